@@ -0,0 +1,70 @@
+'''Space taken by the completion history as log rows and as bitmaps (web/history.py).
+
+Fills a temporary SQLite file with daily habits and a log for every day of their past, builds the
+bitmaps with web.history.build, and compares the bytes on disk (table plus indexes, from dbstat) and
+in memory (the objects loaded to compute the progress of one habit) of both representations.
+
+Run from the root of the repo with: python3 -m benchmarks.bench_history
+'''
+import os
+import random
+import tempfile
+import timeit
+import tracemalloc
+from datetime import datetime, timedelta
+from web import create_app, db
+from web import history
+from web.models import User, Habit, Log
+from web.progress import completed_dates
+
+HABITS = 200
+DAYS = 3 * 365
+
+def fill():
+    rng = random.Random(162)
+    created = datetime.combine(datetime.today() - timedelta(days=DAYS), datetime.min.time())
+    db.session.add(User(username='bench', password='bench'))
+    db.session.bulk_insert_mappings(Habit, [
+        {'user_id': 1, 'title': f'habit {i}', 'frequency': 'daily', 'date_created': created, 'last_modified': created, 'active': True}
+        for i in range(HABITS)
+    ])
+    for habit_id in range(1, HABITS + 1):
+        db.session.bulk_insert_mappings(Log, [
+            {'user_id': 1, 'habit_id': habit_id, 'date': created + timedelta(days=i), 'status': rng.random() < 0.8}
+            for i in range(DAYS)
+        ])
+    db.session.commit()
+
+def allocated(load):
+    '''Bytes still allocated by what load() returns'''
+    tracemalloc.start()
+    kept = load()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return size
+
+def main():
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path})
+    with app.app_context():
+        db.create_all()
+        fill()
+        history.build()
+        storage = history.storage_report()
+
+        print(f'{HABITS} daily habits over {DAYS} days')
+        print('{:>8} {:>10} {:>14} {:>18} {:>20}'.format('storage', 'rows', 'disk (bytes)', 'memory / habit', 'load / habit (ms)'))
+        print('{:>8} {:>10} {:>14} {:>18} {:>20.3f}'.format('logs', storage.log_rows, storage.log_disk_bytes or 0,
+            allocated(lambda: Log.query.filter_by(habit_id=1, status=True).all()),
+            timeit.timeit(lambda: completed_dates(1), number=20) / 20 * 1000))
+        db.session.expunge_all()
+        habit = Habit.query.get(1)
+        print('{:>8} {:>10} {:>14} {:>18} {:>20.3f}'.format('bitmaps', storage.history_rows, storage.history_disk_bytes or 0,
+            allocated(lambda: history.load(habit)),
+            timeit.timeit(lambda: history.load(habit).count(), number=20) / 20 * 1000))
+        db.drop_all()
+    os.remove(path)
+
+if __name__ == '__main__':
+    main()
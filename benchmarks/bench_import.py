@@ -0,0 +1,52 @@
+'''Time taken to import a large history with web.imports.
+
+Writes an NDJSON file of HABITS daily habits with a log for every day of the last DAYS days (about a
+million logs by default) and imports it into a temporary SQLite file.
+
+Run from the root of the repo with: python3 -m benchmarks.bench_import
+'''
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import date, timedelta
+from web import create_app, db
+from web import imports
+from web.models import User
+
+HABITS = 100
+DAYS = 10000
+
+def write_file(path):
+    rng = random.Random(162)
+    first = date.today() - timedelta(days=DAYS)
+    with open(path, 'w') as out:
+        for habit_id in range(1, HABITS + 1):
+            out.write(json.dumps({'record': 'habit', 'id': habit_id, 'title': f'habit {habit_id}', 'frequency': 'daily'}) + '\n')
+            for i in range(DAYS):
+                day = (first + timedelta(days=i)).isoformat()
+                out.write(json.dumps({'record': 'log', 'habit_id': habit_id, 'date': day, 'status': rng.random() < 0.8}) + '\n')
+
+def main():
+    directory = tempfile.mkdtemp()
+    source, database = os.path.join(directory, 'import.ndjson'), os.path.join(directory, 'bench.db')
+    write_file(source)
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + database})
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(username='bench', password='bench'))
+        db.session.commit()
+
+        start = time.perf_counter()
+        with open(source, 'rb') as file:
+            summary = imports.import_file(1, file)
+        db.session.commit()
+        elapsed = time.perf_counter() - start
+        print(f'Imported {summary.habits} habits and {summary.logs} logs in {elapsed:.1f} s ({summary.logs / elapsed:,.0f} logs / s)')
+        db.drop_all()
+    os.remove(source)
+    os.remove(database)
+
+if __name__ == '__main__':
+    main()
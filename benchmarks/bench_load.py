@@ -0,0 +1,105 @@
+'''Throughput of the production server as the number of worker processes grows.
+
+Fills a temporary SQLite file with benchmarks.datagen, then for every count of --workers starts
+`gunicorn -c gunicorn.conf.py web.wsgi:app` on it and keeps --clients client processes busy for
+--duration seconds. Each client logs in as a random user and opens the dashboards of random past
+days, one request at a time. Throughput should grow with the workers until they use all the cores;
+the clients run on the same machine and take some of the cores too.
+
+Needs gunicorn (requirements.txt). Run from the root of the repo with, e.g.:
+    python3 -m benchmarks.bench_load --workers 1 2 4 8 --clients 16 --duration 20
+'''
+import argparse
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from http.cookiejar import CookieJar
+from urllib.error import URLError
+from urllib.parse import urlencode
+from urllib.request import build_opener, HTTPCookieProcessor
+from web import create_app, db
+from benchmarks import datagen
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_server(workers, threads, port, database):
+    env = dict(os.environ, WEB_CONCURRENCY=str(workers), WEB_THREADS=str(threads), WEB_BIND=f'127.0.0.1:{port}',
+        SQLALCHEMY_DATABASE_URI=database)
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'web.wsgi:app'], env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            build_opener().open(f'http://127.0.0.1:{port}/login').read()
+            return server
+        except (URLError, ConnectionError):
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError('gunicorn did not start')
+
+def client(job):
+    '''Requests dashboards until the deadline and returns the latency of each in ms'''
+    url, users, days, deadline, seed = job
+    rng = random.Random(seed)
+    opener = build_opener(HTTPCookieProcessor(CookieJar()))
+    data = urlencode({'username': f'user{rng.randint(1, users)}', 'password': datagen.PASSWORD}).encode()
+    opener.open(url + '/login', data).read()
+    latencies = []
+    while time.monotonic() < deadline:
+        day = date.today() - timedelta(days=rng.randint(1, days - 1))
+        start = time.perf_counter()
+        opener.open(f'{url}/dashboard/{day}').read()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+def run(args, workers, database, pool):
+    port = free_port()
+    server = start_server(workers, args.threads, port, database)
+    try:
+        deadline = time.monotonic() + args.duration
+        jobs = [(f'http://127.0.0.1:{port}', args.users, args.days, deadline, args.seed + i) for i in range(args.clients)]
+        latencies = [latency for result in pool.map(client, jobs) for latency in result]
+    finally:
+        server.send_signal(signal.SIGTERM) # graceful shutdown
+        server.wait()
+    return len(latencies) / args.duration, statistics.median(latencies), statistics.quantiles(latencies, n=20)[-1]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help='worker counts to try')
+    parser.add_argument('--threads', type=int, default=1, help='threads per worker')
+    parser.add_argument('--clients', type=int, default=8, help='concurrent client processes')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per worker count')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--habits', type=int, default=5)
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--seed', type=int, default=162)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    database = 'sqlite:///' + path
+    with create_app({'SQLALCHEMY_DATABASE_URI': database}).app_context():
+        db.create_all()
+        logs = datagen.generate(args.users, args.habits, args.days, seed=args.seed)
+    print(f'{args.users} users, {args.users * args.habits} habits, {logs} logs, {args.clients} clients, {os.cpu_count()} cores')
+
+    print('{:>8} {:>8} {:>14} {:>14} {:>12}'.format('workers', 'threads', 'requests / s', 'median (ms)', 'p95 (ms)'))
+    with multiprocessing.Pool(args.clients) as pool:
+        for workers in args.workers:
+            throughput, median, p95 = run(args, workers, database, pool)
+            print('{:>8} {:>8} {:>14.1f} {:>14.2f} {:>12.2f}'.format(workers, args.threads, throughput, median, p95))
+    os.remove(path)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+'''Time and memory taken by the milestone reminders as the number of milestones grows.
+
+Fills a temporary SQLite file with milestones spread over the next year for USERS users, then times
+reminders.send_reminders() over a week into the null sink and traces the memory it allocates.
+
+Run from the root of the repo with: python3 -m benchmarks.bench_reminders
+'''
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+from web import create_app, db
+from web import reminders
+from web.models import User, Habit, Milestone
+
+USERS = 10000
+SIZES = [100000, 1000000]
+
+def fill(milestones, rng):
+    '''Adds milestones to the habits of the users (one each), with deadlines over the next year'''
+    start = db.session.query(db.func.count(Milestone.id)).scalar()
+    today = date.today()
+    for first in range(start, milestones, 100000):
+        db.session.bulk_insert_mappings(Milestone, [{'user_id': user_id, 'habit_id': user_id, 'text': 'milestone', 'type': 'custom',
+            'deadline': today + timedelta(days=rng.randint(0, 364)), 'complete': rng.random() < 0.3}
+            for user_id in (rng.randint(1, USERS) for _ in range(first, min(first + 100000, milestones)))])
+        db.session.commit()
+
+def main():
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    rng = random.Random(162)
+    with create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path}).app_context():
+        db.create_all()
+        db.session.bulk_insert_mappings(User, [{'id': i, 'username': f'user{i}', 'password': '-'} for i in range(1, USERS + 1)])
+        db.session.bulk_insert_mappings(Habit, [{'id': i, 'user_id': i, 'title': 'habit', 'frequency': 'daily', 'active': True} for i in range(1, USERS + 1)])
+        db.session.commit()
+
+        print('{:>12} {:>10} {:>10} {:>10} {:>14}'.format('milestones', 'users', 'reminders', 'time (s)', 'peak memory'))
+        for size in SIZES:
+            fill(size, rng)
+            tracemalloc.start()
+            start = time.perf_counter()
+            users, sent = reminders.send_reminders(reminders.NullSink(), date.today(), date.today() + timedelta(days=7))
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print('{:>12} {:>10} {:>10} {:>10.2f} {:>12.1f} MB'.format(size, users, sent, elapsed, peak / 1e6))
+        db.drop_all()
+    os.remove(path)
+
+if __name__ == '__main__':
+    main()
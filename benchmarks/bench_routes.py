@@ -0,0 +1,166 @@
+'''Latency and query counts of the hot routes on synthetic data, with a comparison against a saved baseline.
+
+Fills a temporary SQLite file with benchmarks.datagen and times every scenario below through the
+Flask test client, counting the SQL statements each request sends. Save a report with --output on
+the main branch and compare a change against it with --compare: the run fails (exit status 1) if a
+route sends more queries than in the baseline, or if its median latency grew by more than --tolerance.
+
+Run from the root of the repo with, e.g.:
+    python3 -m benchmarks.bench_routes --output baseline.json
+    python3 -m benchmarks.bench_routes --compare baseline.json
+'''
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from sqlalchemy import event
+from web import create_app, db, cache, user_cache
+from web.models import Log
+from benchmarks import datagen
+
+def login(client, user_id):
+    return client.post('/login', data={'username': f'user{user_id}', 'password': datagen.PASSWORD})
+
+def scenarios(args, rng):
+    '''(name, setup, request) for every scenario; setup runs untimed before each request with the test client'''
+    today = date.today()
+
+    def random_user(client):
+        user_id = rng.randint(1, args.users)
+        login(client, user_id)
+        return user_id
+
+    def past_day():
+        return today - timedelta(days=rng.randint(0, args.days - 1))
+
+    def dashboard_cold(client):
+        random_user(client)
+        cache.clear()
+        day = past_day()
+        return lambda: client.get(f'/dashboard/{day}')
+
+    def dashboard_cached(client):
+        random_user(client)
+        day = past_day()
+        client.get(f'/dashboard/{day}')
+        return lambda: client.get(f'/dashboard/{day}')
+
+    def check_off(client):
+        user_id, day = random_user(client), past_day()
+        ids = [str(log_id) for log_id, in db.session.query(Log.id).filter(Log.user_id == user_id, Log.date == datetime.combine(day, datetime.min.time()))]
+        assert ids
+        client.post(f'/dashboard/{day}', data={'undo-done': ids}) # all of them to do, then all checked off at once
+        db.session.remove()
+        return lambda: client.post(f'/dashboard/{day}', data={'done': ids})
+
+    def add_habit(client):
+        random_user(client)
+        return lambda: client.post('/add_habit', data={'title': 'benchmark', 'description': 'added', 'frequency': 'daily'})
+
+    def habit_page(client):
+        user_id = random_user(client)
+        habit_id = (user_id - 1) * args.habits + rng.randint(1, args.habits)
+        return lambda: client.get(f'/habit/{habit_id}')
+
+    def login_request(client):
+        client.get('/logout')
+        user_id = rng.randint(1, args.users)
+        return lambda: login(client, user_id)
+
+    return [
+        ('dashboard GET', dashboard_cold),
+        ('dashboard GET (cached)', dashboard_cached),
+        ('bulk check-off', check_off),
+        ('add_habit', add_habit),
+        ('habit/<id>', habit_page),
+        ('login', login_request),
+    ]
+
+def run(app, args):
+    '''Times the scenarios; each request runs in an app context of its own, like in a worker, so nothing kept in flask.g carries over'''
+    statements = []
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', lambda conn, cursor, statement, *rest: statements.append(statement))
+    rng = random.Random(args.seed)
+    results = {}
+    client = app.test_client()
+    for name, setup in scenarios(args, rng):
+        latencies, queries = [], []
+        for _ in range(args.requests):
+            with app.app_context():
+                request = setup(client)
+                user_cache.clear() # every request loads its user like the first one of a worker would
+                db.session.remove()
+            del statements[:]
+            start = time.perf_counter()
+            response = request()
+            latencies.append((time.perf_counter() - start) * 1000)
+            queries.append(len(statements))
+            assert response.status_code in (200, 302), f'{name}: {response.status_code}'
+        latencies.sort()
+        results[name] = {
+            'median_ms': round(statistics.median(latencies), 3),
+            'p95_ms': round(latencies[int(0.95 * (len(latencies) - 1))], 3),
+            'queries': round(statistics.mean(queries), 2)
+        }
+    return results
+
+def compare(results, baseline, tolerance):
+    '''Prints the change of every route against the baseline and returns the names of the routes that regressed'''
+    regressions = []
+    print('\n{:<24} {:>14} {:>14} {:>10}'.format('compared to baseline', 'median', 'queries', ''))
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        change = result['median_ms'] / before['median_ms'] - 1 if before['median_ms'] else 0
+        regressed = result['queries'] > before['queries'] or change > tolerance
+        print('{:<24} {:>+13.0%} {:>+14.2f} {:>10}'.format(name, change, result['queries'] - before['queries'], 'REGRESSED' if regressed else 'ok'))
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the hot routes on synthetic data.')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--habits', type=int, default=5, help='habits per user')
+    parser.add_argument('--days', type=int, default=365, help='days of history')
+    parser.add_argument('--completion-rate', type=float, default=0.8)
+    parser.add_argument('--requests', type=int, default=50, help='requests per route')
+    parser.add_argument('--seed', type=int, default=162)
+    parser.add_argument('--output', help='save the report as JSON to this file')
+    parser.add_argument('--compare', help='JSON report to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='median latency increase allowed by --compare')
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path, 'TESTING': True})
+    with app.app_context():
+        db.create_all()
+        logs = datagen.generate(args.users, args.habits, args.days, args.completion_rate, args.seed)
+        db.session.remove()
+    print(f'{args.users} users, {args.users * args.habits} habits, {logs} logs, {args.requests} requests per route')
+    results = run(app, args) # outside of any app context, which the requests would reuse
+    with app.app_context():
+        db.drop_all()
+    os.remove(path)
+
+    print('{:<24} {:>14} {:>14} {:>10}'.format('route', 'median (ms)', 'p95 (ms)', 'queries'))
+    for name, result in results.items():
+        print('{:<24} {:>14.3f} {:>14.3f} {:>10.2f}'.format(name, result['median_ms'], result['p95_ms'], result['queries']))
+
+    if args.output:
+        with open(args.output, 'w') as out:
+            json.dump({'parameters': vars(args), 'results': results}, out, indent=2)
+    if args.compare:
+        with open(args.compare) as baseline:
+            if compare(results, json.load(baseline)['results'], args.tolerance):
+                sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+'''Time taken to import the package and to get a new worker to answer its first request.
+
+Each measure runs in a fresh Python process, like a worker being spawned, against the database of
+SQLALCHEMY_DATABASE_URI (see .env):
+    import   `import web`
+    spawn    importing, getting the app and answering a first GET /login
+The time taken to import the dependencies themselves is shown apart.
+
+Run from the root of the repo with: python3 -m benchmarks.bench_startup
+'''
+import statistics
+import subprocess
+import sys
+
+RUNS = 20
+
+# the dependencies are imported before the clock starts, only the app's own work is timed
+IMPORT = '''
+import time
+import flask, flask_sqlalchemy, flask_login, sqlalchemy, dotenv
+start = time.perf_counter()
+import web
+print(time.perf_counter() - start)
+'''
+
+SPAWN = '''
+import time
+import flask, flask_sqlalchemy, flask_login, sqlalchemy, dotenv
+start = time.perf_counter()
+import web
+app = web.app
+assert app.test_client().get('/login').status_code == 200
+print(time.perf_counter() - start)
+'''
+
+BASELINE = '''
+import time
+start = time.perf_counter()
+import flask, flask_sqlalchemy, flask_login, sqlalchemy
+print(time.perf_counter() - start)
+'''
+
+def measure(code):
+    '''Median time in ms reported by code over RUNS fresh processes'''
+    times = [float(subprocess.run([sys.executable, '-c', code], check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout) for _ in range(RUNS)]
+    return statistics.median(times) * 1000
+
+def main():
+    print('{:>24} {:>12}'.format('median of {} runs'.format(RUNS), 'ms'))
+    print('{:>24} {:>12.1f}'.format('import the dependencies', measure(BASELINE)))
+    print('{:>24} {:>12.1f}'.format('import web', measure(IMPORT)))
+    print('{:>24} {:>12.1f}'.format('spawn a worker', measure(SPAWN)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+'''Micro-benchmark of the streak computation done on every check-off.
+
+Compares the nested loop the check-off path used to run (one list of dates rebuilt for every
+candidate day of every milestone) with the single pass of web.streaks.
+
+Run from the root of the repo with: python3 -m benchmarks.bench_streaks
+'''
+import random
+import timeit
+from datetime import date, timedelta
+from web.streaks import compute_streaks
+
+MILESTONES = [3,7,14,30,60]
+
+def history(n_days, completion_rate=0.9, seed=162):
+    '''Sorted completion dates of a daily habit over n_days, ending today'''
+    rng = random.Random(seed)
+    today = date.today()
+    return [today - timedelta(days=i) for i in reversed(range(n_days)) if i == 0 or rng.random() < completion_rate]
+
+def nested_loop(dates, day):
+    '''The original streak check, with dates in place of the re-executed query'''
+    achieved = []
+    for n in MILESTONES:
+        count_logs = 1
+        for i in range(1, n):
+            if day - timedelta(days=i) in [d for d in dates]:
+                count_logs += 1
+        if count_logs == n:
+            achieved.append(n)
+    return achieved
+
+def single_pass(dates, day):
+    streak = compute_streaks(dates, 'daily', as_of=day).current
+    return [n for n in MILESTONES if streak >= n]
+
+def main():
+    print('{:>8} {:>16} {:>16}'.format('days', 'nested loop (ms)', 'single pass (ms)'))
+    for n_days in [30, 365, 3 * 365]:
+        dates = history(n_days)
+        today = dates[-1]
+        assert nested_loop(dates, today) == single_pass(dates, today)
+        runs = 20
+        nested = timeit.timeit(lambda: nested_loop(dates, today), number=runs) / runs * 1000
+        single = timeit.timeit(lambda: single_pass(dates, today), number=runs) / runs * 1000
+        print('{:>8} {:>16.3f} {:>16.3f}'.format(n_days, nested, single))
+
+if __name__ == '__main__':
+    main()
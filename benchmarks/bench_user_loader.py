@@ -0,0 +1,52 @@
+'''How many queries per request the cached user_loader saves.
+
+Logs a user in and requests a few pages with the original loader (one query per request) and with
+the cached one, against an in-memory database.
+
+Run from the root of the repo with: python3 -m benchmarks.bench_user_loader
+'''
+import time
+from sqlalchemy import event
+from werkzeug.security import generate_password_hash
+from web import create_app, db, login_manager, load_user, user_cache
+from web.models import User
+
+PAGES = ['/add_habit', '/archive', '/active_habits', '/api/v1/habits']
+ROUNDS = 50
+
+def uncached_load_user(id):
+    '''The loader before the cache'''
+    return User.query.get(int(id))
+
+def run(client, statements):
+    del statements[:]
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        for page in PAGES:
+            assert client.get(page).status_code == 200
+    elapsed = time.perf_counter() - start
+    requests = ROUNDS * len(PAGES)
+    user_queries = len([s for s in statements if 'FROM user' in s])
+    return len(statements) / requests, user_queries / requests, elapsed / requests * 1000
+
+def main():
+    app = db.app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:', 'SECRET_KEY': 'bench'})
+    with app.test_client() as client:
+        db.create_all()
+        db.session.add(User(username='bench', password=generate_password_hash('bench', method='sha256')))
+        db.session.commit()
+        client.post('/login', data={'username': 'bench', 'password': 'bench'})
+
+        statements = []
+        event.listen(db.engine, 'before_cursor_execute', lambda conn, cursor, statement, *args: statements.append(statement))
+
+        print('{:>10} {:>18} {:>22} {:>16}'.format('loader', 'queries / request', 'user queries / request', 'ms / request'))
+        login_manager.user_loader(uncached_load_user)
+        print('{:>10} {:>18.2f} {:>22.2f} {:>16.3f}'.format('uncached', *run(client, statements)))
+        login_manager.user_loader(load_user)
+        user_cache.clear()
+        print('{:>10} {:>18.2f} {:>22.2f} {:>16.3f}'.format('cached', *run(client, statements)))
+        db.drop_all()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+'''Synthetic users, habits and history for the benchmarks.
+
+Every user gets the same password (PASSWORD) and habits_per_user habits created `days` days ago,
+mostly daily with some weekly and monthly ones, with a log for every day they were due. Each log
+is completed with probability completion_rate. Progress records and the default milestones
+reached are filled in as the app would have, so every page works on the data.
+
+Run from the root of the repo to fill the database of SQLALCHEMY_DATABASE_URI, e.g.:
+    python3 -m benchmarks.datagen --users 100 --habits 5 --days 365 --completion-rate 0.8
+'''
+import argparse
+import random
+from datetime import date, datetime, time, timedelta
+from werkzeug.security import generate_password_hash
+from web import create_app, db
+from web import schedule, milestones
+from web.models import User, Habit, Log, HabitProgress
+from web.progress import progress_values
+
+PASSWORD = 'benchmark'
+FREQUENCIES = ['daily'] * 8 + ['weekly', 'monthly']
+
+def generate(users=100, habits_per_user=5, days=365, completion_rate=0.8, seed=162):
+    '''Adds the users with their habits and history, committing after each user. Returns the number of logs created.'''
+    rng = random.Random(seed)
+    password = generate_password_hash(PASSWORD, method='sha256') # hashing is slow on purpose, do it once
+    created = datetime.combine(date.today() - timedelta(days=days), time.min)
+    first_user = (db.session.query(db.func.max(User.id)).scalar() or 0) + 1
+    logs = 0
+
+    for user_id in range(first_user, first_user + users):
+        db.session.add(User(id=user_id, username=f'user{user_id}', password=password))
+        habits = [Habit(user_id=user_id, title=f'habit {i + 1}', description='generated', frequency=rng.choice(FREQUENCIES),
+            date_created=created, last_modified=created, active=True) for i in range(habits_per_user)]
+        db.session.add_all(habits)
+        db.session.flush()
+
+        new_logs, completed = [], {habit.id: [] for habit in habits}
+        for habit_id, day in schedule.due_pairs(habits, created, date.today()):
+            done = rng.random() < completion_rate
+            new_logs.append({'user_id': user_id, 'habit_id': habit_id, 'date': datetime.combine(day, time.min), 'status': done})
+            if done:
+                completed[habit_id].append(day)
+        db.session.bulk_insert_mappings(Log, new_logs)
+        logs += len(new_logs)
+
+        for habit in habits:
+            values = progress_values(completed[habit.id], habit.frequency)
+            db.session.add(HabitProgress(habit_id=habit.id, user_id=user_id, **values))
+        milestones.complete_reached(user_id)
+        db.session.commit()
+    return logs
+
+def main():
+    parser = argparse.ArgumentParser(description='Fills the database with synthetic users, habits and logs.')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--habits', type=int, default=5, help='habits per user')
+    parser.add_argument('--days', type=int, default=365, help='days of history')
+    parser.add_argument('--completion-rate', type=float, default=0.8)
+    parser.add_argument('--seed', type=int, default=162)
+    args = parser.parse_args()
+    with create_app().app_context():
+        db.create_all()
+        logs = generate(args.users, args.habits, args.days, args.completion_rate, args.seed)
+    print(f'Created {args.users} users, {args.users * args.habits} habits and {logs} logs')
+
+if __name__ == '__main__':
+    main()
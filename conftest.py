@@ -1,24 +1,20 @@
 import pytest
-from web import app, db, login_manager
+from sqlalchemy import event
+import web
+from web import create_app, db, cache, user_cache
+
+# one app for the whole session, installed as web.app so that the tests can import it
+app = web.app = create_app({
+	'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+	'TESTING': True,
+	'SECRET_KEY': 'test_key',
+})
+db.app = app # lets the tests query the database outside of requests
 
 
 @pytest.fixture
 def client():
-	'''
-	This is an extremely simplified configuration for testing. I spent some hours trying to learn how 
-	this can be improved:
-		1. Most configurations first rely on having a create_app function for the main app while we don't currently have one. 
-		2. After applying that, it seems useful to separate the client creation from the db setup, and then define a session-level setting that allows each test to run with a separate db whereas it is not the case with this configuration. We basically use our app but change its config to use a temporary db.
-		3. Also, using a temp file as it was before did not work for me, it kept using our original db or throw errors. 
-		4. I am not sure the teardown is clean here, since os.unlink(app.config['SQL..']) did not work when this is set to theh in-memory DB. So that might be another point for importvement. 
-		
-	For now I proceeded with creating some tests until someone else gets to have a look or I manage to learn a bit more.
-	'''
-	
-	app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
-	app.config['TESTING'] = True
-	app.config['SECRET_KEY'] = 'test_key'
-
+	'''A test client of the app, on a fresh in-memory database'''
 	with app.test_client() as client:
 		db.create_all()
 		yield client
@@ -28,4 +24,18 @@ def client():
 def reset_db(scope='function'):
 	'''A crude and probably imperfect way to reset the DB between consecutive tests'''
 	db.drop_all()
-	db.create_all()
\ No newline at end of file
+	db.create_all()
+	cache.clear() # cached pages of the previous test's users
+	user_cache.clear()
+
+@pytest.fixture
+def count_queries(client):
+	'''Collects every SQL statement sent to the test database while the test runs'''
+	statements = []
+
+	def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+		statements.append(statement)
+
+	event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+	yield statements
+	event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
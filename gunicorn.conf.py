@@ -0,0 +1,41 @@
+'''Settings of the production server, from the environment (and .env):
+    gunicorn -c gunicorn.conf.py web.wsgi:app
+
+    WEB_BIND              address to listen on (default 0.0.0.0:5000)
+    WEB_CONCURRENCY       worker processes (default 2 x cores + 1)
+    WEB_THREADS           threads per worker (default 1); with more, the workers are gthread workers
+    WEB_PRELOAD           import the app once in the master, before forking the workers (default true)
+    WEB_TIMEOUT           seconds after which a stuck worker is killed and replaced (default 30)
+    WEB_GRACEFUL_TIMEOUT  seconds workers get to finish their requests when stopped or reloaded (default 30)
+    WEB_MAX_REQUESTS      requests after which a worker is replaced, 0 for never (default 0)
+
+`kill -HUP <master pid>` reloads gracefully: new workers are started with the new settings and the
+old ones stop once their requests are answered. With WEB_PRELOAD the code was imported by the master,
+so new code is only picked up by a new master: `kill -USR2 <master pid>`, then `kill -QUIT` the old one.
+'''
+import multiprocessing
+import os
+import tempfile
+from dotenv import load_dotenv
+load_dotenv()
+
+bind = os.getenv('WEB_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('WEB_CONCURRENCY') or multiprocessing.cpu_count() * 2 + 1)
+threads = int(os.getenv('WEB_THREADS', 1))
+preload_app = os.getenv('WEB_PRELOAD', 'true').lower() != 'false'
+timeout = int(os.getenv('WEB_TIMEOUT', 30))
+graceful_timeout = int(os.getenv('WEB_GRACEFUL_TIMEOUT', 30))
+max_requests = int(os.getenv('WEB_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10 # so that the workers are not all replaced at once
+
+# /metrics adds up the numbers of every worker through a shared directory (see web/monitoring.py)
+if not os.getenv('METRICS_DIR'):
+    os.environ['METRICS_DIR'] = tempfile.mkdtemp(prefix='habit-metrics-')
+
+def worker_exit(server, worker):
+    '''Writes the last numbers of a worker that stops, e.g. on a reload, so that /metrics keeps them'''
+    from web import metrics
+    from web.wsgi import app
+    with app.app_context():
+        if app.config['METRICS']:
+            metrics.dump()
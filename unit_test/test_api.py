@@ -0,0 +1,143 @@
+import pytest
+from web import app, db, login_manager, api
+from web.models import User, Habit, Log, Milestone
+from datetime import date, timedelta
+from werkzeug.security import generate_password_hash, check_password_hash
+
+def create_db_user(username,password):
+	'''Inserts a test user to the db'''
+	db.session.add(User(username=username, password=generate_password_hash(password, method='sha256')))
+	db.session.commit()
+
+def login_user(client,username,password):
+	client.post('/login', data={'username' : username, 'password' : password})
+
+@pytest.fixture
+def api_client(client, reset_db):
+	'''A client logged in as test_user'''
+	create_db_user('test_user', 'test_password')
+	login_user(client, 'test_user', 'test_password')
+	return client
+
+def test_requires_login(client, reset_db):
+	'''The API answers 401 instead of redirecting to the login page'''
+	rv = client.get('/api/v1/habits')
+	assert rv.status_code == 401
+	assert rv.get_json() == {'error': 'Authentication required'}
+
+def test_habit_crud(api_client):
+	'''Habits can be added, read, updated and deleted'''
+	rv = api_client.post('/api/v1/habits', json={'title': 'read', 'description': 'a book', 'frequency': 'weekly'})
+	assert rv.status_code == 201
+	habit_id = rv.get_json()['id']
+	assert Milestone.query.filter_by(habit_id=habit_id).count() == 0 # like add_habit, defaults are stored once reached
+	assert Log.query.filter_by(habit_id=habit_id).count() == 1
+
+	assert api_client.post('/api/v1/habits', json={'title': 'x', 'frequency': 'hourly'}).status_code == 400
+	assert api_client.post('/api/v1/habits', json={'description': 'no title'}).status_code == 400
+
+	habit = api_client.get('/api/v1/habits/{}'.format(habit_id)).get_json()
+	assert habit['title'] == 'read' and habit['frequency'] == 'weekly'
+	assert habit['progress']['total_completions'] == 0
+
+	rv = api_client.patch('/api/v1/habits/{}'.format(habit_id), json={'title': 'read more', 'active': False})
+	assert rv.status_code == 200
+	assert [h['title'] for h in api_client.get('/api/v1/habits?active=false').get_json()['habits']] == ['read more']
+	assert api_client.get('/api/v1/habits?active=true').get_json()['habits'] == []
+
+	assert api_client.delete('/api/v1/habits/{}'.format(habit_id)).status_code == 204
+	assert Habit.query.get(habit_id) is None
+	assert api_client.get('/api/v1/habits/{}'.format(habit_id)).status_code == 404
+
+def test_logs_and_check_off(api_client):
+	'''Logs of a date range are returned per day and can be checked off and unchecked'''
+	api_client.post('/api/v1/habits', json={'title': 'run', 'frequency': 'daily'})
+	today = date.today()
+
+	days = api_client.get('/api/v1/logs?start={}&end={}'.format(today, today + timedelta(days=2))).get_json()['days']
+	assert [day['date'] for day in days] == [str(today + timedelta(days=i)) for i in range(3)]
+	assert [len(day['habits']) for day in days] == [1, 1, 1] # the next days were materialized
+	log_id = days[0]['habits'][0]['log']['id']
+
+	rv = api_client.post('/api/v1/logs/done', json={'date': str(today), 'log_ids': [log_id]})
+	assert rv.get_json()['habit_ids'] == [1]
+	day = api_client.get('/api/v1/logs?date={}'.format(today)).get_json()['days'][0]
+	assert day['count'] == {'completed': 1, 'todo': 0}
+
+	api_client.post('/api/v1/logs/undo', json={'date': str(today), 'log_ids': [log_id]})
+	assert Log.query.get(log_id).status is False
+
+	assert api_client.get('/api/v1/logs?date=yesterday').status_code == 400
+	assert api_client.post('/api/v1/logs/done', json={'log_ids': [log_id]}).status_code == 400
+
+def test_etag_conditional_get(api_client, count_queries):
+	'''Unchanged data answers 304 after reading the data version only, any write changes the ETag'''
+	api_client.post('/api/v1/habits', json={'title': 'run', 'frequency': 'daily'})
+	url = '/api/v1/logs?date={}'.format(date.today())
+	rv = api_client.get(url)
+	etag = rv.headers['ETag']
+
+	del count_queries[:]
+	rv = api_client.get(url, headers={'If-None-Match': etag})
+	assert rv.status_code == 304
+	assert rv.headers['ETag'] == etag
+	assert len(count_queries) == 1 # the version of the user's data
+
+	assert api_client.get('/api/v1/habits', headers={'If-None-Match': etag}).status_code == 200 # another resource
+
+	log_id = Log.query.first().id
+	api_client.post('/dashboard/{}'.format(date.today()), data={'done': [str(log_id)]}) # a write through the html page
+	rv = api_client.get(url, headers={'If-None-Match': etag})
+	assert rv.status_code == 200
+	assert rv.headers['ETag'] != etag
+
+def test_history(api_client, count_queries):
+	'''A year of completions per day from one query, served from the cache until the data changes'''
+	api_client.post('/api/v1/habits', json={'title': 'run', 'frequency': 'daily'})
+	api_client.post('/api/v1/habits', json={'title': 'read', 'frequency': 'daily'})
+	today = date.today()
+	for habit_id in (1, 2):
+		db.session.add(Log(user_id=1, habit_id=habit_id, date=today - timedelta(days=2), status=True))
+	db.session.add(Log(user_id=1, habit_id=1, date=today - timedelta(days=400), status=True)) # out of range
+	db.session.commit()
+
+	del count_queries[:]
+	history = api_client.get('/api/v1/history').get_json()
+	assert history['start'] == str(today - timedelta(days=364)) and history['end'] == str(today)
+	assert len(history['completed']) == len(history['scheduled']) == 365
+	assert history['completed'][-3:] == [2, 0, 0]
+	assert history['scheduled'][-3:] == [2, 0, 2] # today's logs were added with the habits
+	assert sum(history['completed']) == 2
+	assert len([q for q in count_queries if 'FROM log' in q]) == 1
+
+	del count_queries[:]
+	assert api_client.get('/api/v1/history').get_json() == history
+	assert len(count_queries) == 1 # the version of the user's data, the body comes from the cache
+
+	habit = api_client.get('/api/v1/habits/1/history?end={}'.format(today - timedelta(days=1))).get_json()
+	assert habit['habit_id'] == 1 and habit['completed'][-2:] == [1, 0]
+	assert api_client.get('/api/v1/habits/3/history').status_code == 404
+	assert api_client.get('/api/v1/history?end=today').status_code == 400
+
+	log_id = Log.query.filter_by(habit_id=1).order_by(Log.date.desc()).first().id # today's
+	api_client.post('/api/v1/logs/done', json={'date': str(today), 'log_ids': [log_id]})
+	assert api_client.get('/api/v1/history').get_json()['completed'][-1] == 1
+
+def test_history_changes_at_midnight(api_client, monkeypatch):
+	'''Without ?end= the history ends today, so the next day neither the ETag nor the cached body is reused'''
+	api_client.post('/api/v1/habits', json={'title': 'run', 'frequency': 'daily'})
+	rv = api_client.get('/api/v1/history')
+	etag = rv.headers['ETag']
+	assert api_client.get('/api/v1/history', headers={'If-None-Match': etag}).status_code == 304
+
+	class Tomorrow(date):
+		@classmethod
+		def today(cls):
+			return date.today() + timedelta(days=1)
+	monkeypatch.setattr(api, 'date', Tomorrow)
+	rv = api_client.get('/api/v1/history', headers={'If-None-Match': etag})
+	assert rv.status_code == 200 and rv.headers['ETag'] != etag
+	assert rv.get_json()['end'] == str(date.today() + timedelta(days=1))
+
+	explicit = '/api/v1/history?end={}'.format(date.today())
+	assert api_client.get(explicit).headers['ETag'] == api_client.get(explicit).headers['ETag']
@@ -0,0 +1,158 @@
+import pytest
+from web import app, create_app, db, login_manager, cache, user_cache, progress
+from web.cache import LRUCache, NullCache, MISSING
+from web.models import User, Habit, Log, touch_users
+from datetime import date, datetime
+from werkzeug.security import generate_password_hash, check_password_hash
+
+def create_db_user(username,password):
+	'''Inserts a test user to the db'''
+	db.session.add(User(username=username, password=generate_password_hash(password, method='sha256')))
+	db.session.commit()
+
+def login_user(client,username,password):
+	client.post('/login', data={'username' : username, 'password' : password})
+
+def test_lru_size_limit():
+	'''The least recently used entry is evicted first'''
+	lru = LRUCache(maxsize=2, ttl=60)
+	lru.set('a', 1)
+	lru.set('b', 2)
+	assert lru.get('a') == 1 # a is now more recent than b
+	lru.set('c', 3)
+	assert lru.get('b') is MISSING
+	assert lru.get('a') == 1 and lru.get('c') == 3
+	assert len(lru) == 2 and lru.evictions == 1
+
+def test_lru_ttl():
+	'''Expired entries are not returned'''
+	lru = LRUCache(maxsize=2, ttl=-1)
+	lru.set('a', 1)
+	assert lru.get('a') is MISSING
+
+def test_invalidate_user():
+	'''Invalidating a user drops all of their entries and only theirs'''
+	other = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:', 'SECRET_KEY': 'test_key'}) # with a cache of its own
+	with other.app_context():
+		cache.set(1, 'dashboard', 'monday', value='x')
+		cache.set(1, 'dashboard', 'tuesday', value='y')
+		cache.set(2, 'dashboard', 'monday', value='z')
+		cache.invalidate_user(1)
+		assert cache.get(1, 'dashboard', 'monday') is MISSING
+		assert cache.get(1, 'dashboard', 'tuesday') is MISSING
+		assert cache.get(2, 'dashboard', 'monday') == 'z'
+		assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 2
+
+def test_apps_have_their_own_caches():
+	'''Creating another app leaves the caches of the first one alone'''
+	other = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:', 'SECRET_KEY': 'test_key', 'CACHE_BACKEND': 'null', 'USER_CACHE_MAX_SIZE': 1})
+	with other.app_context():
+		assert isinstance(cache.backend, NullCache) and user_cache.maxsize == 1
+	with app.app_context():
+		assert isinstance(cache.backend, LRUCache) and user_cache.maxsize == app.config['USER_CACHE_MAX_SIZE']
+
+def test_dashboard_is_cached(client, reset_db, count_queries):
+	'''Reloading the dashboard reuses the cached data until a write changes it'''
+	create_db_user('test_user', 'test_password')
+	login_user(client, 'test_user', 'test_password')
+	client.post('/add_habit', data={'title' : 'test_habit', 'description' : '', 'frequency' : 'daily'})
+	url = '/dashboard/{}'.format(date.today())
+
+	client.get(url)
+	del count_queries[:]
+	hits = cache.hits
+	rv = client.get(url)
+	assert cache.hits == hits + 1
+	assert len(count_queries) == 1 # the user's data version; the user comes from the user cache
+	assert b'["Done", "0"]' in rv.data
+
+	client.post(url, data={'done': ['1']}) # check-off bumps the data version
+	assert b'["Done", "1"]' in client.get(url).data
+
+	client.post('/add_habit', data={'title' : 'second_habit', 'description' : '', 'frequency' : 'daily'})
+	assert b'second_habit' in client.get(url).data
+
+	client.post('/habit/2/edit', data={'title' : 'renamed_habit'})
+	assert b'renamed_habit' in client.get(url).data
+
+	client.post('/habit/2/edit', data={'archive' : 'archive'})
+	assert b'renamed_habit' not in client.get(url).data
+
+def test_write_from_elsewhere_is_seen(client, reset_db):
+	'''A write that doesn't invalidate this cache, e.g. made by another worker or a command, still shows up'''
+	create_db_user('test_user', 'test_password')
+	login_user(client, 'test_user', 'test_password')
+	client.post('/add_habit', data={'title' : 'test_habit', 'description' : '', 'frequency' : 'daily'})
+	url = '/dashboard/{}'.format(date.today())
+	assert b'["Done", "0"]' in client.get(url).data
+
+	progress.check_off(1, ['1'], datetime.combine(date.today(), datetime.min.time()))
+	Habit.query.get(1).title = 'renamed_habit'
+	touch_users([1])
+	db.session.commit()
+	rv = client.get(url)
+	assert b'["Done", "1"]' in rv.data
+	assert b'renamed_habit' in rv.data
+
+def test_cache_stats_endpoint(client, reset_db):
+	'''Cache counters are only exposed when asked for'''
+	create_db_user('test_user', 'test_password')
+	login_user(client, 'test_user', 'test_password')
+	assert client.get('/api/v1/stats/cache').status_code == 404
+	app.config['EXPOSE_CACHE_STATS'] = True
+	try:
+		assert set(client.get('/api/v1/stats/cache').get_json()) == {'hits', 'misses', 'hit_ratio', 'size', 'evictions'}
+	finally:
+		app.config['EXPOSE_CACHE_STATS'] = False
+
+def test_sidebar_is_cached(client, reset_db, count_queries):
+	'''The sidebar habit list is queried once and refreshed when habits change'''
+	create_db_user('test_user', 'test_password')
+	login_user(client, 'test_user', 'test_password')
+	client.post('/add_habit', data={'title' : 'first_habit', 'description' : '', 'frequency' : 'daily'})
+	client.post('/add_habit', data={'title' : 'second_habit', 'description' : '', 'frequency' : 'daily'})
+
+	def sidebar_queries():
+		return [q for q in count_queries if q.startswith('SELECT habit.id AS habit_id, habit.title AS habit_title \nFROM habit')]
+
+	del count_queries[:]
+	client.get('/habit/1')
+	client.get('/habit/2')
+	client.get('/habit/1/edit')
+	rv = client.get('/add_habit')
+	assert len(sidebar_queries()) == 1
+	assert b'first_habit' in rv.data and b'second_habit' in rv.data
+
+	client.post('/habit/2/edit', data={'title' : 'renamed_habit'})
+	assert b'renamed_habit' in client.get('/habit/1').data
+	client.post('/habit/2/edit', data={'archive' : 'archive'})
+	assert b'renamed_habit' not in client.get('/habit/1').data
+	client.post('/habit/2/edit', data={'unarchive' : 'unarchive'})
+	assert b'renamed_habit' in client.get('/habit/1').data
+	client.post('/habit/2/edit', data={'delete' : 'delete'})
+	assert b'renamed_habit' not in client.get('/habit/1').data
+
+def test_user_loader_is_cached(client, reset_db, count_queries):
+	'''Authenticated requests reuse the cached user until it changes or logs out'''
+	from web import user_cache
+	create_db_user('test_user', 'test_password')
+	login_user(client, 'test_user', 'test_password')
+
+	def user_queries():
+		return [q for q in count_queries if 'user.username' in q] # not the data version lookups
+
+	client.get('/add_habit')
+	del count_queries[:]
+	rv = client.get('/add_habit')
+	assert rv.status_code == 200
+	assert user_queries() == []
+
+	user = User.query.get(1)
+	user.username = 'renamed_user'
+	db.session.commit() # any change to the user drops it from the cache
+	assert len(user_cache) == 0
+	client.get('/add_habit')
+	assert len(user_queries()) == 1 and len(user_cache) == 1
+
+	client.get('/logout')
+	assert len(user_cache) == 0
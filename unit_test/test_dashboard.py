@@ -0,0 +1,92 @@
+import pytest
+from web import app, db, login_manager
+from web.models import User, Habit, Log
+from datetime import datetime, date, timedelta
+from werkzeug.security import generate_password_hash, check_password_hash
+
+def create_db_user(username,password):
+	'''Inserts a test user to the db and returns it'''
+	user = User(username=username, password=generate_password_hash(password, method='sha256'))
+	db.session.add(user)
+	db.session.commit()
+	return user
+
+def create_db_habits(user, n, frequency='daily'):
+	'''Inserts n active habits created yesterday for the user'''
+	yesterday = datetime.today() - timedelta(days=1)
+	for i in range(n):
+		db.session.add(Habit(user_id=user.id, title='habit_{}'.format(i), frequency=frequency, date_created=yesterday, last_modified=yesterday, active=True))
+	db.session.commit()
+
+def login_user(client,username,password):
+	client.post('/login', data={'username' : username, 'password' : password})
+
+def test_dashboard_materializes_missing_logs(client, reset_db):
+	'''Opening the dashboard creates one log per due habit and does not duplicate them on reload'''
+	user = create_db_user('test_user', 'test_password')
+	create_db_habits(user, 3)
+	create_db_habits(user, 2, frequency='weekly') # not due today
+	login_user(client, 'test_user', 'test_password')
+
+	client.get('/dashboard/{}'.format(date.today()))
+	assert Log.query.count() == 3 # one log for each daily habit
+
+	client.get('/dashboard/{}'.format(date.today()))
+	assert Log.query.count() == 3 # reloading does not add logs
+
+def test_dashboard_query_count_is_constant(client, reset_db, count_queries):
+	'''The number of queries run by the dashboard does not grow with the number of habits'''
+	few = create_db_user('few_habits', 'test_password')
+	many = create_db_user('many_habits', 'test_password')
+	create_db_habits(few, 2)
+	create_db_habits(many, 40)
+	many_id = many.id
+
+	login_user(client, 'few_habits', 'test_password')
+	del count_queries[:]
+	client.get('/dashboard/{}'.format(date.today()))
+	few_queries = len(count_queries)
+	client.get('/logout')
+
+	login_user(client, 'many_habits', 'test_password')
+	del count_queries[:]
+	client.get('/dashboard/{}'.format(date.today()))
+	many_queries = len(count_queries)
+
+	assert Log.query.filter_by(user_id=many_id).count() == 40 # all logs were created
+	assert few_queries == many_queries
+
+def test_dashboard_counts_only_the_users_logs(client, reset_db, count_queries):
+	'''Completed/todo counts come from one aggregate query over the current user's logs'''
+	user = create_db_user('test_user', 'test_password')
+	other = create_db_user('other_user', 'test_password')
+	create_db_habits(user, 3)
+	create_db_habits(other, 4)
+	today = datetime.combine(date.today(), datetime.min.time())
+	for habit in Habit.query.all():
+		db.session.add(Log(user_id=habit.user_id, habit_id=habit.id, date=today, status=habit.id in (1, 4, 5)))
+	db.session.commit()
+
+	login_user(client, 'test_user', 'test_password')
+	del count_queries[:]
+	rv = client.get('/dashboard/{}'.format(date.today()))
+	assert b'["ToDo", "2"]' in rv.data
+	assert b'["Done", "1"]' in rv.data
+	assert b'habit_3' not in rv.data and rv.data.count(b'habit_') == 6 # sidebar and list only show the user's 3 habits
+	assert len([q for q in count_queries if 'GROUP BY' in q and 'count(' in q]) == 1
+
+def test_dashboard_counts_only_active_habits(client, reset_db):
+	'''The logs of archived habits are neither listed nor counted'''
+	user = create_db_user('test_user', 'test_password')
+	create_db_habits(user, 3)
+	today = datetime.combine(date.today(), datetime.min.time())
+	for habit in Habit.query.all():
+		db.session.add(Log(user_id=user.id, habit_id=habit.id, date=today, status=habit.id == 1))
+	Habit.query.get(1).active = False
+	Habit.query.get(2).active = False
+	db.session.commit()
+
+	login_user(client, 'test_user', 'test_password')
+	rv = client.get('/dashboard/{}'.format(date.today()))
+	assert b'["ToDo", "1"]' in rv.data
+	assert b'["Done", "0"]' in rv.data
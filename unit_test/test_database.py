@@ -0,0 +1,124 @@
+import pytest
+import sqlite3
+import threading
+from web import create_app, db
+from web.models import User, Habit, Log, Milestone, HabitProgress
+from web import progress
+from web.progress import new_progress
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+from datetime import datetime, date, timedelta
+from werkzeug.security import generate_password_hash
+
+WRITERS = 8
+DAYS = 24
+HABITS = 3
+
+@pytest.fixture
+def file_app(tmp_path, request):
+	'''An app on a SQLite file with HABITS daily habits of one user, and their logs of the last DAYS days to check off.
+
+	Parametrized indirectly, the param is more config.
+	'''
+	config = {'SQLALCHEMY_DATABASE_URI': 'sqlite:///{}'.format(tmp_path / 'concurrent.db'), 'TESTING': True, 'SECRET_KEY': 'test_key'}
+	file_app = create_app(dict(config, **getattr(request, 'param', {})))
+	with file_app.app_context():
+		db.create_all()
+		db.session.add(User(username='test_user', password=generate_password_hash('test_password', method='sha256')))
+		created = datetime.combine(date.today() - timedelta(days=DAYS), datetime.min.time())
+		habits = [Habit(user_id=1, title='habit {}'.format(i), frequency='daily', date_created=created, active=True) for i in range(HABITS)]
+		db.session.add_all(habits)
+		db.session.flush()
+		for habit in habits:
+			db.session.add(new_progress(habit))
+			db.session.add_all(Log(user_id=1, habit_id=habit.id, date=created + timedelta(days=i), status=False) for i in range(DAYS))
+		db.session.commit()
+	yield file_app
+	with file_app.app_context():
+		db.session.remove()
+		db.get_engine().dispose()
+
+def test_sqlite_profile(file_app):
+	'''Every connection to the file gets the WAL journal, NORMAL synchronous, the busy timeout and the cache size'''
+	with file_app.app_context():
+		pragma = lambda name: db.session.execute('PRAGMA {}'.format(name)).scalar()
+		assert pragma('journal_mode') == 'wal'
+		assert pragma('synchronous') == 1 # NORMAL
+		assert pragma('busy_timeout') == 5000
+		assert pragma('cache_size') == -16384
+
+@pytest.mark.parametrize('file_app, wal', [
+	({}, True),
+	({'SQLITE_TUNING': False, 'SQLALCHEMY_ENGINE_OPTIONS': {'connect_args': {'timeout': 0.1}}}, False) # fail fast
+], indirect=['file_app'])
+def test_read_during_a_write(file_app, wal):
+	'''With WAL a reader gets the last committed data while another connection is writing, without it the reader is locked out'''
+	with file_app.app_context():
+		writer = sqlite3.connect(db.engine.url.database, isolation_level=None)
+		writer.execute('BEGIN EXCLUSIVE') # the lock a writer takes to commit in the rollback journal mode
+		writer.execute('UPDATE log SET status = 1')
+		try:
+			if wal:
+				assert Log.query.filter_by(status=True).count() == 0
+			else:
+				with pytest.raises(OperationalError, match='database is locked'):
+					Log.query.filter_by(status=True).count()
+		finally:
+			writer.rollback()
+			writer.close()
+
+def test_parallel_check_offs(file_app):
+	'''Writers checking off different days of the same habits at once all succeed, and the progress adds up'''
+	with file_app.app_context():
+		logs_by_day = {}
+		for log in Log.query.all():
+			logs_by_day.setdefault(log.date.date(), []).append(str(log.id))
+	days = sorted(logs_by_day)
+	start = threading.Barrier(WRITERS)
+	failures = []
+
+	def writer(n):
+		client = file_app.test_client()
+		client.post('/login', data={'username' : 'test_user', 'password' : 'test_password'})
+		start.wait()
+		for day in days[n::WRITERS]:
+			rv = client.post('/dashboard/{}'.format(day), data={'done': logs_by_day[day]})
+			if not rv.location.endswith('/dashboard/{}'.format(day)): # failed check-offs redirect to today
+				failures.append(day)
+
+	threads = [threading.Thread(target=writer, args=(n,)) for n in range(WRITERS)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+
+	assert failures == []
+	with file_app.app_context():
+		assert Log.query.filter_by(status=False).count() == 0
+		for progress in HabitProgress.query.all():
+			assert (progress.total_completions, progress.longest_streak) == (DAYS, DAYS)
+		assert User.query.get(1).data_version == DAYS
+		assert Milestone.query.count() == HABITS * 6 # 3, 7 and 14 in total and in a row, each stored once
+
+def test_logs_changed_meanwhile_are_not_counted(file_app):
+	'''A check-off whose logs another connection checks off between its SELECT and its UPDATE fails instead of counting them twice'''
+	with file_app.app_context():
+		log = Log.query.first()
+		log_id, day, version = log.id, log.date, User.query.get(1).data_version
+		db.session.commit()
+		meanwhile = []
+
+		def check_off_meanwhile(conn, cursor, statement, *args):
+			if statement.startswith('SELECT log.id') and not meanwhile:
+				meanwhile.append(statement)
+				with db.engine.begin() as other:
+					other.execute(Log.__table__.update().where(Log.id == log_id).values(status=True))
+
+		event.listen(db.engine, 'after_cursor_execute', check_off_meanwhile)
+		try:
+			with pytest.raises(progress.ConcurrentChange):
+				progress.check_off(1, [log_id], day)
+		finally:
+			event.remove(db.engine, 'after_cursor_execute', check_off_meanwhile)
+		db.session.rollback()
+		assert Log.query.get(log_id).status == True and User.query.get(1).data_version == version
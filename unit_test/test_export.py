@@ -0,0 +1,77 @@
+import pytest
+import csv
+import gzip
+import io
+import json
+from web import app, db, login_manager
+from web import export
+from web.models import User, Habit, Log, Milestone
+from datetime import datetime, date, timedelta
+from werkzeug.security import generate_password_hash
+
+def create_db_user(username,password):
+	'''Inserts a test user to the db'''
+	db.session.add(User(username=username, password=generate_password_hash(password, method='sha256')))
+	db.session.commit()
+
+def login_user(client,username,password):
+	client.post('/login', data={'username' : username, 'password' : password})
+
+@pytest.fixture
+def data(client, reset_db):
+	'''test_user with a habit, three logs and a milestone, and another user with a habit'''
+	create_db_user('test_user', 'test_password')
+	create_db_user('other_user', 'other_password')
+	created = datetime(2020, 1, 1)
+	db.session.add(Habit(user_id=1, title='run', description='5k', frequency='daily', date_created=created, last_modified=created, active=True))
+	db.session.add(Habit(user_id=2, title='read', frequency='daily', date_created=created, last_modified=created, active=True))
+	for i in range(3):
+		db.session.add(Log(user_id=1, habit_id=1, date=created + timedelta(days=i), status=i != 1))
+	db.session.add(Milestone(user_id=1, habit_id=1, type='custom', text='Run a marathon', deadline=date(2020, 6, 1)))
+	db.session.commit()
+	return client
+
+def test_export_ndjson(data):
+	'''Every record of the user is one line of JSON, and nothing of the other user or any password'''
+	login_user(data, 'test_user', 'test_password')
+	rv = data.get('/api/v1/export')
+	assert rv.status_code == 200
+	assert rv.mimetype == 'application/x-ndjson'
+	records = [json.loads(line) for line in rv.get_data(as_text=True).splitlines()]
+
+	assert [record['record'] for record in records] == ['user', 'habit', 'log', 'log', 'log', 'milestone']
+	assert records[0] == {'record': 'user', 'id': 1, 'username': 'test_user'}
+	assert records[1]['title'] == 'run' and records[1]['date_created'] == '2020-01-01T00:00:00'
+	assert [(record['date'], record['status']) for record in records[2:5]] == [('2020-01-01', True), ('2020-01-02', False), ('2020-01-03', True)]
+	assert records[5]['deadline'] == '2020-06-01' and records[5]['complete'] is False
+
+def test_export_csv_gzipped(data):
+	'''The CSV is gzipped on the fly for clients that accept it'''
+	login_user(data, 'test_user', 'test_password')
+	rv = data.get('/api/v1/export?format=csv', headers={'Accept-Encoding': 'gzip'})
+	assert rv.headers['Content-Encoding'] == 'gzip'
+	rows = list(csv.DictReader(io.StringIO(gzip.decompress(rv.data).decode('utf-8'))))
+	assert len(rows) == 6
+	assert rows[2]['record'] == 'log' and rows[2]['habit_id'] == '1' and rows[2]['title'] == ''
+
+	assert data.get('/api/v1/export?format=xml').status_code == 400
+
+def test_export_is_streamed_in_chunks(data, monkeypatch):
+	'''Records are written out in chunks as they are read'''
+	monkeypatch.setattr(export, 'CHUNK_SIZE', 100)
+	chunks = list(export.export(1, 'ndjson'))
+	assert len(chunks) > 3
+	assert b''.join(chunks).count(b'\n') == 6
+
+def test_export_command(data, tmp_path):
+	'''The command exports every user, or only the one asked for'''
+	output = tmp_path / 'export.ndjson.gz'
+	result = app.test_cli_runner().invoke(args=['export', '--output', str(output), '--gzip'])
+	assert result.exit_code == 0
+	records = [json.loads(line) for line in gzip.decompress(output.read_bytes()).splitlines()]
+	assert [record['record'] for record in records].count('user') == 2
+
+	result = app.test_cli_runner().invoke(args=['export', '--user', 'other_user', '--format', 'csv'])
+	assert result.exit_code == 0
+	assert [row['record'] for row in csv.DictReader(io.StringIO(result.output))] == ['user', 'habit']
+	assert app.test_cli_runner().invoke(args=['export', '--user', 'nobody']).exit_code != 0
@@ -0,0 +1,90 @@
+import pytest
+import random
+from web import app, db, login_manager
+from web import history
+from web.models import User, Habit, Log, HabitProgress, HabitHistory
+from web.streaks import compute_streaks
+from datetime import datetime, date, timedelta
+from werkzeug.security import generate_password_hash
+
+def create_db_user(username,password):
+	'''Inserts a test user to the db'''
+	db.session.add(User(username=username, password=generate_password_hash(password, method='sha256')))
+	db.session.commit()
+
+def login_user(client,username,password):
+	client.post('/login', data={'username' : username, 'password' : password})
+
+@pytest.fixture
+def storage():
+	'''Lets a test switch HISTORY_STORAGE, restoring it afterwards'''
+	before = app.config['HISTORY_STORAGE']
+	yield app.config
+	app.config['HISTORY_STORAGE'] = before
+
+def test_bitmap_matches_the_dates():
+	'''Counts, ranges and streaks computed on the bits match the ones computed on the dates'''
+	created = date(2019, 12, 20)
+	rng = random.Random(7)
+	dates = sorted(created + timedelta(days=i) for i in range(-3, 800) if rng.random() < 0.7)
+	for frequency in ('daily', 'weekly', 'monthly'):
+		rows = [HabitHistory(year=row['year'], bits=row['bits']) for row in history.history_rows(1, 1, created.toordinal(), dates)]
+		bitmap = history.History.from_rows(created.toordinal(), rows)
+
+		assert bitmap.dates() == dates
+		assert bitmap.count() == len(dates)
+		assert bitmap.last_completed() == dates[-1]
+		assert bitmap.streaks(frequency) == compute_streaks(dates, frequency)
+		day = dates[400]
+		assert bitmap.streaks(frequency, as_of=day) == compute_streaks(dates, frequency, as_of=day)
+
+		start, end = date(2020, 3, 1), date(2021, 2, 28) # across two bitmap years
+		assert bitmap.dates(start, end) == [d for d in dates if start <= d <= end]
+		assert bitmap.count(start, end) == len([d for d in dates if start <= d <= end])
+	assert len(rows) == 4 # the days before the habit was created make a year -1
+
+def test_check_off_writes_the_bitmap(client, reset_db, storage):
+	'''With bitmaps turned on, check-off and undo keep them in sync with the logs and progress is read from them'''
+	storage['HISTORY_STORAGE'] = 'bitmaps'
+	create_db_user('test_user', 'test_password')
+	login_user(client, 'test_user', 'test_password')
+	client.post('/add_habit', data={'title' : 'test_habit', 'description' : 'test_description', 'frequency' : 'daily'})
+	yesterday = datetime.combine(date.today() - timedelta(days=1), datetime.min.time())
+	db.session.add(Log(user_id=1, habit_id=1, date=yesterday)) # log 2
+	db.session.commit()
+
+	client.post('/dashboard/{}'.format(yesterday.date()), data={'done': ['2']})
+	client.post('/dashboard/{}'.format(date.today()), data={'done': ['1']})
+	habit = Habit.query.get(1)
+	assert history.load(habit).dates() == [yesterday.date(), date.today()] # one day before the habit was created
+	progress = HabitProgress.query.get(1)
+	assert (progress.total_completions, progress.current_streak, progress.longest_streak) == (2, 2, 2)
+
+	client.post('/dashboard/{}'.format(yesterday.date()), data={'undo-done': ['2']})
+	assert history.load(habit).dates() == [date.today()]
+	assert HabitProgress.query.get(1).longest_streak == 1
+
+def test_build_history(client, reset_db):
+	'''The bitmaps are built from the completed logs of every habit, and rebuilding them is idempotent'''
+	create_db_user('test_user', 'test_password')
+	created = datetime(2020, 1, 1)
+	db.session.add(Habit(user_id=1, title='daily', frequency='daily', date_created=created, last_modified=created, active=True))
+	db.session.add(Habit(user_id=1, title='archived', frequency='daily', date_created=created, last_modified=created, active=False))
+	for i in range(400):
+		db.session.add(Log(user_id=1, habit_id=1, date=created + timedelta(days=i), status=i % 3 != 0))
+	db.session.add(Log(user_id=1, habit_id=2, date=created, status=True))
+	db.session.commit()
+
+	reports = []
+	assert history.build(batch_size=1, report=lambda *args: reports.append(args)) == 3
+	assert history.build() == 3
+	assert reports == [(1, 2), (2, 3)]
+	assert history.load(Habit.query.get(1)).count() == Log.query.filter_by(habit_id=1, status=True).count()
+
+	storage = history.storage_report()
+	assert (storage.log_rows, storage.completed_logs, storage.history_rows) == (401, 267, 3)
+	assert storage.history_bytes == 3 * history.YEAR_BYTES
+
+	result = app.test_cli_runner().invoke(args=['build-history'])
+	assert result.exit_code == 0
+	assert 'Bitmaps: 3 rows' in result.output
@@ -0,0 +1,104 @@
+import pytest
+import gzip
+import io
+import json
+import os
+from web import app, db, login_manager, imports
+from web.models import User, Habit, Log, Milestone, HabitProgress
+from datetime import datetime, date, timedelta
+from werkzeug.security import generate_password_hash
+
+def create_db_user(username,password):
+	'''Inserts a test user to the db'''
+	db.session.add(User(username=username, password=generate_password_hash(password, method='sha256')))
+	db.session.commit()
+
+def login_user(client,username,password):
+	client.post('/login', data={'username' : username, 'password' : password})
+
+@pytest.fixture
+def api_client(client, reset_db):
+	'''A client logged in as test_user'''
+	create_db_user('test_user', 'test_password')
+	login_user(client, 'test_user', 'test_password')
+	return client
+
+def upload(client, content, filename='habits.csv'):
+	return client.post('/api/v1/import', data={'file': (io.BytesIO(content), filename)}, content_type='multipart/form-data')
+
+def test_import_csv(api_client):
+	'''Completions from another tracker make habits with their logs, progress and completed milestones'''
+	rows = ['title,date'] + ['Meditate,2020-01-{:02d}'.format(day) for day in range(1, 11)] + ['Stretch,2020-01-05']
+	rv = upload(api_client, '\n'.join(rows).encode('utf-8'))
+	assert rv.status_code == 201
+	assert rv.get_json() == {'habits': 2, 'logs': 11, 'milestones': 0}
+
+	habit = Habit.query.filter_by(title='Meditate').one()
+	assert habit.frequency == 'daily' and habit.user_id == 1
+	assert habit.date_created == datetime(2020, 1, 1) # the first day of its history
+	assert Log.query.filter_by(habit_id=habit.id, status=True).count() == 10
+
+	progress = HabitProgress.query.get(habit.id)
+	assert (progress.total_completions, progress.longest_streak, progress.last_completed) == (10, 10, date(2020, 1, 10))
+	completed = Milestone.query.filter_by(habit_id=habit.id, complete=True).all()
+	assert sorted(milestone.text for milestone in completed) == sorted([
+		'Complete the habit 3 times!', 'Complete the habit 7 times!', 'Complete the habit 3 consecutive times!', 'Complete the habit 7 consecutive times!'
+	])
+	assert Milestone.query.filter_by(habit_id=habit.id).count() == 4 # the unreached defaults are not stored
+
+def test_export_can_be_imported(api_client):
+	'''A gzipped export imports back as new habits with the same logs and custom milestones'''
+	api_client.post('/api/v1/habits', json={'title': 'run', 'frequency': 'weekly'})
+	log = Log.query.first()
+	log.status = True
+	day = log.date.date()
+	db.session.add(Milestone(user_id=1, habit_id=1, type='custom', text='Run a marathon', deadline=date(2030, 1, 1)))
+	db.session.commit()
+	exported = api_client.get('/api/v1/export', headers={'Accept-Encoding': 'gzip'}).data
+
+	rv = upload(api_client, exported, 'habits.ndjson.gz')
+	assert rv.get_json() == {'habits': 1, 'logs': 1, 'milestones': 1}
+	imported = Habit.query.get(2)
+	assert (imported.title, imported.frequency) == ('run', 'weekly')
+	assert [(l.date.date(), l.status) for l in Log.query.filter_by(habit_id=2)] == [(day, True)]
+	assert Milestone.query.filter_by(habit_id=2, type='custom').one().deadline == date(2030, 1, 1)
+	assert HabitProgress.query.get(2).total_completions == 1
+
+def test_invalid_import_writes_nothing(api_client):
+	'''Every invalid record is reported with its line and nothing is imported'''
+	records = [
+		{'record': 'habit', 'id': 1, 'title': 'run', 'frequency': 'hourly'},
+		{'record': 'log', 'habit_id': 1, 'date': '2020-01-01'},
+		{'record': 'log', 'habit_id': 1, 'date': '2020-01-01'},
+		{'record': 'log', 'habit_id': 2, 'date': 'yesterday'},
+		{'record': 'log', 'habit_id': 3, 'date': '2020-01-01'},
+	]
+	content = '\n'.join(json.dumps(record) for record in records) + '\nnot json\n'
+	rv = upload(api_client, content.encode('utf-8'), 'habits.ndjson')
+	assert rv.status_code == 400
+	assert [record['line'] for record in rv.get_json()['records']] == [1, 3, 4, 6, 0, 0]
+	assert Habit.query.count() == 0 and Log.query.count() == 0
+
+	assert api_client.post('/api/v1/import').status_code == 400
+
+def test_import_command(client, reset_db, tmp_path):
+	'''The command imports a file for the given user'''
+	create_db_user('test_user', 'test_password')
+	path = tmp_path / 'habits.csv.gz'
+	path.write_bytes(gzip.compress(b'record,id,title,frequency,habit_id,date,status\nhabit,7,Read,monthly,,,\nlog,,,,7,2020-01-01,true\nlog,,,,7,2020-01-31,false\n'))
+	result = app.test_cli_runner().invoke(args=['import', str(path), '--user', 'test_user'])
+	assert result.exit_code == 0
+	assert 'Imported 1 habits, 2 logs' in result.output
+	assert [(l.date, l.status) for l in Log.query.order_by(Log.date)] == [(datetime(2020, 1, 1), True), (datetime(2020, 1, 31), False)]
+
+	assert app.test_cli_runner().invoke(args=['import', str(path), '--user', 'nobody']).exit_code != 0
+
+def test_import_from_a_pipe(client, reset_db):
+	'''A gzipped file read from a pipe, which can't seek back after the format is sniffed, like `flask import -`'''
+	create_db_user('test_user', 'test_password')
+	read, write = os.pipe()
+	with open(write, 'wb') as out:
+		out.write(gzip.compress(b'{"record": "habit", "id": 1, "title": "Read", "date_created": "2020-01-01T08:30:00"}\n{"record": "log", "habit_id": 1, "date": "2020-01-02"}\n'))
+	with open(read, 'rb') as file:
+		assert imports.import_file(1, file) == (1, 1, 0)
+	assert Habit.query.one().date_created == datetime(2020, 1, 1, 8, 30)
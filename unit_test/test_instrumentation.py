@@ -0,0 +1,65 @@
+import pytest
+import logging
+from web import app, db, login_manager
+from web.instrumentation import QueryBudgetExceeded, RequestStats
+from web.models import User, Habit, Log
+from datetime import date
+from werkzeug.security import generate_password_hash
+
+def create_db_user(username,password):
+	'''Inserts a test user to the db'''
+	db.session.add(User(username=username, password=generate_password_hash(password, method='sha256')))
+	db.session.commit()
+
+def login_user(client,username,password):
+	client.post('/login', data={'username' : username, 'password' : password})
+
+@pytest.fixture
+def instrumented(client, reset_db):
+	'''A logged in client with the instrumentation on, turned off again afterwards'''
+	settings = {key: app.config[key] for key in ('SQL_INSTRUMENTATION', 'SQL_QUERY_BUDGET', 'SQL_QUERY_BUDGET_STRICT')}
+	create_db_user('test_user', 'test_password')
+	login_user(client, 'test_user', 'test_password')
+	app.config['SQL_INSTRUMENTATION'] = True
+	yield client
+	app.config.update(settings)
+
+def test_off_by_default(client, reset_db):
+	'''Without the setting responses have no SQL headers'''
+	assert 'X-SQL-Queries' not in client.get('/login').headers
+
+def test_request_stats(instrumented, count_queries, caplog):
+	'''Every response tells how many statements it sent, how long they took and how many were repeated'''
+	for title in ('run', 'read', 'write'):
+		instrumented.post('/add_habit', data={'title' : title, 'description' : '', 'frequency' : 'daily'})
+
+	del count_queries[:]
+	with caplog.at_level(logging.DEBUG, logger=app.logger.name):
+		rv = instrumented.get('/dashboard/{}'.format(date.today()))
+	assert int(rv.headers['X-SQL-Queries']) == len(count_queries)
+	assert float(rv.headers['X-SQL-Time']) >= float(rv.headers['X-SQL-Slowest']) > 0
+	assert rv.headers['X-SQL-Duplicates'] == '0'
+	assert '{} queries in'.format(len(count_queries)) in caplog.text
+
+	log_ids = [str(log.id) for log in Log.query.all()]
+	with caplog.at_level(logging.DEBUG, logger=app.logger.name):
+		rv = instrumented.post('/dashboard/{}'.format(date.today()), data={'done': log_ids})
+	assert rv.headers['X-SQL-Duplicates'] == '0' # the progress records of all the habits are read in one query
+
+def test_duplicates():
+	'''Every execution of a statement after the first is a duplicate'''
+	stats = RequestStats()
+	for statement in ('SELECT progress', 'SELECT progress', 'SELECT progress', 'UPDATE log'):
+		stats.add(statement, 0.001)
+	assert stats.duplicates() == 2 and stats.most_repeated() == ('SELECT progress', 3)
+
+def test_query_budget(instrumented):
+	'''Going over the budget fails the request when the budget is strict'''
+	app.config['SQL_QUERY_BUDGET'] = 1
+	assert instrumented.get('/dashboard/2020-01-01').status_code == 200 # only logged
+
+	app.config['SQL_QUERY_BUDGET_STRICT'] = True
+	with pytest.raises(QueryBudgetExceeded):
+		instrumented.get('/dashboard/2020-01-02')
+	app.config['SQL_QUERY_BUDGET'] = 20
+	assert instrumented.get('/dashboard/2020-01-03').status_code == 200
@@ -0,0 +1,53 @@
+import pytest
+from web import app, db, login_manager
+from web import jobs
+from web.models import User, Habit, Log
+from datetime import datetime, date, timedelta
+from werkzeug.security import generate_password_hash
+
+def create_habits():
+	'''Two users: one with a daily and a weekly habit, one with a daily and an archived habit'''
+	created = datetime(2020, 1, 1)
+	db.session.add(User(username='a', password=generate_password_hash('a', method='sha256')))
+	db.session.add(User(username='b', password=generate_password_hash('b', method='sha256')))
+	db.session.add(Habit(user_id=1, title='daily', frequency='daily', date_created=created, last_modified=created, active=True))
+	db.session.add(Habit(user_id=1, title='weekly', frequency='weekly', date_created=created, last_modified=created, active=True))
+	db.session.add(Habit(user_id=2, title='daily', frequency='daily', date_created=created, last_modified=created, active=True))
+	db.session.add(Habit(user_id=2, title='archived', frequency='daily', date_created=created, last_modified=created, active=False))
+	db.session.add(Log(user_id=2, habit_id=3, date=datetime(2020, 1, 10), status=True)) # that day was already viewed
+	db.session.commit()
+
+def test_generate_logs(client, reset_db):
+	'''Due logs are created for every user in batches, without duplicating existing ones'''
+	create_habits()
+	reports = []
+	created = jobs.generate_logs(date(2020, 1, 1), date(2020, 1, 14), batch_size=2, report=lambda *args: reports.append(args))
+
+	assert created == 14 + 1 + 13
+	assert reports == [(2, 15), (3, 28)] # progress after each batch of habits
+	assert Log.query.filter_by(habit_id=1).count() == 14
+	assert [log.date for log in Log.query.filter_by(habit_id=2)] == [datetime(2020, 1, 8)] # weekly
+	assert Log.query.filter_by(habit_id=3, user_id=2).count() == 14
+	assert Log.query.filter_by(habit_id=4).count() == 0 # archived habits get no logs
+	assert Log.query.filter_by(habit_id=3, date=datetime(2020, 1, 10)).one().status # the existing log is untouched
+
+	assert jobs.generate_logs(date(2020, 1, 1), date(2020, 1, 14)) == 0 # running again creates nothing
+
+def test_generate_logs_command(client, reset_db):
+	'''The flask command reports its progress'''
+	create_habits()
+	result = app.test_cli_runner().invoke(args=['generate-logs', '--start', '2020-01-15', '--end', '2020-01-15'])
+	assert result.exit_code == 0
+	assert '3/3 habits, 3 logs created' in result.output
+	assert Log.query.filter_by(date=datetime(2020, 1, 15)).count() == 3
+
+def test_read_only_dashboard(client, reset_db):
+	'''With materialization on read turned off the dashboard does not create logs'''
+	create_habits()
+	client.post('/login', data={'username': 'a', 'password': 'a'})
+	app.config['MATERIALIZE_ON_READ'] = False
+	try:
+		assert client.get('/dashboard/2020-01-20').status_code == 200
+		assert Log.query.filter_by(user_id=1).count() == 0
+	finally:
+		app.config['MATERIALIZE_ON_READ'] = True
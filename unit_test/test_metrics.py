@@ -0,0 +1,86 @@
+import pytest
+import json
+import os
+from web import app, db, login_manager, metrics
+from web.monitoring import Snapshot
+from web.models import User, Log
+from datetime import date
+from werkzeug.security import generate_password_hash
+
+def create_db_user(username,password):
+	'''Inserts a test user to the db'''
+	db.session.add(User(username=username, password=generate_password_hash(password, method='sha256')))
+	db.session.commit()
+
+def login_user(client,username,password):
+	client.post('/login', data={'username' : username, 'password' : password})
+
+@pytest.fixture
+def fresh_metrics(client, reset_db):
+	'''Starts the test with no metrics recorded'''
+	settings = {key: app.config[key] for key in ('METRICS', 'METRICS_DIR')}
+	app.extensions['metrics'].snapshot = Snapshot()
+	yield client
+	app.config.update(settings)
+
+def samples(client):
+	'''{sample with its labels: value} of /metrics'''
+	rv = client.get('/metrics')
+	assert rv.status_code == 200 and rv.mimetype == 'text/plain'
+	return {line.rsplit(' ', 1)[0]: float(line.rsplit(' ', 1)[1]) for line in rv.get_data(as_text=True).splitlines() if not line.startswith('#')}
+
+def test_request_and_domain_metrics(fresh_metrics):
+	'''Requests are counted and timed per endpoint, next to the domain counters'''
+	client = fresh_metrics
+	create_db_user('test_user', 'test_password')
+	login_user(client, 'test_user', 'test_password')
+	client.post('/add_habit', data={'title' : 'run', 'description' : '', 'frequency' : 'daily'})
+	client.get('/dashboard/{}'.format(date.today()))
+	client.post('/dashboard/{}'.format(date.today()), data={'done': [str(Log.query.first().id)]})
+	client.get('/no_such_page')
+
+	values = samples(client)
+	assert values['http_requests_total{endpoint="web.login",method="POST",status="302"}'] == 1
+	assert values['http_requests_total{endpoint="web.dashboard",method="GET",status="200"}'] == 1
+	assert values['http_requests_total{endpoint="none",method="GET",status="404"}'] == 1
+	assert values['http_request_duration_seconds_count{endpoint="web.dashboard"}'] == 2
+	assert values['http_request_duration_seconds_bucket{endpoint="web.dashboard",le="+Inf"}'] == 2
+	assert values['http_requests_in_flight'] >= 1 # this one
+	assert values['habits_created_total'] == 1
+	assert values['logs_checked_off_total'] == 1
+	assert values['cache_requests_total{result="miss"}'] >= 1
+	assert 'cache_entries{cache="pages"}' in values
+
+def test_metrics_of_all_workers(fresh_metrics, tmp_path):
+	'''With METRICS_DIR the numbers of every worker are added up, without the gauges of the ones that exited'''
+	app.config['METRICS_DIR'] = str(tmp_path)
+	other = Snapshot()
+	other.counters[('habits_created_total', ())] = 5
+	other.gauges[('http_requests_in_flight', ())] = 100
+	other.observe('http_request_duration_seconds', (('endpoint', 'web.login'),), 0.02)
+	(tmp_path / '999999999.json').write_text(json.dumps(dict(other.to_json(), pid=999999999))) # no such process
+
+	fresh_metrics.get('/login')
+	values = samples(fresh_metrics)
+	assert values['habits_created_total'] == 5
+	assert values['http_requests_in_flight'] < 100
+	assert values['http_request_duration_seconds_count{endpoint="web.login"}'] == 2
+	assert values['http_request_duration_seconds_bucket{endpoint="web.login",le="0.025"}'] >= 1
+
+def test_reused_pid(fresh_metrics, tmp_path):
+	'''The snapshot of a worker that exited is kept when a new one gets its pid, without its gauges'''
+	app.config['METRICS_DIR'] = str(tmp_path)
+	exited = Snapshot()
+	exited.counters[('habits_created_total', ())] = 5
+	exited.gauges[('http_requests_in_flight', ())] = 100
+	(tmp_path / '{}-1.json'.format(os.getpid())).write_text(json.dumps(dict(exited.to_json(), started=1)))
+
+	for _ in range(2):
+		values = samples(fresh_metrics)
+		assert values['habits_created_total'] == 5
+		assert values['http_requests_in_flight'] < 100
+	assert len(list(tmp_path.glob('{}-*.json'.format(os.getpid())))) == 2
+
+def test_metrics_can_be_turned_off(fresh_metrics):
+	app.config['METRICS'] = False
+	assert fresh_metrics.get('/metrics').status_code == 404
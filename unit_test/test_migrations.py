@@ -0,0 +1,65 @@
+import pytest
+from sqlalchemy import inspect
+from web import app, db, login_manager, create_app
+from web import migrations
+
+def index_names(table):
+	return {ix['name'] for ix in inspect(db.engine).get_indexes(table)}
+
+@pytest.fixture
+def old_schema(client, reset_db):
+	'''A database that was created before the composite indexes existed'''
+	migrations.schema_version.drop(db.engine, checkfirst=True)
+	for name in ['ix_habit_user_active_created', 'ix_log_habit_date', 'ix_log_user_habit_status', 'ix_milestone_user_habit_type']:
+		db.engine.execute('DROP INDEX {}'.format(name))
+	yield
+	migrations.schema_version.drop(db.engine, checkfirst=True)
+
+def test_upgrade_adds_composite_indexes(old_schema):
+	'''Upgrading an existing database adds the indexes declared on the models'''
+	assert 'ix_log_habit_date' not in index_names('log')
+	assert migrations.current_version() == 0
+
+	assert 1 in migrations.upgrade()
+
+	assert {'ix_log_habit_date', 'ix_log_user_habit_status'} <= index_names('log')
+	assert 'ix_habit_user_active_created' in index_names('habit')
+	assert 'ix_milestone_user_habit_type' in index_names('milestone')
+	assert migrations.current_version() == max(version for version, _, _ in migrations.MIGRATIONS)
+
+def test_migrations_are_frozen(old_schema):
+	'''Migration 1 creates its own four indexes only, not the ones added to the models since'''
+	for name in ['ix_log_user_date_status', 'ix_milestone_user_deadline']:
+		db.engine.execute('DROP INDEX {}'.format(name))
+	assert migrations.upgrade(target=1) == [1]
+	assert 'ix_log_user_date_status' not in index_names('log')
+	assert 'ix_milestone_user_deadline' not in index_names('milestone')
+
+	migrations.upgrade()
+	assert 'ix_log_user_date_status' in index_names('log')
+	assert 'ix_milestone_user_deadline' in index_names('milestone')
+
+def test_upgrade_is_idempotent(old_schema):
+	'''Running the upgrade twice applies every migration only once'''
+	migrations.upgrade()
+	assert migrations.upgrade() == []
+
+def test_upgrade_fresh_database(client, reset_db):
+	'''Migrations are no-ops on a database built by create_all()'''
+	migrations.schema_version.drop(db.engine, checkfirst=True)
+	assert 1 in migrations.upgrade()
+	assert 'ix_log_habit_date' in index_names('log')
+	migrations.schema_version.drop(db.engine, checkfirst=True)
+
+def test_init_db(tmp_path):
+	'''Creating the app leaves the database alone until `flask init-db` creates its tables'''
+	path = tmp_path / 'new.db'
+	new_app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///{}'.format(path), 'TESTING': True})
+	assert not path.exists()
+
+	result = new_app.test_cli_runner().invoke(args=['init-db'])
+	assert result.exit_code == 0
+	with new_app.app_context():
+		assert {'user', 'habit', 'log', 'milestone'} <= set(inspect(db.engine).get_table_names())
+		assert migrations.current_version() == max(version for version, _, _ in migrations.MIGRATIONS)
+		db.get_engine().dispose()
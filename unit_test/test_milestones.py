@@ -0,0 +1,132 @@
+import pytest
+from sqlalchemy.exc import IntegrityError
+from web import app, db, login_manager, user_cache
+from web import milestones, migrations
+from web.cache import MISSING
+from web.models import User, Habit, Log, Milestone, HabitProgress
+from datetime import datetime, date, timedelta
+from werkzeug.security import generate_password_hash
+
+def create_db_user(username,password):
+	'''Inserts a test user to the db'''
+	db.session.add(User(username=username, password=generate_password_hash(password, method='sha256')))
+	db.session.commit()
+
+def login_user(client,username,password):
+	client.post('/login', data={'username' : username, 'password' : password})
+
+def add_past_logs(habit_id, days):
+	'''Adds a not yet completed log to the habit for each of the given number of days ago'''
+	for i in days:
+		db.session.add(Log(user_id=1, habit_id=habit_id, date=datetime.combine(date.today() - timedelta(days=i), datetime.min.time())))
+	db.session.commit()
+
+def flashes(client):
+	'''Pops the messages flashed to the client'''
+	with client.session_transaction() as session:
+		return [message for _, message in session.pop('_flashes', [])]
+
+def completed(habit_id):
+	return sorted((m.type, m.threshold) for m in Milestone.query.filter_by(habit_id=habit_id, complete=True))
+
+@pytest.fixture
+def habit(client, reset_db):
+	'''A logged in user with a daily habit and its logs of the last four days'''
+	create_db_user('test_user', 'test_password')
+	login_user(client, 'test_user', 'test_password')
+	client.post('/add_habit', data={'title' : 'test_habit', 'description' : 'test_description', 'frequency' : 'daily'}) # log 1 is today
+	add_past_logs(1, [3, 2, 1])
+	return client
+
+def test_default_milestones_are_templates(habit):
+	'''A new habit stores none of its default milestones, but its page shows them all with the custom ones'''
+	assert Milestone.query.filter_by(habit_id=1).count() == 0
+	db.session.add(Milestone(user_id=1, habit_id=1, type='custom', text='by hand'))
+	db.session.commit()
+
+	page = habit.get('/habit/1').data.decode()
+	for text in ['by hand'] + [text for _, _, text in milestones.TEMPLATES]:
+		assert text in page
+	assert page.index('by hand') < page.index(milestones.TEMPLATES[0][2])
+
+def test_check_off_completes_milestones(habit):
+	'''Milestones reached by a check-off are saved as completed, and celebrated once'''
+	client = habit
+	for log_id, days_ago in ((2, 3), (3, 2)):
+		client.post('/dashboard/{}'.format(date.today() - timedelta(days=days_ago)), data={'done': [str(log_id)]})
+	assert completed(1) == []
+
+	day = date.today() - timedelta(days=1)
+	client.post('/dashboard/{}'.format(day), data={'done': ['4']})
+	assert completed(1) == [('count', 3), ('streak', 3)]
+	assert len(flashes(client)) == 2
+
+	client.post('/dashboard/{}'.format(day), data={'undo-done': ['4']})
+	client.post('/dashboard/{}'.format(day), data={'done': ['4']})
+	assert completed(1) == [('count', 3), ('streak', 3)] # reached milestones stay completed
+	assert flashes(client) == []
+
+def test_check_off_from_the_api_completes_milestones(habit):
+	for log in Log.query.filter_by(habit_id=1).all():
+		habit.post('/api/v1/logs/done', json={'date': log.date.strftime('%Y-%m-%d'), 'log_ids': [log.id]})
+	assert completed(1) == [('count', 3), ('streak', 3)]
+
+def test_complete_reached_in_bulk(habit):
+	'''After a backfill of the progress, a single INSERT ... SELECT stores what it reached, for one user or all'''
+	create_db_user('other_user', 'test_password')
+	db.session.add(Habit(user_id=2, title='other', frequency='daily', active=True))
+	db.session.add(HabitProgress(habit_id=2, user_id=2, total_completions=20, current_streak=1, longest_streak=7))
+	db.session.add(Milestone(user_id=2, habit_id=2, type='custom', text='by hand'))
+	db.session.add(Milestone(user_id=2, habit_id=2, type='count', threshold=3, text='Complete the habit 3 times!', complete=True))
+	HabitProgress.query.get(1).total_completions = 30
+	db.session.commit()
+	version = User.query.get(2).data_version
+	for user_id in (1, 2):
+		user_cache.set(user_id, User.query.get(user_id))
+
+	assert milestones.complete_reached(user_id=2) == 4
+	db.session.commit()
+	assert completed(2) == [('count', 3), ('count', 7), ('count', 14), ('streak', 3), ('streak', 7)]
+	assert completed(1) == []
+	assert User.query.get(2).data_version == version + 1
+	assert user_cache.get(2) is MISSING and user_cache.get(1) is not MISSING # only the importing user is forgotten
+
+	assert milestones.complete_reached() == 4 # the count milestones of the first user
+	db.session.commit()
+	assert completed(1) == [('count', 3), ('count', 7), ('count', 14), ('count', 30)]
+	assert milestones.complete_reached() == 0
+
+def test_migration_collapses_default_rows(habit):
+	'''The default milestones of an older database, one row each, are deleted unless reached; the reached ones are kept completed'''
+	for kind, n, text in milestones.TEMPLATES:
+		db.session.add(Milestone(user_id=1, habit_id=1, type=kind, text=text, complete=(kind, n) == ('count', 3)))
+	db.session.add(Milestone(user_id=1, habit_id=1, type='custom', text='by hand'))
+	HabitProgress.query.get(1).longest_streak = 7
+	db.session.commit()
+
+	with db.engine.begin() as connection:
+		migrations.add_milestone_threshold(connection)
+		migrations.collapse_default_milestones(connection)
+	db.session.expire_all()
+	assert completed(1) == [('count', 3), ('streak', 3), ('streak', 7)]
+	assert Milestone.query.filter_by(habit_id=1).count() == 4 # and the custom one
+
+def test_migration_makes_default_milestones_unique(habit):
+	'''Duplicates stored by concurrent check-offs are removed, and the unique index keeps a default milestone once per habit'''
+	db.engine.execute('DROP INDEX ix_milestone_habit_rule')
+	for _ in range(2):
+		db.session.add(Milestone(user_id=1, habit_id=1, type='count', threshold=3, text='Complete the habit 3 times!', complete=True))
+	db.session.commit()
+
+	with db.engine.begin() as connection:
+		migrations.add_milestone_rule_index(connection)
+	assert completed(1) == [('count', 3)]
+	HabitProgress.query.get(1).total_completions = 3
+	db.session.commit()
+	assert milestones.evaluate([1]) == [] # already stored
+	duplicate = dict(user_id=1, habit_id=1, type='count', threshold=3, text='Complete the habit 3 times!', complete=True)
+	assert db.session.execute(milestones.insert_new(db.engine.dialect.name).values(**duplicate)).rowcount == 0 # e.g. stored by another transaction meanwhile
+	db.session.add(Milestone(**duplicate))
+	with pytest.raises(IntegrityError):
+		db.session.commit()
+	db.session.rollback()
@@ -0,0 +1,148 @@
+import pytest
+from web import app, db, login_manager
+from web import migrations
+from web.models import User, Habit, Log, Milestone, HabitProgress
+from datetime import datetime, date, timedelta
+from werkzeug.security import generate_password_hash, check_password_hash
+
+def create_db_user(username,password):
+	'''Inserts a test user to the db'''
+	db.session.add(User(username=username, password=generate_password_hash(password, method='sha256')))
+	db.session.commit()
+
+def login_user(client,username,password):
+	client.post('/login', data={'username' : username, 'password' : password})
+
+def add_past_logs(habit_id, days):
+	'''Adds a not yet completed log to the habit for each of the given number of days ago'''
+	for i in days:
+		db.session.add(Log(user_id=1, habit_id=habit_id, date=datetime.combine(date.today() - timedelta(days=i), datetime.min.time())))
+	db.session.commit()
+
+def check_off(client, day, log_ids, action='done'):
+	client.post('/dashboard/{}'.format(day), data={action: [str(i) for i in log_ids]})
+
+def test_new_habit_has_progress(client, reset_db):
+	'''Adding a habit creates an empty progress record'''
+	create_db_user('test_user', 'test_password')
+	login_user(client, 'test_user', 'test_password')
+	client.post('/add_habit', data={'title' : 'test_habit', 'description' : 'test_description', 'frequency' : 'daily'})
+
+	progress = HabitProgress.query.get(1)
+	assert progress.total_completions == 0
+	assert progress.current_streak == 0 and progress.longest_streak == 0
+	assert progress.last_completed is None
+
+def test_check_off_and_undo_update_progress(client, reset_db):
+	'''Check-off and undo keep the totals and streaks in sync with the logs'''
+	create_db_user('test_user', 'test_password')
+	login_user(client, 'test_user', 'test_password')
+	client.post('/add_habit', data={'title' : 'test_habit', 'description' : 'test_description', 'frequency' : 'daily'}) # log 1 is today
+	add_past_logs(1, [2, 1]) # logs 2 and 3
+
+	check_off(client, date.today() - timedelta(days=2), [2])
+	check_off(client, date.today(), [1])
+	progress = HabitProgress.query.get(1)
+	assert progress.total_completions == 2
+	assert progress.current_streak == 1 and progress.longest_streak == 1 # yesterday is missing
+	assert progress.last_completed == date.today()
+
+	check_off(client, date.today() - timedelta(days=1), [3]) # filling the gap joins both days
+	progress = HabitProgress.query.get(1)
+	assert progress.total_completions == 3
+	assert progress.current_streak == 3 and progress.longest_streak == 3
+
+	check_off(client, date.today() - timedelta(days=1), [3]) # checking off twice does not count twice
+	assert HabitProgress.query.get(1).total_completions == 3
+
+	check_off(client, date.today(), [1], action='undo-done')
+	progress = HabitProgress.query.get(1)
+	assert progress.total_completions == 2
+	assert progress.current_streak == 2 and progress.longest_streak == 2
+	assert progress.last_completed == date.today() - timedelta(days=1)
+
+def test_migration_backfills_progress(client, reset_db):
+	'''Existing habits get a progress record computed from their logs'''
+	create_db_user('test_user', 'test_password')
+	db.session.add(Habit(user_id=1, title='test_habit', frequency='daily', date_created=datetime.today(), active=True))
+	db.session.commit()
+	add_past_logs(1, [4, 3, 1, 0])
+	Log.query.filter(Log.id != 3).update({'status': True}, synchronize_session=False)
+	db.session.commit()
+
+	migrations.schema_version.drop(db.engine, checkfirst=True)
+	migrations.upgrade()
+	migrations.schema_version.drop(db.engine, checkfirst=True)
+
+	progress = HabitProgress.query.get(1)
+	assert progress.total_completions == 3
+	assert progress.current_streak == 1 and progress.longest_streak == 2
+	assert progress.last_completed == date.today()
+
+def test_bulk_check_off_and_undo(client, reset_db, count_queries):
+	'''All the submitted logs are updated with a single UPDATE statement and the other user's log is left alone'''
+	create_db_user('test_user', 'test_password')
+	create_db_user('other_user', 'test_password')
+	login_user(client, 'other_user', 'test_password')
+	client.post('/add_habit', data={'title' : 'not_mine', 'description' : '', 'frequency' : 'daily'}) # log 1
+	client.get('/logout')
+	login_user(client, 'test_user', 'test_password')
+	for i in range(5): # logs 2 to 6
+		client.post('/add_habit', data={'title' : 'habit_{}'.format(i), 'description' : '', 'frequency' : 'daily'})
+
+	del count_queries[:]
+	check_off(client, date.today(), range(1, 7))
+	assert len([q for q in count_queries if q.startswith('UPDATE log')]) == 1
+	assert [log.status for log in Log.query.order_by(Log.id)] == [False] + [True] * 5
+	assert [p.total_completions for p in HabitProgress.query.order_by(HabitProgress.habit_id)] == [0] + [1] * 5
+
+	del count_queries[:]
+	check_off(client, date.today(), [2, 3, 4], action='undo-done')
+	assert len([q for q in count_queries if q.startswith('UPDATE log')]) == 1
+	assert [log.status for log in Log.query.order_by(Log.id)] == [False] * 4 + [True] * 2
+	assert [p.total_completions for p in HabitProgress.query.order_by(HabitProgress.habit_id)] == [0] * 4 + [1] * 2
+
+def test_check_off_locks_in_id_order(client, reset_db, count_queries):
+	'''The logs and progress records of a check-off are selected by id, so that concurrent check-offs lock them in the same order'''
+	create_db_user('test_user', 'test_password')
+	login_user(client, 'test_user', 'test_password')
+	for title in ('first', 'second'):
+		client.post('/add_habit', data={'title' : title, 'description' : '', 'frequency' : 'daily'})
+	del count_queries[:]
+	check_off(client, date.today(), [2, 1])
+	assert [q for q in count_queries if q.startswith('SELECT habit_progress.')][0].endswith('ORDER BY habit_progress.habit_id')
+	assert [q for q in count_queries if q.startswith('SELECT log.id')][0].endswith('ORDER BY log.id')
+
+def test_frequency_change_rebuilds_progress(client, reset_db):
+	'''Streaks are counted in periods of the frequency, so changing it recomputes them, from the form or the API'''
+	create_db_user('test_user', 'test_password')
+	login_user(client, 'test_user', 'test_password')
+	client.post('/add_habit', data={'title' : 'test_habit', 'description' : '', 'frequency' : 'daily'}) # log 1 is today
+	add_past_logs(1, [14, 7, 6, 5, 4]) # logs 2 to 6
+	for log_id, days_ago in zip(range(2, 7), [14, 7, 6, 5, 4]):
+		check_off(client, date.today() - timedelta(days=days_ago), [log_id])
+	assert (HabitProgress.query.get(1).current_streak, HabitProgress.query.get(1).longest_streak) == (4, 4)
+
+	client.post('/habit/1/edit', data={'frequency' : 'weekly'})
+	db.session.expire_all()
+	progress = HabitProgress.query.get(1)
+	assert (progress.total_completions, progress.current_streak, progress.longest_streak) == (5, 1, 2) # 14 and 7 days ago
+
+	client.patch('/api/v1/habits/1', json={'frequency': 'daily'})
+	db.session.expire_all()
+	progress = HabitProgress.query.get(1)
+	assert (progress.total_completions, progress.current_streak, progress.longest_streak) == (5, 4, 4)
+
+def test_frequency_change_completes_milestones(client, reset_db):
+	'''A frequency change that makes a streak long enough stores the milestone it reached'''
+	create_db_user('test_user', 'test_password')
+	login_user(client, 'test_user', 'test_password')
+	client.post('/add_habit', data={'title' : 'test_habit', 'description' : '', 'frequency' : 'daily'}) # log 1 is today
+	add_past_logs(1, [21, 14, 7]) # logs 2 to 4, one week apart
+	for log_id, days_ago in zip(range(2, 5), [21, 14, 7]):
+		check_off(client, date.today() - timedelta(days=days_ago), [log_id])
+	assert Milestone.query.filter_by(habit_id=1, type='streak').count() == 0 # three days, not in a row
+
+	client.post('/habit/1/edit', data={'frequency' : 'weekly'})
+	milestone = Milestone.query.filter_by(habit_id=1, type='streak').one()
+	assert (milestone.threshold, milestone.complete) == (3, True)
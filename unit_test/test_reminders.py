@@ -0,0 +1,85 @@
+import pytest
+import json
+from sqlalchemy import event
+from web import app, db, login_manager
+from web import reminders
+from web.models import User, Habit, Milestone
+from datetime import datetime, date, timedelta
+
+TODAY = date(2020, 6, 15)
+
+def add_milestones(user_id, habit_id, deadlines, complete=False):
+	for deadline in deadlines:
+		db.session.add(Milestone(user_id=user_id, habit_id=habit_id, text='by {}'.format(deadline), type='custom', deadline=deadline, complete=complete))
+
+@pytest.fixture
+def milestones(client, reset_db):
+	'''Three users with milestones due around TODAY, some finished or on an archived habit'''
+	for name in ('alice', 'bob', 'carol'):
+		db.session.add(User(username=name, password='-'))
+	db.session.add_all([Habit(user_id=1, title='run', frequency='daily', active=True),
+		Habit(user_id=2, title='read', frequency='daily', active=True),
+		Habit(user_id=2, title='archived', frequency='daily', active=False),
+		Habit(user_id=3, title='write', frequency='daily', active=True)])
+	db.session.flush()
+	add_milestones(1, 1, [TODAY + timedelta(days=i) for i in (3, 0, 1, -2)]) # four, one overdue
+	add_milestones(1, 1, [TODAY + timedelta(days=2)], complete=True)
+	add_milestones(2, 2, [TODAY + timedelta(days=30), None])
+	add_milestones(2, 3, [TODAY + timedelta(days=1)])
+	add_milestones(3, 4, [TODAY + timedelta(days=5), TODAY + timedelta(days=6)])
+	db.session.commit()
+
+def test_digests_by_user(milestones, count_queries):
+	'''Unfinished milestones of active habits due in the window, one digest per user even across batches'''
+	del count_queries[:]
+	digests = list(reminders.digests(TODAY - timedelta(days=7), TODAY + timedelta(days=7), today=TODAY, batch_size=2))
+	assert len(count_queries) == 4 # 3 users with milestones due (bob's on an archived habit): 2 batches of 2 queries
+
+	assert [(digest.username, len(digest.reminders)) for digest in digests] == [('alice', 4), ('carol', 2)]
+	alice = digests[0].reminders
+	assert [reminder.deadline for reminder in alice] == sorted(reminder.deadline for reminder in alice)
+	assert [reminder.overdue for reminder in alice] == [True, False, False, False]
+	assert alice[0].habit_title == 'run' and alice[0].text == 'by 2020-06-13'
+
+def test_plan_reads_only_the_window(milestones):
+	'''The users are found by a range of the partial index on deadlines, their milestones by a search per user, neither by a scan'''
+	queries = []
+	def explain(conn, cursor, statement, parameters, context, executemany):
+		if statement.startswith('SELECT') and 'FROM milestone' in statement:
+			queries.append(' '.join(row[-1] for row in conn.connection.execute('EXPLAIN QUERY PLAN ' + statement, parameters)))
+	event.listen(db.engine, 'before_cursor_execute', explain)
+	try:
+		list(reminders.digests(TODAY - timedelta(days=7), TODAY + timedelta(days=7), today=TODAY))
+	finally:
+		event.remove(db.engine, 'before_cursor_execute', explain)
+	count, rows = queries
+	assert 'USING INDEX ix_milestone_due (deadline>? AND deadline<?)' in count
+	assert 'USING INDEX ix_milestone_user_deadline (user_id=? AND deadline>? AND deadline<?)' in rows
+	assert 'SCAN milestone' not in count + rows
+
+def test_window(milestones):
+	'''Without a start every overdue milestone is included'''
+	upcoming = list(reminders.digests(TODAY, TODAY + timedelta(days=1), today=TODAY))
+	assert [len(digest.reminders) for digest in upcoming] == [2]
+	overdue = list(reminders.digests(None, TODAY, today=TODAY))
+	assert [reminder.deadline for reminder in overdue[0].reminders] == [TODAY - timedelta(days=2), TODAY]
+
+def test_send_reminders_to_a_file(milestones, tmp_path):
+	'''The file sink writes a JSON line per user'''
+	path = tmp_path / 'reminders.ndjson'
+	sink = reminders.make_sink({'REMINDER_SINK': 'file', 'REMINDER_FILE': str(path)})
+	assert reminders.send_reminders(sink, None, TODAY + timedelta(days=7), today=TODAY) == (2, 6)
+
+	lines = [json.loads(line) for line in path.read_text().splitlines()]
+	assert [line['username'] for line in lines] == ['alice', 'carol']
+	assert lines[1]['reminders'][0] == {'milestone_id': 9, 'habit_id': 4, 'habit_title': 'write', 'text': 'by 2020-06-20', 'deadline': '2020-06-20', 'overdue': False}
+
+def test_send_reminders_command(milestones, tmp_path):
+	path = tmp_path / 'reminders.ndjson'
+	app.config['REMINDER_FILE'] = str(path)
+	try:
+		result = app.test_cli_runner().invoke(args=['send-reminders', '--start', '2020-06-15', '--end', '2020-07-15'])
+	finally:
+		app.config['REMINDER_FILE'] = 'reminders.ndjson'
+	assert 'Done: 6 reminders sent to 3 users' in result.output
+	assert len(path.read_text().splitlines()) == 3
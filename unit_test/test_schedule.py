@@ -0,0 +1,50 @@
+import pytest
+from types import SimpleNamespace
+from datetime import datetime, date, timedelta
+from web.schedule import due_pairs
+
+def original_is_due(habit, day):
+	'''The check the dashboard used to run inline for one habit and one day'''
+	if not habit.date_created <= datetime.combine(day, datetime.min.time()):
+		return False
+	gap = (day - habit.last_modified.date()).days
+	weekly_test =  gap > 0 and gap % 7 == 0
+	monthly_test =  gap > 0 and gap % 30 == 0
+	return ((habit.frequency == 'daily')
+		or (habit.frequency == 'weekly' and weekly_test)
+		or (habit.frequency == 'monthly' and monthly_test))
+
+def make_habits():
+	'''Habits of every frequency, created at midnight or during the day, some with a later frequency change'''
+	habits = []
+	created = datetime(2020, 3, 1, 0, 0)
+	for i, frequency in enumerate(['daily', 'weekly', 'monthly', 'Daily', 'weekly', 'monthly', 'daily', 'weekly']):
+		date_created = created + timedelta(days=i, hours=13 * (i % 2))
+		last_modified = date_created + timedelta(days=10 * (i % 3), hours=2)
+		habits.append(SimpleNamespace(id=i + 1, frequency=frequency, date_created=date_created, last_modified=last_modified))
+	return habits
+
+def test_matches_dashboard_semantics():
+	'''Due days over a range are exactly the days the old inline check would create a log for'''
+	habits = make_habits()
+	start, end = date(2020, 2, 20), date(2020, 7, 1)
+	expected = [(habit.id, start + timedelta(days=i))
+		for i in range((end - start).days + 1)
+		for habit in habits if original_is_due(habit, start + timedelta(days=i))]
+	assert due_pairs(habits, start, end) == expected
+
+	for i in range((end - start).days + 1):
+		day = start + timedelta(days=i)
+		assert [habit_id for habit_id, _ in due_pairs(habits, day, day)] == [h.id for h in habits if original_is_due(h, day)]
+
+def test_weekly_habit_is_not_due_on_its_first_day():
+	'''Weekly habits get their next log one week after they were created'''
+	habit = SimpleNamespace(id=1, frequency='weekly', date_created=datetime(2020, 1, 1), last_modified=datetime(2020, 1, 1, 9))
+	assert due_pairs([habit], date(2020, 1, 1), date(2020, 1, 1)) == []
+	assert due_pairs([habit], datetime(2020, 1, 8), datetime(2020, 1, 8)) == [(1, date(2020, 1, 8))]
+	assert due_pairs([habit], date(2020, 1, 1), date(2020, 1, 31)) == [(1, date(2020, 1, d)) for d in (8, 15, 22, 29)]
+
+def test_empty_range():
+	habit = SimpleNamespace(id=1, frequency='daily', date_created=datetime(2020, 1, 1), last_modified=datetime(2020, 1, 1))
+	assert due_pairs([habit], date(2020, 1, 5), date(2020, 1, 4)) == []
+	assert due_pairs([habit], date(2019, 12, 1), date(2019, 12, 31)) == [] # before it was created
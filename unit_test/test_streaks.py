@@ -0,0 +1,36 @@
+import pytest
+from datetime import date, timedelta
+from web.streaks import compute_streaks
+
+def days(*offsets, step=1):
+	'''Sorted dates, offsets are counted in periods from Jan 1st 2020'''
+	return [date(2020, 1, 1) + timedelta(days=i * step) for i in offsets]
+
+def test_no_completions():
+	'''A habit that was never completed has no streak'''
+	assert compute_streaks([], 'daily') == (0, 0)
+
+def test_daily_streaks():
+	'''The current streak ends on the last completion, the longest can be an earlier one'''
+	dates = days(0, 1, 2, 3, 5, 6)
+	assert compute_streaks(dates, 'daily') == (2, 4)
+
+def test_current_streak_as_of():
+	'''The current streak can be asked for any day'''
+	dates = days(0, 1, 2, 3, 5, 6)
+	assert compute_streaks(dates, 'daily', as_of=days(2)[0]) == (3, 4)
+	assert compute_streaks(dates, 'daily', as_of=days(4)[0]) == (0, 4)
+
+def test_weekly_and_monthly_streaks():
+	'''Consecutive completions are one week or 30 days apart'''
+	weekly = days(0, 1, 2, step=7)
+	assert compute_streaks(weekly, 'weekly') == (3, 3)
+	assert compute_streaks(weekly, 'daily') == (1, 1)
+	monthly = days(0, 1, 3, 4, 5, step=30)
+	assert compute_streaks(monthly, 'monthly') == (3, 3)
+	assert compute_streaks(monthly, 'monthly', as_of=days(1, step=30)[0]) == (2, 3)
+
+def test_duplicate_dates_count_once():
+	'''Two completed logs on the same day do not make the streak longer'''
+	dates = days(0, 1, 1, 2)
+	assert compute_streaks(dates, 'daily') == (3, 3)
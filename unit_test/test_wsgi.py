@@ -0,0 +1,36 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
+from web.database import refuse_foreign_connections
+
+@pytest.fixture
+def engine(tmp_path):
+	'''A pooled engine on a SQLite file, refusing the connections of other processes like the ones of web.wsgi'''
+	engine = create_engine('sqlite:///{}'.format(tmp_path / 'fork.db'), poolclass=QueuePool)
+	refuse_foreign_connections(engine)
+	yield engine
+	engine.dispose()
+
+def test_connections_are_not_shared_across_forks(engine):
+	'''A pooled connection opened by another process is replaced instead of being reused'''
+	connection = engine.connect()
+	inherited = connection.connection.connection
+	connection.connection._connection_record.info['pid'] = -1 # as if opened before a fork
+	connection.close()
+
+	connection = engine.connect()
+	assert connection.connection.connection is not inherited
+	assert connection.execute('SELECT 1').scalar() == 1
+	connection.close()
+
+def test_connection_without_a_pid_is_replaced(engine):
+	'''A connection opened before the pids were recorded may come from any process, so it is replaced too'''
+	connection = engine.connect()
+	inherited = connection.connection.connection
+	del connection.connection._connection_record.info['pid']
+	connection.close()
+
+	connection = engine.connect()
+	assert connection.connection.connection is not inherited
+	assert connection.execute('SELECT 1').scalar() == 1
+	connection.close()
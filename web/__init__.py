@@ -1,30 +1,139 @@
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
 import os
+import sys
+import types
 from flask_login import LoginManager
 
-# this might solve the problem of os.getenv 
+# this might solve the problem of os.getenv
 from dotenv import load_dotenv
 load_dotenv()
 
 
-app = Flask(__name__)
+def default_config():
+    '''The settings read from the environment (and .env)'''
+    config = {}
+    config['SQLALCHEMY_DATABASE_URI'] = os.getenv('SQLALCHEMY_DATABASE_URI')
+    config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('SQLALCHEMY_DATABASE_URI')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')
-app.config['FLASK_ENV'] = os.getenv('development')
-app.config['FLASK_APP'] = os.getenv('web')
+    # connection pool and per-connection settings, see web/database.py
+    config['DB_POOL_SIZE'] = int(os.getenv('DB_POOL_SIZE', 5))
+    config['DB_MAX_OVERFLOW'] = int(os.getenv('DB_MAX_OVERFLOW', 10))
+    config['DB_POOL_TIMEOUT'] = float(os.getenv('DB_POOL_TIMEOUT', 30))
+    config['DB_POOL_RECYCLE'] = int(os.getenv('DB_POOL_RECYCLE', 1800))
+    config['DB_POOL_PRE_PING'] = os.getenv('DB_POOL_PRE_PING', 'true').lower() != 'false'
+    config['DB_STATEMENT_TIMEOUT'] = int(os.getenv('DB_STATEMENT_TIMEOUT', 0)) # ms, 0 for no timeout
+    config['SQLITE_TUNING'] = os.getenv('SQLITE_TUNING', 'true').lower() != 'false'
+    config['SQLITE_JOURNAL_MODE'] = os.getenv('SQLITE_JOURNAL_MODE', 'wal')
+    config['SQLITE_SYNCHRONOUS'] = os.getenv('SQLITE_SYNCHRONOUS', 'normal')
+    config['SQLITE_BUSY_TIMEOUT'] = int(os.getenv('SQLITE_BUSY_TIMEOUT', 5000)) # ms
+    config['SQLITE_CACHE_SIZE'] = int(os.getenv('SQLITE_CACHE_SIZE', 16384)) # KiB per connection
+    config['SECRET_KEY'] = os.getenv('SECRET_KEY')
+    config['FLASK_ENV'] = os.getenv('development')
+    config['FLASK_APP'] = os.getenv('web')
+    # set to false once `flask generate-logs` runs nightly, so that the dashboard GET stops writing
+    config['MATERIALIZE_ON_READ'] = os.getenv('MATERIALIZE_ON_READ', 'true').lower() != 'false'
 
-db = SQLAlchemy(app)
+    # in-process LRU cache by default, see web/cache.py for the other backends
+    config['CACHE_BACKEND'] = os.getenv('CACHE_BACKEND', 'lru')
+    config['CACHE_MAX_SIZE'] = int(os.getenv('CACHE_MAX_SIZE', 1024))
+    config['CACHE_TTL'] = float(os.getenv('CACHE_TTL', 300))
+    config['EXPOSE_CACHE_STATS'] = os.getenv('EXPOSE_CACHE_STATS', 'false').lower() == 'true'
 
-login_manager = LoginManager(app)
-login_manager.login_view = 'login'
-login_manager.init_app(app)
+    # detached copies of the logged in users, so that most requests authenticate without a query
+    config['USER_CACHE_MAX_SIZE'] = int(os.getenv('USER_CACHE_MAX_SIZE', 4096))
+    config['USER_CACHE_TTL'] = float(os.getenv('USER_CACHE_TTL', 60))
+
+    # where the completion history is kept while moving from logs to bitmaps: 'logs', 'dual' or 'bitmaps' (see web/history.py)
+    config['HISTORY_STORAGE'] = os.getenv('HISTORY_STORAGE', 'logs')
+
+    # statements, database time and duplicate queries of every request, see web/instrumentation.py
+    config['SQL_INSTRUMENTATION'] = os.getenv('SQL_INSTRUMENTATION', 'false').lower() == 'true'
+    config['SQL_QUERY_BUDGET'] = int(os.getenv('SQL_QUERY_BUDGET', 0)) # 0 for no budget
+    config['SQL_QUERY_BUDGET_STRICT'] = os.getenv('SQL_QUERY_BUDGET_STRICT', 'false').lower() == 'true'
+
+    # where `flask send-reminders` sends the digests of milestones due soon: 'file', 'null' or a factory (see web/reminders.py)
+    config['REMINDER_SINK'] = os.getenv('REMINDER_SINK', 'file')
+    config['REMINDER_FILE'] = os.getenv('REMINDER_FILE', 'reminders.ndjson')
+
+    # Prometheus metrics on /metrics, added up over the worker processes through METRICS_DIR (see web/monitoring.py)
+    config['METRICS'] = os.getenv('METRICS', 'true').lower() != 'false'
+    config['METRICS_DIR'] = os.getenv('METRICS_DIR')
+    config['METRICS_DUMP_INTERVAL'] = float(os.getenv('METRICS_DUMP_INTERVAL', 1))
+    return config
+
+# the extensions are bound to an app by create_app(); none of them connects to the database until it is used
+from .database import Database
+db = Database()
+
+from .cache import Cache
+cache = Cache()
+
+from .instrumentation import SQLInstrumentation
+sql_instrumentation = SQLInstrumentation()
+
+from .monitoring import Metrics
+metrics = Metrics()
+
+login_manager = LoginManager()
+login_manager.login_view = 'web.login'
 
 from .models import User
+from .cache import LRUCache, MISSING
+from sqlalchemy import event
+from werkzeug.local import LocalProxy
+
+# the LRUCache of the app of the current context (or the one db is bound to), see create_app()
+user_cache = LocalProxy(lambda: db.get_app().extensions['user_cache'])
+
 @login_manager.user_loader
 def load_user(id):
-    return User.query.get(int(id))
+    user = user_cache.get(int(id))
+    if user is MISSING:
+        user = User.query.get(int(id))
+        if user is None:
+            return None
+        db.session.expunge(user) # the cached copy must not belong to this request's session
+        user_cache.set(user.id, user)
+    return db.session.merge(user, load=False) # a copy attached to this request's session, without a query
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def forget_user(mapper, connection, user):
+    user_cache.delete(user.id)
+
+def create_app(config=None):
+    '''Returns the app configured from the environment, with the settings of config on top.
+
+    Nothing is sent to the database here: the tables of a new database are created with `flask init-db`
+    and an existing one is brought up to date with `flask upgrade-db`.
+    '''
+    app = Flask(__name__)
+    app.config.update(default_config())
+    app.config.update(config or {})
+
+    db.init_app(app)
+    cache.init_app(app)
+    sql_instrumentation.init_app(app)
+    metrics.init_app(app)
+    login_manager.init_app(app)
+    app.extensions['user_cache'] = LRUCache(app.config['USER_CACHE_MAX_SIZE'], app.config['USER_CACHE_TTL'])
+
+    from . import serve, api
+    app.register_blueprint(serve.bp)
+    app.register_blueprint(api.bp)
+    app.shell_context_processor(serve.make_shell_context)
+    return app
+
+class LazyApp:
+    '''`web.app`, the app of `flask run` and of WSGI servers (web:app), created on first use'''
+
+    def __get__(self, module, owner):
+        if module is None:
+            return self
+        module.app = create_app() # kept in the module's __dict__, which takes precedence from now on
+        return module.app
+
+class WebModule(types.ModuleType):
+    app = LazyApp() # a module __getattr__ would need Python 3.7
 
-from web import serve, models
+sys.modules[__name__].__class__ = WebModule
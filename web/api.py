@@ -0,0 +1,325 @@
+'''Versioned JSON API for the mobile clients, next to the HTML routes of serve.py.
+
+Every write to a user's habits, logs or milestones bumps User.data_version. GET responses carry an
+ETag made of that version and the requested URL, so a client polling with If-None-Match gets a
+304 after a single primary key lookup, without the data being queried or serialized again.
+'''
+import json
+from datetime import datetime, date, timedelta
+from functools import partial, wraps
+from hashlib import sha1
+from flask import Blueprint, current_app, request, jsonify, Response, g, stream_with_context
+from flask_login import current_user
+from sqlalchemy import func
+from web import db, cache
+from .cache import MISSING
+from .models import User, Habit, Log, touch_users
+from .schedule import FREQUENCY_DAYS
+from .serve import materialize_logs, create_habit, delete_habit
+from . import progress, export, imports, milestones
+
+API = '/api/v1'
+MAX_DAYS = 366 # longest date range a client can ask for at once
+HISTORY_DAYS = 365 # days in a history (heatmap)
+
+bp = Blueprint('api', __name__)
+
+def error(message, status=400):
+    return jsonify({'error': message}), status
+
+def api_login_required(view):
+    '''Like login_required, but answers 401 instead of redirecting to the login page'''
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not current_user.is_authenticated:
+            return error('Authentication required', 401)
+        return view(*args, **kwargs)
+    return wrapper
+
+def current_etag(*parts):
+    '''ETag of the requested resource for the current version of the user's data, and the given parts if any'''
+    # read from the database: the logged in user may be a cached copy from before another worker's write
+    version = db.session.query(User.data_version).filter(User.id == current_user.id).scalar()
+    url = sha1(' '.join((request.full_path,) + parts).encode('utf-8')).hexdigest()[:16]
+    return '{}-{}-{}'.format(current_user.id, version, url)
+
+def conditional(view=None, *, vary=None):
+    '''Answers 304 when the client already has the current version of the resource.
+
+    vary, if given, returns what else than the URL and the user's data the response depends on
+    (like a default resolved from today's date), as a string that goes into the ETag.
+    '''
+    if view is None:
+        return partial(conditional, vary=vary)
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        parts = (vary(),) if vary else ()
+        etag = g.etag = current_etag(*parts)
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            etag = g.etag or current_etag(*parts) # views that write while reading (creating logs) reset g.etag
+        response.set_etag(etag)
+        return response
+    return wrapper
+
+def parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d')
+
+def habit_json(habit):
+    return {
+        'id': habit.id,
+        'title': habit.title,
+        'description': habit.description,
+        'frequency': habit.frequency,
+        'active': habit.active,
+        'date_created': habit.date_created.isoformat() if habit.date_created else None,
+        'last_modified': habit.last_modified.isoformat() if habit.last_modified else None
+    }
+
+def log_json(log):
+    return {'id': log.id, 'habit_id': log.habit_id, 'date': log.date.strftime('%Y-%m-%d'), 'status': bool(log.status)}
+
+def user_habit(habit_id):
+    return Habit.query.filter_by(id=habit_id, user_id=current_user.id).first()
+
+@bp.route(API + '/logs')
+@api_login_required
+@conditional
+def api_logs():
+    '''The user's active habits and their logs for ?date=YYYY-MM-DD, or for every day from ?start= to ?end='''
+    try:
+        start = parse_date(request.args.get('date') or request.args['start'])
+        end = parse_date(request.args.get('date') or request.args.get('end') or request.args['start'])
+    except (KeyError, ValueError):
+        return error('Expected date=YYYY-MM-DD or start=YYYY-MM-DD&end=YYYY-MM-DD')
+    if end < start or (end - start).days >= MAX_DAYS:
+        return error(f'The range must go forward and be at most {MAX_DAYS} days long')
+
+    if current_app.config['MATERIALIZE_ON_READ']:
+        try:
+            if materialize_logs(current_user.id, start, end):
+                g.etag = None # the version changed
+        except:
+            db.session.rollback()
+            return error('The logs could not be loaded', 500)
+
+    rows = (db.session.query(Habit, Log)
+        .filter(Habit.id == Log.habit_id, Log.user_id == current_user.id, Log.date >= start, Log.date <= end, Habit.active == True)
+        .order_by(Log.date, Habit.id))
+    days = {}
+    for i in range((end - start).days + 1):
+        day = (start + timedelta(days=i)).strftime('%Y-%m-%d')
+        days[day] = {'date': day, 'count': {'completed': 0, 'todo': 0}, 'habits': []}
+    for habit, log in rows:
+        day = days[log.date.strftime('%Y-%m-%d')]
+        day['habits'].append(dict(habit_json(habit), log=log_json(log)))
+        day['count']['completed' if log.status else 'todo'] += 1
+    return jsonify({'start': start.strftime('%Y-%m-%d'), 'end': end.strftime('%Y-%m-%d'), 'days': list(days.values())})
+
+@bp.route(API + '/logs/<action>', methods=['POST'])
+@api_login_required
+def api_check_off(action):
+    '''Checks off (action=done) or unchecks (action=undo) the logs {"date": "YYYY-MM-DD", "log_ids": [...]}'''
+    if action not in ('done', 'undo'):
+        return error('Unknown action', 404)
+    data = request.get_json(silent=True) or {}
+    try:
+        day = parse_date(data['date'])
+        log_ids = [int(i) for i in data['log_ids']]
+    except (KeyError, TypeError, ValueError):
+        return error('Expected {"date": "YYYY-MM-DD", "log_ids": [...]}')
+
+    try:
+        if action == 'done':
+            habit_ids = progress.check_off(current_user.id, log_ids, day)
+            milestones.evaluate(habit_ids)
+        else:
+            habit_ids = list(progress.undo(current_user.id, log_ids, day))
+        db.session.commit()
+    except:
+        db.session.rollback()
+        return error('The logs could not be updated', 500)
+    return jsonify({'habit_ids': sorted(habit_ids)})
+
+@bp.route(API + '/habits', methods=['GET', 'POST'])
+@api_login_required
+def api_habits():
+    if request.method == 'GET':
+        return api_habit_list()
+
+    data = request.get_json(silent=True) or {}
+    if not data.get('title'):
+        return error('A habit needs a title')
+    if data.get('frequency', 'daily') not in FREQUENCY_DAYS:
+        return error('frequency must be one of ' + ', '.join(FREQUENCY_DAYS))
+    try:
+        habit = create_habit(current_user.id, data['title'], data.get('description'), data.get('frequency', 'daily'))
+        touch_users([current_user.id])
+        db.session.commit()
+        cache.invalidate_user(current_user.id)
+    except:
+        db.session.rollback()
+        return error('The habit could not be added', 500)
+    return jsonify(habit_json(habit)), 201
+
+@conditional
+def api_habit_list():
+    '''The user's habits, only the active (?active=true) or archived (?active=false) ones if asked'''
+    habits = Habit.query.filter_by(user_id=current_user.id)
+    if 'active' in request.args:
+        habits = habits.filter_by(active=request.args['active'].lower() == 'true')
+    return jsonify({'habits': [habit_json(habit) for habit in habits.order_by(Habit.id)]})
+
+@bp.route(API + '/habits/<int:habit_id>', methods=['GET', 'PATCH', 'DELETE'])
+@api_login_required
+def api_habit(habit_id):
+    if request.method == 'GET':
+        return api_habit_detail(habit_id)
+
+    habit = user_habit(habit_id)
+    if habit is None:
+        return error('No such habit', 404)
+
+    if request.method == 'DELETE':
+        try:
+            delete_habit(habit)
+            touch_users([current_user.id])
+            db.session.commit()
+            cache.invalidate_user(current_user.id)
+        except:
+            db.session.rollback()
+            return error('The habit could not be deleted', 500)
+        return '', 204
+
+    data = request.get_json(silent=True) or {}
+    if 'title' in data and not data['title']:
+        return error('A habit needs a title')
+    if 'frequency' in data and data['frequency'] not in FREQUENCY_DAYS:
+        return error('frequency must be one of ' + ', '.join(FREQUENCY_DAYS))
+    if 'active' in data and not isinstance(data['active'], bool):
+        return error('active must be true or false')
+    try:
+        for field in ('title', 'description', 'active'):
+            if field in data:
+                setattr(habit, field, data[field])
+        if 'frequency' in data:
+            progress.change_frequency(habit, data['frequency']) # streaks are counted in periods of the frequency
+            habit.last_modified = datetime.today() # due dates are counted from the last frequency change
+        touch_users([current_user.id])
+        db.session.commit()
+        cache.invalidate_user(current_user.id)
+    except:
+        db.session.rollback()
+        return error('The habit could not be updated', 500)
+    return jsonify(habit_json(habit))
+
+@conditional
+def api_habit_detail(habit_id):
+    '''A habit of the user with its progress'''
+    habit = user_habit(habit_id)
+    if habit is None:
+        return error('No such habit', 404)
+    record = progress.get_progress(habit)
+    return jsonify(dict(habit_json(habit), progress={
+        'total_completions': record.total_completions,
+        'current_streak': record.current_streak,
+        'longest_streak': record.longest_streak,
+        'last_completed': record.last_completed.isoformat() if record.last_completed else None
+    }))
+
+def history_data(user_id, start, end, habit_id=None):
+    '''Number of completed and of scheduled logs for every day from start to end (datetimes, included).
+
+    One range query grouped by day and status, answered from the (user_id, date, status) index. Days
+    whose logs were never created (see `flask generate-logs`) count as nothing scheduled.
+    '''
+    rows = db.session.query(Log.date, Log.status, func.count(Log.id)).filter(Log.user_id == user_id, Log.date >= start, Log.date <= end)
+    if habit_id is not None:
+        rows = rows.filter(Log.habit_id == habit_id)
+    days = (end - start).days + 1
+    completed, scheduled = [0] * days, [0] * days
+    for day, status, n in rows.group_by(Log.date, Log.status):
+        i = (day - start).days
+        scheduled[i] += n
+        if status:
+            completed[i] += n
+    return {
+        'start': start.strftime('%Y-%m-%d'),
+        'end': end.strftime('%Y-%m-%d'),
+        'habit_id': habit_id,
+        'completed': completed,
+        'scheduled': scheduled
+    }
+
+@bp.route(API + '/history', defaults={'habit_id': None})
+@bp.route(API + '/habits/<int:habit_id>/history')
+@api_login_required
+@conditional(vary=lambda: request.args.get('end', str(date.today()))) # without ?end= the year ends today, a new one every day
+def api_history(habit_id):
+    '''Completed and scheduled logs per day over the year ending on ?end=YYYY-MM-DD (default today), of one habit or of all of them.
+
+    The rendered JSON is cached under the ETag, which changes with every write to the user's data and
+    with the last day, so loading a heatmap again costs the version lookup only.
+    '''
+    try:
+        end = parse_date(request.args['end']) if 'end' in request.args else datetime.combine(date.today(), datetime.min.time())
+    except ValueError:
+        return error('Expected end=YYYY-MM-DD')
+
+    body = cache.get(current_user.id, 'history', g.etag)
+    if body is MISSING:
+        if habit_id is not None and user_habit(habit_id) is None:
+            return error('No such habit', 404)
+        body = json.dumps(history_data(current_user.id, end - timedelta(days=HISTORY_DAYS - 1), end, habit_id))
+        cache.set(current_user.id, 'history', g.etag, value=body)
+    return Response(body, mimetype='application/json')
+
+@bp.route(API + '/export')
+@api_login_required
+def api_export():
+    '''All the user's habits, logs and milestones as ?format=ndjson (default) or csv, streamed and gzipped if the client accepts it'''
+    format = request.args.get('format', 'ndjson')
+    if format not in export.FORMATS:
+        return error('format must be one of ' + ', '.join(export.FORMATS))
+    compress = 'gzip' in request.accept_encodings
+    response = Response(stream_with_context(export.export(current_user.id, format, compress)), mimetype=export.MIMETYPES[format])
+    response.headers['Content-Disposition'] = 'attachment; filename=habits.' + format
+    response.vary.add('Accept-Encoding')
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+@bp.route(API + '/import', methods=['POST'])
+@api_login_required
+def api_import():
+    '''Imports the habits, logs and milestones of an uploaded CSV or NDJSON file (see web/imports.py), gzipped or not'''
+    upload = request.files.get('file')
+    if upload is None:
+        return error('Expected a file upload named file')
+    format = request.args.get('format')
+    if format is not None and format not in imports.FORMATS:
+        return error('format must be one of ' + ', '.join(imports.FORMATS))
+    try:
+        summary = imports.import_file(current_user.id, upload.stream, format)
+        db.session.commit()
+        cache.invalidate_user(current_user.id)
+    except imports.InvalidImport as e:
+        db.session.rollback()
+        return jsonify({'error': 'The file has invalid records', 'records': [{'line': line, 'error': message} for line, message in e.errors]}), 400
+    except:
+        db.session.rollback()
+        return error('The file could not be imported', 500)
+    return jsonify(summary._asdict()), 201
+
+@bp.route(API + '/stats/cache')
+@api_login_required
+def api_cache_stats():
+    '''Hit and miss counters of this worker's cache, to tune CACHE_MAX_SIZE and CACHE_TTL (only if EXPOSE_CACHE_STATS is set)'''
+    if not current_app.config['EXPOSE_CACHE_STATS']:
+        return error('Not found', 404)
+    return jsonify(cache.stats())
@@ -0,0 +1,174 @@
+'''Cache for data that is read far more often than it changes, like the dashboard of a user for a day.
+
+The views go through the Cache object below, which counts hits and misses. Entries are stored in a
+pluggable backend chosen with the CACHE_BACKEND setting:
+    'lru'  (default) an in-process LRU with a size limit (CACHE_MAX_SIZE) and a time to live (CACHE_TTL)
+    'null' caching turned off
+    'package.module:factory' any callable taking the app config and returning an object with the
+           get/set/delete/clear methods of LRUCache, e.g. to share the cache between worker processes
+
+The dashboard and sidebar entries of a user are keyed by User.data_version, which every write to the
+user's data bumps, so a write makes them unreachable whichever worker process or command makes it, with
+no invalidation to send around. Adding or editing a habit also drops every cached entry of that user.
+Every app made by create_app() has a backend and counters of its own, in app.extensions['cache'].
+'''
+import time
+import uuid
+from collections import OrderedDict
+from importlib import import_module
+from threading import Lock
+
+MISSING = object()
+
+class LRUCache:
+    '''Keeps at most maxsize entries for at most ttl seconds each, evicting the least recently used first'''
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.evictions = 0
+        self._entries = OrderedDict() # key -> (expiry time, value), least recently used first
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return MISSING
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return MISSING
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+class NullCache:
+    '''Never keeps anything'''
+
+    def get(self, key):
+        return MISSING
+
+    def set(self, key, value):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+    def __len__(self):
+        return 0
+
+def make_backend(config):
+    name = config.get('CACHE_BACKEND', 'lru')
+    if name == 'lru':
+        return LRUCache(int(config.get('CACHE_MAX_SIZE', 1024)), float(config.get('CACHE_TTL', 300)))
+    if name == 'null':
+        return NullCache()
+    module, factory = name.split(':')
+    return getattr(import_module(module), factory)(config)
+
+class CacheState:
+    '''The backend and counters of the cache of an app, kept in app.extensions['cache']'''
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = self.misses = 0
+
+class Cache:
+    '''What the views use: per-user entries on top of the backend of the current app, with hit and miss counters'''
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['cache'] = CacheState(make_backend(app.config))
+
+    @property
+    def state(self):
+        from web import db
+        return db.get_app().extensions['cache'] # the app of the current context, or the one db is bound to
+
+    @property
+    def backend(self):
+        return self.state.backend
+
+    @property
+    def hits(self):
+        return self.state.hits
+
+    @property
+    def misses(self):
+        return self.state.misses
+
+    def _namespace(self, user_id):
+        '''Token prefixed to all the keys of a user; replacing it invalidates all of them at once'''
+        token = self.backend.get(('user', user_id))
+        if token is MISSING:
+            token = uuid.uuid4().hex
+            self.backend.set(('user', user_id), token)
+        return token
+
+    def key(self, user_id, *parts):
+        return (self._namespace(user_id),) + parts
+
+    def get(self, user_id, *parts):
+        '''Returns the cached value, or MISSING'''
+        state = self.state
+        value = state.backend.get(self.key(user_id, *parts))
+        if value is MISSING:
+            state.misses += 1
+        else:
+            state.hits += 1
+        return value
+
+    def set(self, user_id, *parts, value):
+        self.backend.set(self.key(user_id, *parts), value)
+
+    def get_or_set(self, user_id, *parts, compute):
+        '''Returns the cached value, computing and storing it with compute() on a miss'''
+        value = self.get(user_id, *parts)
+        if value is MISSING:
+            value = compute()
+            self.set(user_id, *parts, value=value)
+        return value
+
+    def delete(self, user_id, *parts):
+        self.backend.delete(self.key(user_id, *parts))
+
+    def invalidate_user(self, user_id):
+        '''Drops every entry of the user'''
+        self.backend.delete(('user', user_id))
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'size': len(self.backend),
+            'evictions': getattr(self.backend, 'evictions', 0)
+        }
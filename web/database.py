@@ -0,0 +1,94 @@
+'''Engine options and per-connection settings of the database, from the app config.
+
+Connection pool, for every database but SQLite in memory:
+    DB_POOL_SIZE          connections kept open by each worker process (at least WEB_THREADS)
+    DB_MAX_OVERFLOW       extra connections opened when they are all in use
+    DB_POOL_TIMEOUT       seconds to wait for a connection before failing
+    DB_POOL_RECYCLE       seconds after which a connection is replaced, before the server drops it
+    DB_POOL_PRE_PING      test connections before handing them out, replacing the ones that died
+    DB_STATEMENT_TIMEOUT  milliseconds after which PostgreSQL or MySQL (SELECTs only) cancels a statement, 0 for none
+
+SQLite profile, on with SQLITE_TUNING and applied to every new connection:
+    SQLITE_JOURNAL_MODE   'wal': readers no longer wait for the writer, nor the writer for the readers
+    SQLITE_SYNCHRONOUS    'normal': with WAL, a sync at checkpoints instead of at every commit. A power
+                          loss can undo the last commits but never corrupts the file.
+    SQLITE_BUSY_TIMEOUT   milliseconds a writer waits for another one to commit before "database is locked"
+    SQLITE_CACHE_SIZE     KiB of page cache of each connection
+The connections to a SQLite file are then pooled, so that they keep their cache between requests,
+instead of being opened for every request.
+'''
+import os
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+def in_memory(sa_url):
+    return sa_url.drivername.startswith('sqlite') and sa_url.database in (None, '', ':memory:')
+
+def engine_options(config, sa_url):
+    '''Keyword arguments of create_engine() for the database of sa_url'''
+    options = {'pool_pre_ping': config['DB_POOL_PRE_PING']}
+    if in_memory(sa_url):
+        return options # a single connection (StaticPool), or the data would be lost
+    if sa_url.drivername.startswith('sqlite'):
+        if not config['SQLITE_TUNING']:
+            return options # a new connection for every request (NullPool)
+        # sqlite3 connections refuse to be used by another thread than their own, even one at a time
+        options.update(poolclass=QueuePool, connect_args={'check_same_thread': False})
+    options.update(pool_size=config['DB_POOL_SIZE'], max_overflow=config['DB_MAX_OVERFLOW'],
+        pool_timeout=config['DB_POOL_TIMEOUT'], pool_recycle=config['DB_POOL_RECYCLE'])
+    return options
+
+def connection_statements(config, dialect):
+    '''Statements run on every new connection to a database of that dialect'''
+    if dialect == 'sqlite':
+        if not config['SQLITE_TUNING']:
+            return []
+        return ['PRAGMA journal_mode = {}'.format(config['SQLITE_JOURNAL_MODE']),
+            'PRAGMA synchronous = {}'.format(config['SQLITE_SYNCHRONOUS']),
+            'PRAGMA busy_timeout = {:d}'.format(config['SQLITE_BUSY_TIMEOUT']),
+            'PRAGMA cache_size = -{:d}'.format(config['SQLITE_CACHE_SIZE'])] # negative: in KiB instead of pages
+    timeout = config['DB_STATEMENT_TIMEOUT']
+    if timeout and dialect == 'postgresql':
+        return ['SET statement_timeout = {:d}'.format(timeout)]
+    if timeout and dialect == 'mysql':
+        return ['SET SESSION max_execution_time = {:d}'.format(timeout)]
+    return []
+
+def refuse_foreign_connections(target):
+    '''Makes the pools of target (an engine, or Pool for every pool) replace the connections another process opened.
+
+    A connection is remembered with the pid of the process that opened it. One checked out in another
+    process, or opened before this was set up and so by any process, is forgotten without being closed
+    and the pool opens a new one.
+    '''
+    @event.listens_for(target, 'connect')
+    def remember_pid(dbapi_connection, connection_record):
+        connection_record.info['pid'] = os.getpid()
+
+    @event.listens_for(target, 'checkout')
+    def check_pid(dbapi_connection, connection_record, connection_proxy):
+        pid = os.getpid()
+        owner = connection_record.info.get('pid')
+        if owner != pid:
+            connection_record.connection = connection_proxy.connection = None # forgotten, not closed
+            raise exc.DisconnectionError('Connection opened by process {} checked out in process {}'.format(owner or 'unknown', pid))
+
+class Database(SQLAlchemy):
+    '''Flask-SQLAlchemy with the settings above; SQLALCHEMY_ENGINE_OPTIONS still has the last word'''
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        super().apply_driver_hacks(app, sa_url, options)
+        options.update(engine_options(app.config, sa_url))
+
+    def create_engine(self, sa_url, engine_opts):
+        engine = super().create_engine(sa_url, engine_opts)
+        statements = connection_statements(self.get_app().config, engine.dialect.name)
+        if statements:
+            @event.listens_for(engine, 'connect')
+            def configure(dbapi_connection, connection_record):
+                cursor = dbapi_connection.cursor()
+                for statement in statements:
+                    cursor.execute(statement)
+                cursor.close()
+        return engine
@@ -0,0 +1,77 @@
+'''Export of the users' data (users, habits, logs and milestones) as CSV or newline delimited JSON.
+
+Rows are read with yield_per, which also asks the driver for a server-side cursor where it has one,
+and written out in chunks as they come, so memory use stays the same however long the history is.
+Every record has a `record` field telling what it is: user, habit, log or milestone. The CSV has one
+column per field of any record and leaves the ones that don't apply empty.
+'''
+import csv
+import io
+import json
+import zlib
+from web import db
+from .models import User, Habit, Log, Milestone
+from .schedule import as_date
+
+FORMATS = ('csv', 'ndjson')
+MIMETYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+COLUMNS = ['record', 'id', 'user_id', 'habit_id', 'username', 'title', 'description', 'frequency', 'active',
+    'date_created', 'last_modified', 'date', 'status', 'text', 'type', 'threshold', 'deadline', 'complete']
+BATCH_SIZE = 1000 # rows fetched from the database at a time
+CHUNK_SIZE = 64 * 1024 # characters written out at a time
+
+def isoformat(value):
+    return value.isoformat() if value is not None else None
+
+def records(user_id=None):
+    '''Yields the users, habits, logs and milestones of the user (of every user if None) as dicts, in that order'''
+    def rows(query, owner, *order):
+        if user_id is not None:
+            query = query.filter(owner == user_id)
+        return query.order_by(*order).yield_per(BATCH_SIZE)
+
+    for row in rows(db.session.query(User.id, User.username), User.id, User.id): # never the password
+        yield {'record': 'user', 'id': row.id, 'username': row.username}
+    for row in rows(db.session.query(Habit), Habit.user_id, Habit.id):
+        yield {'record': 'habit', 'id': row.id, 'user_id': row.user_id, 'title': row.title, 'description': row.description,
+            'frequency': row.frequency, 'active': row.active, 'date_created': isoformat(row.date_created), 'last_modified': isoformat(row.last_modified)}
+    for row in rows(db.session.query(Log.id, Log.user_id, Log.habit_id, Log.date, Log.status), Log.user_id, Log.habit_id, Log.date):
+        yield {'record': 'log', 'id': row.id, 'user_id': row.user_id, 'habit_id': row.habit_id,
+            'date': isoformat(as_date(row.date)), 'status': bool(row.status)}
+    for row in rows(db.session.query(Milestone), Milestone.user_id, Milestone.id):
+        yield {'record': 'milestone', 'id': row.id, 'user_id': row.user_id, 'habit_id': row.habit_id, 'text': row.text,
+            'type': row.type, 'threshold': row.threshold, 'deadline': isoformat(row.deadline), 'complete': bool(row.complete)}
+
+def serialize(records, format):
+    '''Yields the records as text in chunks of about CHUNK_SIZE characters'''
+    buffer = io.StringIO()
+    if format == 'csv':
+        writer = csv.DictWriter(buffer, COLUMNS)
+        writer.writeheader()
+        write = writer.writerow
+    else:
+        write = lambda record: buffer.write(json.dumps(record) + '\n')
+
+    for record in records:
+        write(record)
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def gzipped(chunks):
+    '''Compresses the text chunks into a gzip stream as they come'''
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) # 16 + MAX_WBITS: gzip header and trailer
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+def export(user_id=None, format='ndjson', compress=False):
+    '''Yields the data of the user (of every user if None) as bytes, gzipped if compress'''
+    chunks = serialize(records(user_id), format)
+    if compress:
+        return gzipped(chunks)
+    return (chunk.encode('utf-8') for chunk in chunks)
@@ -0,0 +1,203 @@
+'''Completion history of habits stored as bitmaps instead of one Log row per day.
+
+Each HabitHistory row holds one year of a habit: 365 bits (46 bytes), bit i set if the habit was
+completed i days after the start of that year, years being counted from the day the habit was
+created. A daily habit kept for ten years is 10 rows of 46 bytes instead of 3650 log rows, and
+counts, streaks and date ranges become masks, shifts and popcounts on a single integer.
+
+The Log table stays the source of truth while existing databases move over, following the
+HISTORY_STORAGE setting:
+    'logs'    (default) bitmaps are not used
+    'dual'    check-off and undo also update the bitmaps, progress is still computed from the logs
+    'bitmaps' check-off and undo update the bitmaps and progress is computed from them
+`flask build-history` (re)builds the bitmaps of every habit from its logs and reports the space they
+take next to the logs; run it after switching to 'dual' and before switching to 'bitmaps'.
+'''
+from collections import defaultdict, namedtuple
+from datetime import date
+from sqlalchemy import text
+from web import db
+from .models import Habit, Log, HabitHistory
+from .schedule import period, as_date
+from .streaks import Streaks
+
+YEAR_DAYS = 365
+YEAR_BYTES = (YEAR_DAYS + 7) // 8
+
+def writes_enabled():
+    return db.get_app().config['HISTORY_STORAGE'] in ('dual', 'bitmaps')
+
+def reads_enabled():
+    return db.get_app().config['HISTORY_STORAGE'] == 'bitmaps'
+
+def origin(habit):
+    '''Ordinal of the day bit 0 of year 0 stands for: the day the habit was created'''
+    return as_date(habit.date_created).toordinal()
+
+def to_int(bits):
+    return int.from_bytes(bits, 'little')
+
+def to_bytes(value):
+    return value.to_bytes(YEAR_BYTES, 'little')
+
+def popcount(value):
+    return bin(value).count('1')
+
+class History:
+    '''The completions of one habit as a single integer, bit i set if it was completed on the day with ordinal start + i'''
+
+    def __init__(self, start, bits=0):
+        self.start = start
+        self.bits = bits
+
+    @classmethod
+    def from_rows(cls, origin, rows):
+        '''Joins the yearly rows of a habit created on the day with ordinal origin'''
+        rows = list(rows)
+        first = min((row.year for row in rows), default=0) # completions before the habit was created make negative years
+        bits = 0
+        for row in rows:
+            bits |= to_int(row.bits) << ((row.year - first) * YEAR_DAYS)
+        return cls(origin + first * YEAR_DAYS, bits)
+
+    def _offset(self, day):
+        return as_date(day).toordinal() - self.start
+
+    def _mask(self, start, end):
+        '''Bits of the days from start to end (included), either of which can be None for no limit'''
+        lo = max(0, self._offset(start)) if start is not None else 0
+        hi = self._offset(end) if end is not None else self.bits.bit_length() - 1
+        if hi < lo:
+            return 0
+        return ((1 << (hi - lo + 1)) - 1) << lo
+
+    def count(self, start=None, end=None):
+        '''Number of completions from start to end (included), all of them by default'''
+        return popcount(self.bits & self._mask(start, end))
+
+    def dates(self, start=None, end=None):
+        '''Sorted dates of the completions from start to end (included), all of them by default'''
+        bits = self.bits & self._mask(start, end)
+        days = []
+        while bits:
+            lowest = bits & -bits
+            days.append(date.fromordinal(self.start + lowest.bit_length() - 1))
+            bits ^= lowest
+        return days
+
+    def last_completed(self):
+        return date.fromordinal(self.start + self.bits.bit_length() - 1) if self.bits else None
+
+    def _links(self, step):
+        '''Bit i set if days i and i + step were both completed with no completion in between'''
+        between = 0
+        for gap in range(1, step):
+            between |= self.bits >> gap
+        return self.bits & self.bits >> step & ~between
+
+    def streaks(self, frequency, as_of=None):
+        '''Like streaks.compute_streaks: the streak ending on as_of (or on the last completion) and the longest one.
+
+        A streak of n completions is n - 1 links one period apart. After k rounds of links &= links >> step,
+        bit i is only still set if the links on days i, i + step, ..., i + k * step all exist, so the
+        number of rounds until nothing is left is the longest streak minus one.
+        '''
+        if not self.bits:
+            return Streaks(0, 0)
+        step = period(frequency)
+        links = self._links(step)
+
+        current = 0
+        offset = self._offset(as_of) if as_of is not None else self.bits.bit_length() - 1
+        if offset >= 0 and self.bits >> offset & 1:
+            current = 1
+            while offset >= step and links >> (offset - step) & 1:
+                current += 1
+                offset -= step
+
+        longest = 1
+        while links:
+            links &= links >> step
+            longest += 1
+        return Streaks(current, longest)
+
+def load(habit):
+    '''The history of habit, from its bitmap rows'''
+    return History.from_rows(origin(habit), HabitHistory.query.filter_by(habit_id=habit.id))
+
+def record(habit, day, completed):
+    '''Sets (completed) or clears the bit of day in the history of habit, in the session'''
+    year, bit = divmod(as_date(day).toordinal() - origin(habit), YEAR_DAYS)
+    row = HabitHistory.query.get((habit.id, year))
+    if row is None:
+        if not completed:
+            return
+        row = HabitHistory(habit_id=habit.id, year=year, user_id=habit.user_id, bits=to_bytes(0))
+        db.session.add(row)
+    value = to_int(row.bits)
+    row.bits = to_bytes(value | 1 << bit if completed else value & ~(1 << bit))
+
+def history_rows(habit_id, user_id, origin, dates):
+    '''Mappings of the bitmap rows of a habit completed on dates'''
+    years = defaultdict(int)
+    for day in dates:
+        year, bit = divmod(as_date(day).toordinal() - origin, YEAR_DAYS)
+        years[year] |= 1 << bit
+    return [{'habit_id': habit_id, 'year': year, 'user_id': user_id, 'bits': to_bytes(bits)} for year, bits in sorted(years.items())]
+
+def build(batch_size=500, report=None):
+    '''Rebuilds the bitmaps of all habits (archived ones included) from their completed logs.
+
+    Works batch_size habits at a time with one query for their completed logs, a bulk insert and a
+    commit per batch. report, if given, is called after each batch with the number of habits and of
+    bitmap rows done so far. Returns the number of bitmap rows written.
+    '''
+    last_id = habits_done = written = 0
+    while True:
+        batch = (db.session.query(Habit.id, Habit.user_id, Habit.date_created)
+            .filter(Habit.id > last_id).order_by(Habit.id).limit(batch_size).all())
+        if not batch:
+            return written
+        ids = [habit.id for habit in batch]
+        dates = defaultdict(list)
+        for habit_id, day in db.session.query(Log.habit_id, Log.date).filter(Log.habit_id.in_(ids), Log.status == True):
+            dates[habit_id].append(day)
+
+        rows = [row for habit in batch for row in history_rows(habit.id, habit.user_id, origin(habit), dates[habit.id])]
+        HabitHistory.query.filter(HabitHistory.habit_id.in_(ids)).delete(synchronize_session=False)
+        if rows:
+            db.session.bulk_insert_mappings(HabitHistory, rows)
+        db.session.commit()
+
+        last_id = batch[-1].id
+        habits_done += len(batch)
+        written += len(rows)
+        if report:
+            report(habits_done, written)
+
+StorageReport = namedtuple('StorageReport', ['log_rows', 'completed_logs', 'history_rows', 'history_bytes', 'log_disk_bytes', 'history_disk_bytes'])
+
+def disk_usage(tables):
+    '''Bytes used on disk by each table with its indexes, or None if the database can't tell'''
+    dialect = db.engine.dialect.name
+    try:
+        if dialect == 'sqlite':
+            rows = db.session.execute(text('SELECT m.tbl_name, SUM(s.pgsize) FROM dbstat s JOIN sqlite_master m ON s.name = m.name GROUP BY m.tbl_name'))
+            sizes = dict(rows.fetchall())
+            return {table: sizes.get(table, 0) for table in tables}
+        if dialect == 'postgresql':
+            return {table: db.session.execute(text('SELECT pg_total_relation_size(:table)'), {'table': table}).scalar() for table in tables}
+    except Exception: # e.g. SQLite compiled without the dbstat table
+        db.session.rollback()
+    return {table: None for table in tables}
+
+def storage_report():
+    '''How much space the logs and the bitmaps take'''
+    disk = disk_usage(['log', 'habit_history'])
+    return StorageReport(
+        log_rows=Log.query.count(),
+        completed_logs=Log.query.filter(Log.status == True).count(),
+        history_rows=HabitHistory.query.count(),
+        history_bytes=db.session.query(db.func.coalesce(db.func.sum(db.func.length(HabitHistory.bits)), 0)).scalar(),
+        log_disk_bytes=disk['log'],
+        history_disk_bytes=disk['habit_history'])
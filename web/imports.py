@@ -0,0 +1,235 @@
+'''Bulk import of habits and their history from CSV or newline delimited JSON, e.g. from another tracker.
+
+Every record is a habit, a log (a dated completion) or a custom milestone, told apart by a `record`
+field like in the files written by web/export.py, which can be imported back. Without that field a
+record with a date is a log and any other record is a habit. A log refers to its habit either by
+`habit_id`, the `id` of a habit record of the same file, or by `title`, the title of a habit record
+without an id; a title no habit record has makes a new daily habit. Every import creates new habits:
+nothing already in the database is changed.
+
+The whole file is validated in a first streaming pass that only keeps the days seen for each habit,
+and nothing is written if any record is invalid. The logs are then written with bulk inserts of
+BATCH_SIZE rows, together with the progress records, the default milestones that the history
+reaches and the bitmaps if they are enabled, all in one transaction.
+'''
+import csv
+import gzip
+import io
+import json
+from collections import namedtuple
+from datetime import datetime, date, time
+from itertools import chain
+from web import db
+from .models import Habit, Log, Milestone, HabitProgress, HabitHistory, touch_users
+from .schedule import FREQUENCY_DAYS
+from .progress import progress_values
+from . import history, milestones
+
+FORMATS = ('csv', 'ndjson')
+BATCH_SIZE = 10000 # rows per bulk insert
+ISO_FORMATS = ['%Y-%m-%d'] + ['%Y-%m-%d' + sep + time for sep in 'T ' for time in ('%H:%M', '%H:%M:%S', '%H:%M:%S.%f')]
+MAX_ERRORS = 20 # validation stops after this many invalid records
+
+ImportSummary = namedtuple('ImportSummary', ['habits', 'logs', 'milestones']) # milestones: the custom ones of the file
+
+class InvalidImport(ValueError):
+    '''The file has invalid records; errors is a list of (line number, message)'''
+
+    def __init__(self, errors):
+        super().__init__('; '.join(f'line {line}: {message}' for line, message in errors))
+        self.errors = errors
+
+class PendingHabit:
+    '''A habit of the file being validated, with the ordinals of the days it was completed or missed'''
+
+    def __init__(self, title, frequency='daily', description=None, active=True, date_created=None, last_modified=None):
+        self.title = title
+        self.frequency = frequency
+        self.description = description
+        self.active = active
+        self.date_created = date_created
+        self.last_modified = last_modified
+        self.defined = False # False while the habit is only known from the logs that refer to it
+        self.completed = set()
+        self.missed = set()
+        self.milestones = []
+
+def read_rows(file, format=None):
+    '''Yields (line number, record) for every record of a binary CSV or NDJSON file, gzipped or not.
+
+    The format is guessed from the first line if not given. A record is None if the line is not valid JSON.
+    '''
+    if hasattr(file, 'peek'): # a BufferedReader, e.g. standard input, which can't seek back
+        gzipped = file.peek(2)[:2] == b'\x1f\x8b'
+    else:
+        gzipped = file.read(2) == b'\x1f\x8b'
+        file.seek(0)
+    text = io.TextIOWrapper(gzip.GzipFile(fileobj=file, mode='rb') if gzipped else file, encoding='utf-8', newline='')
+    try:
+        first = text.readline()
+        if format is None:
+            format = 'ndjson' if first.lstrip().startswith('{') else 'csv'
+        lines = chain([first], text)
+        if format == 'csv':
+            reader = csv.DictReader(lines)
+            for row in reader:
+                yield reader.line_num, {field: value for field, value in row.items() if value not in ('', None)}
+        else:
+            for number, line in enumerate(lines, 1):
+                if line.strip():
+                    try:
+                        yield number, json.loads(line)
+                    except ValueError:
+                        yield number, None
+    finally:
+        text.detach() # leaves the file open for the caller
+
+def parse_bool(value, default):
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        return value
+    if str(value).lower() in ('true', '1', 'yes'):
+        return True
+    if str(value).lower() in ('false', '0', 'no'):
+        return False
+    raise ValueError(f'{value!r} is not true or false')
+
+def parse_datetime(value):
+    '''The datetime of an ISO date, or date and time (what datetime.fromisoformat() of Python 3.7 reads)'''
+    if value is None:
+        return None
+    value = str(value)
+    for format in ISO_FORMATS:
+        try:
+            return datetime.strptime(value, format)
+        except ValueError:
+            pass
+    raise ValueError(f'{value!r} is not an ISO date')
+
+def parse_day(value):
+    '''Ordinal of the day of an ISO date or datetime'''
+    if value is None:
+        raise ValueError('a date is required')
+    return parse_datetime(value).toordinal()
+
+def string(record, field, max_length, required=False):
+    value = record.get(field)
+    if value is None:
+        if required:
+            raise ValueError(f'{field} is required')
+        return None
+    value = str(value)
+    if len(value) > max_length:
+        raise ValueError(f'{field} is longer than {max_length} characters')
+    return value
+
+def validate(rows):
+    '''Checks every record and returns the habits of the file, raising InvalidImport if anything is wrong'''
+    habits = {} # ('id', id in the file) or ('title', title) -> PendingHabit
+    errors = []
+
+    def habit_for(record):
+        if record.get('habit_id') is not None:
+            return habits.setdefault(('id', str(record['habit_id'])), PendingHabit(None))
+        title = string(record, 'title', 100, required=True)
+        return habits.setdefault(('title', title), PendingHabit(title))
+
+    for line, record in rows:
+        try:
+            if not isinstance(record, dict):
+                raise ValueError('not a JSON object')
+            kind = record.get('record') or ('log' if 'date' in record else 'habit')
+            if kind == 'habit':
+                key = ('id', str(record['id'])) if record.get('id') is not None else ('title', string(record, 'title', 100, required=True))
+                habit = habits.setdefault(key, PendingHabit(None))
+                if habit.defined:
+                    raise ValueError('the habit is defined twice')
+                frequency = record.get('frequency', 'daily')
+                if frequency not in FREQUENCY_DAYS:
+                    raise ValueError('frequency must be one of ' + ', '.join(FREQUENCY_DAYS))
+                habit.title = string(record, 'title', 100, required=True)
+                habit.description = string(record, 'description', 500)
+                habit.frequency = frequency
+                habit.active = parse_bool(record.get('active'), True)
+                habit.date_created = parse_datetime(record.get('date_created'))
+                habit.last_modified = parse_datetime(record.get('last_modified'))
+                habit.defined = True
+            elif kind == 'log':
+                day, status = parse_day(record.get('date')), parse_bool(record.get('status'), True)
+                habit = habit_for(record)
+                if day in habit.completed or day in habit.missed:
+                    raise ValueError('the habit already has a log on that day')
+                (habit.completed if status else habit.missed).add(day)
+            elif kind == 'milestone':
+                if record.get('type', 'custom') == 'custom': # the others are made again from the history
+                    habit_for(record).milestones.append({
+                        'text': string(record, 'text', 200, required=True),
+                        'deadline': date.fromordinal(parse_day(record['deadline'])) if record.get('deadline') is not None else None,
+                        'complete': parse_bool(record.get('complete'), False)
+                    })
+            elif kind != 'user':
+                raise ValueError(f'unknown record {kind!r}')
+        except (KeyError, TypeError, ValueError) as e:
+            errors.append((line, str(e)))
+            if len(errors) >= MAX_ERRORS:
+                break
+
+    for (by, key), habit in habits.items():
+        if by == 'id' and not habit.defined and len(errors) < MAX_ERRORS:
+            errors.append((0, f'no habit record with id {key}'))
+    if errors:
+        raise InvalidImport(errors)
+    return list(habits.values())
+
+def log_batches(habits):
+    '''Mappings of the logs of the habits (with their ids), BATCH_SIZE at a time'''
+    batch, midnights = [], {} # the habits mostly share the same days
+    for habit, pending in habits:
+        for day in sorted(pending.completed | pending.missed):
+            if day not in midnights:
+                midnights[day] = datetime.combine(date.fromordinal(day), time.min)
+            batch.append({'user_id': habit.user_id, 'habit_id': habit.id, 'date': midnights[day], 'status': day in pending.completed})
+            if len(batch) == BATCH_SIZE:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+def import_file(user_id, file, format=None):
+    '''Validates and imports the habits, logs and milestones of file (binary) for the user, without committing.
+
+    Raises InvalidImport, having written nothing, if any record is invalid. Returns an ImportSummary.
+    '''
+    pending = validate(read_rows(file, format))
+
+    habits = []
+    for habit in pending:
+        days = sorted(habit.completed | habit.missed)
+        created = habit.date_created or (datetime.combine(date.fromordinal(days[0]), time.min) if days else datetime.today())
+        habits.append((Habit(user_id=user_id, title=habit.title, description=habit.description, frequency=habit.frequency,
+            active=habit.active, date_created=created, last_modified=habit.last_modified or created), habit))
+    db.session.add_all(habit for habit, _ in habits)
+    db.session.flush() # ids of the habits
+
+    logs = 0
+    for batch in log_batches(habits):
+        db.session.bulk_insert_mappings(Log, batch)
+        logs += len(batch)
+
+    progress, custom_milestones, bitmaps = [], 0, []
+    for habit, imported in habits:
+        dates = [date.fromordinal(day) for day in sorted(imported.completed)]
+        values = progress_values(dates, habit.frequency)
+        progress.append(dict(values, habit_id=habit.id, user_id=user_id))
+        for milestone in imported.milestones:
+            db.session.add(Milestone(user_id=user_id, habit_id=habit.id, type='custom', **milestone))
+        custom_milestones += len(imported.milestones)
+        if history.writes_enabled():
+            bitmaps.extend(history.history_rows(habit.id, user_id, history.origin(habit), dates))
+    db.session.bulk_insert_mappings(HabitProgress, progress)
+    if bitmaps:
+        db.session.bulk_insert_mappings(HabitHistory, bitmaps)
+    milestones.complete_reached(user_id) # the default milestones the imported history reached
+    touch_users([user_id])
+    return ImportSummary(len(habits), logs, custom_milestones)
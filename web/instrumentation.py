@@ -0,0 +1,108 @@
+'''Opt-in SQL statistics for every request: how many statements it sent, how long they took and which repeat.
+
+Turned on with the SQL_INSTRUMENTATION setting, which can also be changed while the app runs (e.g.
+in a test). Until it is first turned on no engine event listener is installed, so it costs nothing.
+While on, every response carries the headers
+    X-SQL-Queries     number of statements
+    X-SQL-Time        total time spent in the database (ms)
+    X-SQL-Slowest     time of the slowest statement (ms)
+    X-SQL-Duplicates  executions of a statement already sent during the request, the sign of an N+1 query
+and the same figures are logged at debug level with the slowest and the most repeated statements.
+
+With SQL_QUERY_BUDGET set, a request sending more statements is logged as a warning, and raises
+QueryBudgetExceeded if SQL_QUERY_BUDGET_STRICT is also set, which fails the test that made it.
+'''
+import time
+from collections import Counter
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+class RequestStats:
+    '''The statements of one request'''
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0 # seconds
+        self.slowest = (0.0, None) # (seconds, statement)
+        self.statements = Counter()
+
+    def add(self, statement, elapsed):
+        self.count += 1
+        self.total += elapsed
+        self.statements[statement] += 1
+        if elapsed > self.slowest[0]:
+            self.slowest = (elapsed, statement)
+
+    def duplicates(self):
+        return sum(n - 1 for n in self.statements.values())
+
+    def most_repeated(self):
+        '''(statement, executions) of the statement sent most often'''
+        return self.statements.most_common(1)[0] if self.statements else (None, 0)
+
+def shorten(statement, length=200):
+    statement = ' '.join(statement.split())
+    return statement if len(statement) <= length else statement[:length] + '...'
+
+class SQLInstrumentation:
+    '''Collects the statistics of every request while app.config['SQL_INSTRUMENTATION'] is on'''
+
+    def __init__(self, app=None):
+        self.listening = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self.start)
+        app.after_request(self.finish)
+
+    def listen(self):
+        '''Installs the engine event listeners, once'''
+        if not self.listening:
+            event.listen(Engine, 'before_cursor_execute', self.before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', self.after_cursor_execute)
+            self.listening = True
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('sql_instrumentation_start', []).append(time.perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['sql_instrumentation_start'].pop()
+        stats = g.get('sql_stats') if has_request_context() else None
+        if stats is not None:
+            stats.add(statement, elapsed)
+
+    def start(self):
+        if current_app.config['SQL_INSTRUMENTATION']:
+            self.listen()
+            g.sql_stats = RequestStats()
+
+    def finish(self, response):
+        stats = g.pop('sql_stats', None)
+        if stats is None:
+            return response
+        slowest, slowest_statement = stats.slowest
+        response.headers['X-SQL-Queries'] = str(stats.count)
+        response.headers['X-SQL-Time'] = '{:.3f}'.format(stats.total * 1000)
+        response.headers['X-SQL-Slowest'] = '{:.3f}'.format(slowest * 1000)
+        response.headers['X-SQL-Duplicates'] = str(stats.duplicates())
+
+        logger = current_app.logger
+        repeated, executions = stats.most_repeated()
+        logger.debug('%s %s: %d queries in %.3f ms, slowest %.3f ms: %s', request.method, request.full_path,
+            stats.count, stats.total * 1000, slowest * 1000, shorten(slowest_statement or ''))
+        if executions > 1:
+            logger.debug('%s %s: %d duplicate queries, sent %d times: %s', request.method, request.full_path,
+                stats.duplicates(), executions, shorten(repeated))
+
+        budget = current_app.config['SQL_QUERY_BUDGET']
+        if budget and stats.count > budget:
+            message = '{} {} sent {} queries, over the budget of {}'.format(request.method, request.full_path, stats.count, budget)
+            logger.warning(message)
+            if current_app.config['SQL_QUERY_BUDGET_STRICT']:
+                raise QueryBudgetExceeded(message)
+        return response
@@ -0,0 +1,50 @@
+'''Background jobs, run from the command line (see the commands registered in serve.py).'''
+from datetime import datetime, time
+from web import db, metrics
+from .models import Habit, Log, touch_users
+from . import schedule
+
+def habit_batches(batch_size):
+    '''Yields the active habits in batches of batch_size, using the id of the last habit as the cursor'''
+    last_id = 0
+    while True:
+        batch = (db.session.query(Habit.id, Habit.user_id, Habit.frequency, Habit.date_created, Habit.last_modified)
+            .filter(Habit.active == True, Habit.id > last_id)
+            .order_by(Habit.id)
+            .limit(batch_size)
+            .all())
+        if not batch:
+            return
+        yield batch
+        last_id = batch[-1].id
+
+def generate_logs(start, end, batch_size=500, report=None):
+    '''Creates the missing logs of all active habits of all users that are due between start and end (dates, included).
+
+    Habits are processed batch_size at a time: the logs that already exist for a batch are fetched
+    in one query, the missing ones are bulk inserted and the batch is committed before moving on,
+    so memory use does not depend on the number of habits. report, if given, is called after each
+    batch with the number of habits processed and logs created so far. Returns the number of logs created.
+    '''
+    first, last = datetime.combine(start, time.min), datetime.combine(end, time.min)
+    habits_done = created = 0
+    for batch in habit_batches(batch_size):
+        existing = {(habit_id, day.date()) for habit_id, day in db.session.query(Log.habit_id, Log.date)
+            .filter(Log.habit_id.in_([habit.id for habit in batch]), Log.date >= first, Log.date <= last)}
+        owners = {habit.id: habit.user_id for habit in batch}
+
+        new_logs = [
+            {'user_id': owners[habit_id], 'habit_id': habit_id, 'date': datetime.combine(day, time.min), 'status': False}
+            for habit_id, day in schedule.due_pairs(batch, start, end) if (habit_id, day) not in existing
+        ]
+        if new_logs:
+            db.session.bulk_insert_mappings(Log, new_logs)
+            touch_users({log['user_id'] for log in new_logs})
+        db.session.commit()
+        metrics.inc('logs_materialized_total', len(new_logs))
+
+        habits_done += len(batch)
+        created += len(new_logs)
+        if report:
+            report(habits_done, created)
+    return created
@@ -0,0 +1,150 @@
+'''Versioned schema migrations.
+
+db.create_all() only creates the tables that are missing, it never changes a table that already
+exists. Every change to the schema of an existing database is therefore written as a numbered
+migration below and applied with `flask upgrade-db`. Each migration runs in its own transaction and
+is recorded in the schema_version table, so a database only ever runs the migrations it has not seen.
+
+Migrations must be safe to run on a database that was just built by db.create_all() (which already
+has the latest schema), so they check what exists before changing anything. They must also stay
+frozen: the indexes a migration creates are spelled out in it by name and columns, not read from the
+models, which keep changing after it was written.
+'''
+from collections import defaultdict
+from datetime import datetime
+from sqlalchemy import MetaData, Table, Column, Index, Integer, String, DateTime, and_, func, inspect, select, text
+from web import db
+from .models import User, Habit, Log, Milestone, HabitProgress, HabitHistory
+from .progress import progress_values
+from . import milestones
+
+# kept out of db.metadata so that db.drop_all() never forgets which migrations were applied
+metadata = MetaData()
+schema_version = Table('schema_version', metadata,
+    Column('version', Integer, primary_key=True),
+    Column('description', String(200)),
+    Column('applied_at', DateTime))
+
+MIGRATIONS = []
+
+def migration(version, description):
+    '''Registers a function taking a connection as the migration with the given version'''
+    def register(func):
+        MIGRATIONS.append((version, description, func))
+        return func
+    return register
+
+def create_index(connection, table, name, columns, unique=False, where=None):
+    '''Creates the index name on the columns of table unless the table already has an index with that name.
+
+    where is the condition of a partial index, as SQL for each dialect that has them; elsewhere the index is on every row.
+    '''
+    if name in {ix['name'] for ix in inspect(connection).get_indexes(table)}:
+        return
+    frozen = Table(table, MetaData(), *[Column(column) for column in columns]) # only the names are needed
+    options = {'{}_where'.format(dialect): text(condition) for dialect, condition in (where or {}).items()}
+    Index(name, *frozen.c, unique=unique, **options).create(connection)
+
+def add_column(connection, column):
+    '''Adds column to its table unless the table already has it'''
+    table = column.table.name
+    if column.name in {c['name'] for c in inspect(connection).get_columns(table)}:
+        return
+    quote = connection.dialect.identifier_preparer.quote
+    ddl = 'ALTER TABLE {} ADD COLUMN {} {}'.format(quote(table), quote(column.name), column.type.compile(connection.dialect))
+    if column.server_default is not None:
+        ddl += " DEFAULT '{}'".format(column.server_default.arg)
+    if not column.nullable:
+        ddl += ' NOT NULL'
+    connection.execute(ddl)
+
+@migration(1, 'Composite indexes for the habit, log and milestone queries')
+def add_composite_indexes(connection):
+    create_index(connection, 'habit', 'ix_habit_user_active_created', ['user_id', 'active', 'date_created'])
+    create_index(connection, 'log', 'ix_log_habit_date', ['habit_id', 'date'])
+    create_index(connection, 'log', 'ix_log_user_habit_status', ['user_id', 'habit_id', 'status'])
+    create_index(connection, 'milestone', 'ix_milestone_user_habit_type', ['user_id', 'habit_id', 'type'])
+
+@migration(2, 'Progress records with completion counts and streaks for every habit')
+def add_habit_progress(connection):
+    HabitProgress.__table__.create(connection, checkfirst=True)
+
+    habit, log, progress = Habit.__table__, Log.__table__, HabitProgress.__table__
+    missing = select([habit.c.id, habit.c.user_id, habit.c.frequency]).where(~habit.c.id.in_(select([progress.c.habit_id]))).order_by(habit.c.id)
+    while True:
+        batch = connection.execute(missing.limit(500)).fetchall() # the inserts below shrink the result
+        if not batch:
+            break
+        dates = defaultdict(list)
+        completed = select([log.c.habit_id, log.c.date]).where(log.c.habit_id.in_([row.id for row in batch])).where(log.c.status == True).order_by(log.c.habit_id, log.c.date)
+        for habit_id, day in connection.execute(completed):
+            dates[habit_id].append(day.date())
+        connection.execute(progress.insert(), [
+            dict(progress_values(dates[row.id], row.frequency), habit_id=row.id, user_id=row.user_id) for row in batch
+        ])
+
+@migration(3, 'Index on the logs of a user by day, for the dashboard counts')
+def add_log_user_date_index(connection):
+    create_index(connection, 'log', 'ix_log_user_date_status', ['user_id', 'date', 'status'])
+
+@migration(4, 'Data version of the users, for ETags')
+def add_user_data_version(connection):
+    add_column(connection, User.__table__.c.data_version)
+
+@migration(5, 'Completion history of the habits as bitmaps')
+def add_habit_history(connection):
+    HabitHistory.__table__.create(connection, checkfirst=True) # filled by `flask build-history`
+
+@migration(6, 'Index on the milestones of a user by deadline, for the reminders')
+def add_milestone_deadline_index(connection):
+    create_index(connection, 'milestone', 'ix_milestone_user_deadline', ['user_id', 'deadline', 'id'])
+
+@migration(7, 'Kind and threshold of the default milestones')
+def add_milestone_threshold(connection):
+    add_column(connection, Milestone.__table__.c.threshold)
+    table = Milestone.__table__
+    for kind, n, text in milestones.TEMPLATES: # the rules were only written in the text
+        connection.execute(table.update().where(and_(table.c.type == kind, table.c.text == text, table.c.threshold == None)).values(threshold=n))
+
+@migration(8, 'Default milestones computed from templates, only the reached ones stored')
+def collapse_default_milestones(connection):
+    table = Milestone.__table__
+    connection.execute(table.delete().where(and_(table.c.threshold != None, table.c.complete.isnot(True))))
+    for statement in milestones.completion_inserts(connection.dialect.name): # reached but never saved as completed before
+        connection.execute(statement)
+
+@migration(9, 'Unique index on the default milestones of a habit')
+def add_milestone_rule_index(connection):
+    table = Milestone.__table__
+    first = select([func.min(table.c.id)]).where(table.c.threshold != None).group_by(table.c.habit_id, table.c.type, table.c.threshold)
+    connection.execute(table.delete().where(and_(table.c.threshold != None, ~table.c.id.in_(first)))) # duplicates stored by concurrent check-offs
+    create_index(connection, 'milestone', 'ix_milestone_habit_rule', ['habit_id', 'type', 'threshold'], unique=True)
+
+@migration(10, 'Partial index on the deadlines of the unfinished milestones, for the reminders')
+def add_milestone_due_index(connection):
+    create_index(connection, 'milestone', 'ix_milestone_due', ['deadline', 'user_id'],
+        where={'sqlite': 'complete IS NOT 1', 'postgresql': 'complete IS NOT true'})
+
+def applied_versions(connection):
+    schema_version.create(connection, checkfirst=True)
+    return {version for version, in connection.execute(select([schema_version.c.version]))}
+
+def current_version():
+    '''Returns the highest migration version applied to the database (0 if none)'''
+    with db.engine.begin() as connection:
+        return max(applied_versions(connection), default=0)
+
+def upgrade(target=None):
+    '''Applies the missing migrations up to target (default: all of them) and returns their versions'''
+    with db.engine.begin() as connection:
+        applied = applied_versions(connection)
+
+    done = []
+    for version, description, func in sorted(MIGRATIONS, key=lambda m: m[0]):
+        if version in applied or (target is not None and version > target):
+            continue
+        with db.engine.begin() as connection: # one transaction per migration
+            func(connection)
+            connection.execute(schema_version.insert().values(version=version, description=description, applied_at=datetime.utcnow()))
+        done.append(version)
+    return done
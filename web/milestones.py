@@ -0,0 +1,123 @@
+'''Milestones completed by the progress of their habit.
+
+Every habit has the same default milestones, so they are not stored: they are templates, a kind and
+a threshold, computed for each habit from its HabitProgress record. ('count', 7) is reached once
+the habit was checked off 7 times and ('streak', 7) once it was checked off 7 times in a row. Only
+the milestones a user wrote (the custom ones, without a threshold) and the default milestones
+reached so far are rows of the milestone table; a reached one is inserted as completed, and stays
+completed even if check-offs are undone later.
+
+Milestones are evaluated against the progress records in the same transaction as the check-off
+that changed them. After an import or a backfill, complete_reached() inserts the milestones reached
+by every habit of the database, or of a user, with a single INSERT ... SELECT. A default milestone is
+stored at most once per habit, which the unique index ix_milestone_habit_rule enforces: the check-off
+locks the progress records of its habits (see web/progress.py), and the inserts skip the milestones
+that a concurrent transaction, e.g. `flask evaluate-milestones`, stored in the meantime.
+'''
+from sqlalchemy import and_, exists, literal, or_, select, union_all
+from sqlalchemy.dialects import postgresql
+from web import db, metrics, user_cache
+from .models import User, Habit, Milestone, HabitProgress
+
+THRESHOLDS = (3, 7, 14, 30, 60) # of the milestones every habit has
+
+# kind -> (column of HabitProgress compared with the threshold, text of the default milestones)
+KINDS = {
+    'count': (HabitProgress.total_completions, 'Complete the habit {} times!'),
+    'streak': (HabitProgress.longest_streak, 'Complete the habit {} consecutive times!'),
+}
+
+TEMPLATES = [(kind, n, text.format(n)) for kind, (_, text) in KINDS.items() for n in THRESHOLDS]
+
+def reached(kind, threshold, progress):
+    '''Whether progress (a HabitProgress, a dict of its values or None) reached the threshold'''
+    if progress is None:
+        return False
+    column = KINDS[kind][0]
+    value = progress[column.key] if isinstance(progress, dict) else getattr(progress, column.key)
+    return (value or 0) >= threshold
+
+def habit_milestones(habit, stored, progress):
+    '''The milestones of the habit to display: the stored custom ones, then every default one.
+
+    stored are the milestone rows of the habit. The default milestones not stored yet are new,
+    unsaved Milestone objects, completed if progress reached them.
+    '''
+    achieved = {(m.type, m.threshold): m for m in stored if m.threshold is not None}
+    return [m for m in stored if m.threshold is None] + [achieved.get((kind, n)) or
+        Milestone(user_id=habit.user_id, habit_id=habit.id, type=kind, threshold=n, text=text, complete=reached(kind, n, progress))
+        for kind, n, text in TEMPLATES]
+
+def insert_new(dialect):
+    '''INSERT into the milestone table that skips the rows violating ix_milestone_habit_rule instead of failing'''
+    table = Milestone.__table__
+    if dialect == 'postgresql':
+        return postgresql.insert(table).on_conflict_do_nothing()
+    if dialect == 'sqlite':
+        return table.insert().prefix_with('OR IGNORE')
+    if dialect == 'mysql':
+        return table.insert().prefix_with('IGNORE')
+    return table.insert()
+
+def evaluate(habit_ids):
+    '''Inserts the default milestones of the habits that their progress reached, without committing.
+
+    Returns (milestone, habit title) for every milestone completed, by habit and threshold. The
+    milestones are inserted with Core statements, so the ones returned are not in the session.
+    '''
+    if not habit_ids:
+        return []
+    rows = (db.session.query(HabitProgress, Habit.title)
+        .join(Habit, Habit.id == HabitProgress.habit_id)
+        .filter(HabitProgress.habit_id.in_(habit_ids))
+        .order_by(HabitProgress.habit_id))
+    candidates = [(progress, title, kind, n, text) for progress, title in rows for kind, n, text in TEMPLATES if reached(kind, n, progress)]
+    if not candidates: # most check-offs, skips the query of the milestones
+        return []
+    stored = set(db.session.query(Milestone.habit_id, Milestone.type, Milestone.threshold)
+        .filter(Milestone.habit_id.in_(habit_ids), Milestone.threshold != None))
+    insert = insert_new(db.engine.dialect.name)
+    completed = []
+    for progress, title, kind, n, text in candidates:
+        if (progress.habit_id, kind, n) not in stored:
+            values = dict(user_id=progress.user_id, habit_id=progress.habit_id, type=kind, threshold=n, text=text, complete=True)
+            if db.session.execute(insert.values(**values)).rowcount: # 0 if another transaction just stored it
+                completed.append((Milestone(**values), title))
+                metrics.inc('milestones_completed_total', type=kind)
+    return completed
+
+def missing_milestones(user_id=None):
+    '''SELECT of the default milestones (of the user if given) that the progress of their habit reached but that are not stored'''
+    template = union_all(*[select([literal(kind).label('type'), literal(n).label('threshold'), literal(text).label('text')])
+        for kind, n, text in TEMPLATES]).alias('template')
+    progress = HabitProgress.__table__
+    stored = Milestone.__table__.alias('stored')
+    query = (select([progress.c.habit_id, progress.c.user_id, template.c.type, template.c.threshold, template.c.text, literal(True).label('complete')])
+        .select_from(progress.join(template, or_(*[and_(template.c.type == kind, progress.c[column.key] >= template.c.threshold)
+            for kind, (column, _) in KINDS.items()])))
+        .where(~exists().where(and_(stored.c.habit_id == progress.c.habit_id, stored.c.type == template.c.type, stored.c.threshold == template.c.threshold))))
+    if user_id is not None:
+        query = query.where(progress.c.user_id == user_id)
+    return query
+
+def completion_inserts(dialect, user_id=None):
+    '''Statements bumping the data version of the owners of the missing milestones, then inserting these milestones'''
+    missing = missing_milestones(user_id)
+    owners = select([missing.alias().c.user_id])
+    return [User.__table__.update().where(User.id.in_(owners)).values(data_version=User.data_version + 1),
+        insert_new(dialect).from_select(['habit_id', 'user_id', 'type', 'threshold', 'text', 'complete'], missing)]
+
+def complete_reached(user_id=None):
+    '''Inserts every default milestone (of the user if given) that its habit's progress reached and that is not stored yet, without committing.
+
+    The owners' data versions are bumped by the same means, and their cached users forgotten: the user's
+    only, or all of them after a backfill of every user. Backfills are not counted in the
+    milestones_completed_total metric. Returns the number of milestones completed.
+    '''
+    db.session.flush() # progress records still pending in the session
+    *_, completed = [db.session.execute(statement) for statement in completion_inserts(db.engine.dialect.name, user_id)]
+    if user_id is None:
+        user_cache.clear()
+    else:
+        user_cache.delete(user_id)
+    return completed.rowcount
@@ -10,6 +10,7 @@ class User(UserMixin,db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(200), unique=True)
     password = db.Column(db.String(200))
+    data_version = db.Column(db.Integer, default=0, server_default='0', nullable=False) # bumped by every write to the user's data (ETags)
 
     def __repr__(self):
         return "<User(id={}, username={}, password={})>".format(
@@ -17,9 +18,21 @@ class User(UserMixin,db.Model):
             self.username,
             self.password)
 
+def touch_users(user_ids):
+    '''Bumps the data version of the users, in the current transaction, after their habits, logs or milestones changed'''
+    from web import user_cache
+    user_ids = list(user_ids)
+    if user_ids:
+        User.query.filter(User.id.in_(user_ids)).update({User.data_version: User.data_version + 1}, synchronize_session=False)
+        for user_id in user_ids: # bulk updates skip the after_update event
+            user_cache.delete(user_id)
+
 class Habit(db.Model):
 
     __tablename__ = 'habit'
+    __table_args__ = (
+        db.Index('ix_habit_user_active_created', 'user_id', 'active', 'date_created'), # active habits of a user (dashboard, sidebar)
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
@@ -44,6 +57,11 @@ class Habit(db.Model):
 class Log(db.Model):
 
     __tablename__ = 'log'
+    __table_args__ = (
+        db.Index('ix_log_habit_date', 'habit_id', 'date'), # the log of a habit on a given day
+        db.Index('ix_log_user_habit_status', 'user_id', 'habit_id', 'status'), # completed logs of a habit (milestones)
+        db.Index('ix_log_user_date_status', 'user_id', 'date', 'status'), # a user's logs on a given day (dashboard counts)
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     habit_id = db.Column(db.Integer, db.ForeignKey('habit.id'))
@@ -59,9 +77,54 @@ class Log(db.Model):
             self.date,
             self.status)
 
+class HabitProgress(db.Model):
+
+    __tablename__ = 'habit_progress'
+
+    # running totals kept up to date by check-off and undo, so milestones don't have to rescan the logs
+    habit_id = db.Column(db.Integer, db.ForeignKey('habit.id'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    total_completions = db.Column(db.Integer, default=0, nullable=False)
+    current_streak = db.Column(db.Integer, default=0, nullable=False) # streak ending on last_completed
+    longest_streak = db.Column(db.Integer, default=0, nullable=False)
+    last_completed = db.Column(db.Date)
+
+    def __repr__(self):
+        return "<HabitProgress(habit_id={}, user_id={}, total_completions={}, current_streak={}, longest_streak={}, last_completed={})>".format(
+            self.habit_id,
+            self.user_id,
+            self.total_completions,
+            self.current_streak,
+            self.longest_streak,
+            self.last_completed)
+
+class HabitHistory(db.Model):
+
+    __tablename__ = 'habit_history'
+
+    # the completions of a habit as one bit per day, one row per year counted from the day it was created (see web/history.py)
+    habit_id = db.Column(db.Integer, db.ForeignKey('habit.id'), primary_key=True)
+    year = db.Column(db.Integer, primary_key=True, autoincrement=False) # 0 for the first 365 days from date_created
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    bits = db.Column(db.LargeBinary, nullable=False) # bit i of the little-endian bytes is day 365 * year + i
+
+    def __repr__(self):
+        return "<HabitHistory(habit_id={}, year={}, user_id={}, completions={})>".format(
+            self.habit_id,
+            self.year,
+            self.user_id,
+            bin(int.from_bytes(self.bits, 'little')).count('1'))
+
 class Milestone(db.Model):
 
     __tablename__ = 'milestone'
+    __table_args__ = (
+        db.Index('ix_milestone_user_habit_type', 'user_id', 'habit_id', 'type'), # milestones of a habit by type
+        db.Index('ix_milestone_user_deadline', 'user_id', 'deadline', 'id'), # milestones due, user by user (reminders)
+        db.Index('ix_milestone_due', 'deadline', 'user_id', # users with unfinished milestones due in a window (reminders)
+            sqlite_where=db.text('complete IS NOT 1'), postgresql_where=db.text('complete IS NOT true')),
+        db.Index('ix_milestone_habit_rule', 'habit_id', 'type', 'threshold', unique=True), # a default milestone is stored once per habit
+    )
 
     id = db.Column(db.Integer, primary_key=True)
 
@@ -69,7 +132,8 @@ class Milestone(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
 
     text = db.Column(db.String(200), nullable=False)
-    type = db.Column(db.String(200), default='custom')
+    type = db.Column(db.String(200), default='custom') # 'custom', or the kind of rule of a milestone with a threshold
+    threshold = db.Column(db.Integer) # e.g. 7 for a 'count' milestone reached after 7 check-offs, see web/milestones.py
 
     deadline = db.Column(db.Date) # deadline is optional
     complete = db.Column(db.Boolean, default=False)
@@ -86,5 +150,3 @@ class Milestone(db.Model):
                 self.type,
                 self.deadline,
                 self.complete)
-
-db.create_all()
@@ -0,0 +1,255 @@
+'''Metrics in the Prometheus text format, served on /metrics.
+
+Requests are counted and timed per endpoint in memory, under a lock, so the cost on the hot path is
+a few dictionary updates. Domain events (logs materialized, check-offs, milestones completed...) are
+counted with metrics.inc() where they happen; the database pool and the cache are read when the
+metrics are collected.
+
+Each worker process has its own numbers. With METRICS_DIR set to a directory shared by the workers,
+every process writes a snapshot of its numbers there at most every METRICS_DUMP_INTERVAL seconds,
+and /metrics adds up the snapshots of all of them, whichever worker answers. Counters of workers that
+exited are kept so totals never go down, while their gauges (e.g. requests in flight) are dropped.
+Snapshot files are named after the pid and the start of their process, so a new worker that gets the
+pid of one that exited writes a file of its own instead of replacing the other's counters. As with
+any counter that only goes up, empty METRICS_DIR when restarting the whole server.
+'''
+import json
+import os
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from threading import Lock
+from flask import current_app, g, has_app_context, request, Response
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0) # seconds
+
+# name -> (type, help) of every metric
+METRICS = {
+    'http_requests_total': ('counter', 'Requests answered, by endpoint, method and status'),
+    'http_request_duration_seconds': ('histogram', 'Time taken to answer requests, by endpoint'),
+    'http_requests_in_flight': ('gauge', 'Requests being answered'),
+    'db_pool_size': ('gauge', 'Connections the database pool keeps open'),
+    'db_pool_checked_out': ('gauge', 'Database connections in use'),
+    'db_pool_overflow': ('gauge', 'Database connections open beyond the pool size'),
+    'cache_requests_total': ('counter', 'Lookups in the page cache, by result (hit or miss)'),
+    'cache_entries': ('gauge', 'Entries in the cache, by cache'),
+    'logs_materialized_total': ('counter', 'Logs created ahead of or on the first view of their day'),
+    'logs_checked_off_total': ('counter', 'Logs checked off'),
+    'logs_unchecked_total': ('counter', 'Logs unchecked'),
+    'habits_created_total': ('counter', 'Habits added'),
+    'milestones_completed_total': ('counter', 'Milestones completed, by type'),
+    'milestone_reminders_total': ('counter', 'Reminders of milestones due soon or overdue sent'),
+}
+
+def labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+def format_labels(key):
+    if not key:
+        return ''
+    escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join('{}="{}"'.format(name, escape(value)) for name, value in key) + '}'
+
+def format_number(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+class Snapshot:
+    '''Numbers of one process: counters and gauges by (name, labels), histograms as [bucket counts..., sum, count]'''
+
+    def __init__(self):
+        self.counters = defaultdict(float)
+        self.gauges = {}
+        self.histograms = {}
+
+    def observe(self, name, key, value):
+        histogram = self.histograms.get((name, key))
+        if histogram is None:
+            histogram = self.histograms[(name, key)] = [0] * (len(BUCKETS) + 1) + [0.0, 0]
+        histogram[bisect_left(BUCKETS, value)] += 1 # the last bucket is +Inf
+        histogram[-2] += value
+        histogram[-1] += 1
+
+    def merge(self, other, gauges=True):
+        for key, value in other.counters.items():
+            self.counters[key] += value
+        if gauges:
+            for key, value in other.gauges.items():
+                self.gauges[key] = self.gauges.get(key, 0) + value
+        for key, values in other.histograms.items():
+            mine = self.histograms.setdefault(key, [0] * len(values))
+            for i, value in enumerate(values):
+                mine[i] += value
+
+    def to_json(self):
+        pack = lambda items: [[name, list(key), value] for (name, key), value in items]
+        return {'pid': os.getpid(), 'counters': pack(self.counters.items()), 'gauges': pack(self.gauges.items()), 'histograms': pack(self.histograms.items())}
+
+    @classmethod
+    def from_json(cls, data):
+        snapshot = cls()
+        unpack = lambda items: {(name, tuple(tuple(pair) for pair in key)): value for name, key, value in items}
+        snapshot.counters.update(unpack(data['counters']))
+        snapshot.gauges = unpack(data['gauges'])
+        snapshot.histograms = unpack(data['histograms'])
+        return snapshot
+
+    def render(self):
+        '''The text exposition format'''
+        samples = defaultdict(list)
+        for (name, key), value in self.counters.items():
+            samples[name].append('{}{} {}'.format(name, format_labels(key), format_number(value)))
+        for (name, key), value in self.gauges.items():
+            samples[name].append('{}{} {}'.format(name, format_labels(key), format_number(value)))
+        for (name, key), values in sorted(self.histograms.items()):
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), values):
+                cumulative += count
+                samples[name].append('{}_bucket{} {}'.format(name, format_labels(key + (('le', str(bound)),)), cumulative))
+            samples[name].append('{}_sum{} {}'.format(name, format_labels(key), format_number(values[-2])))
+            samples[name].append('{}_count{} {}'.format(name, format_labels(key), values[-1]))
+
+        lines = []
+        for name, (kind, help) in METRICS.items():
+            if name in samples:
+                lines += ['# HELP {} {}'.format(name, help), '# TYPE {} {}'.format(name, kind)] + sorted(samples[name])
+        return '\n'.join(lines) + '\n'
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class Recorder:
+    '''The numbers of an app in this process, kept in app.extensions['metrics']'''
+
+    def __init__(self):
+        self.snapshot = Snapshot()
+        self.in_flight = 0
+        self.lock = Lock()
+        self.last_dump = 0.0
+        self.pid = self.started = None
+
+    def filename(self):
+        '''Name of this process' snapshot file, from its pid and when it first wrote it (in ms since the epoch)'''
+        if self.pid != os.getpid(): # the first dump of this process, which may be a fork of the one that made the app
+            self.pid, self.started = os.getpid(), int(time.time() * 1000)
+        return '{}-{}.json'.format(self.pid, self.started)
+
+class Metrics:
+    '''What the app records its metrics with, in the Recorder of the current app'''
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['metrics'] = Recorder()
+        app.before_request(self.start)
+        app.after_request(self.status)
+        app.teardown_request(self.finish)
+        app.add_url_rule('/metrics', 'metrics', self.view)
+
+    @property
+    def recorder(self):
+        return current_app.extensions['metrics']
+
+    def enabled(self):
+        return has_app_context() and current_app.config['METRICS']
+
+    def inc(self, name, value=1, **labels):
+        '''Adds value to the counter name with the given labels'''
+        if self.enabled() and value:
+            recorder = self.recorder
+            with recorder.lock:
+                recorder.snapshot.counters[(name, labels_key(labels))] += value
+
+    def start(self):
+        if self.enabled():
+            g.metrics_start = time.perf_counter()
+            recorder = self.recorder
+            with recorder.lock:
+                recorder.in_flight += 1
+
+    def status(self, response):
+        g.metrics_status = response.status_code
+        return response
+
+    def finish(self, exception=None):
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return
+        elapsed = time.perf_counter() - start
+        endpoint = request.endpoint or 'none'
+        status = g.pop('metrics_status', 500)
+        recorder = self.recorder
+        with recorder.lock:
+            recorder.in_flight -= 1
+            recorder.snapshot.counters[('http_requests_total', (('endpoint', endpoint), ('method', request.method), ('status', str(status))))] += 1
+            recorder.snapshot.observe('http_request_duration_seconds', (('endpoint', endpoint),), elapsed)
+        if current_app.config['METRICS_DIR'] and time.monotonic() - recorder.last_dump > current_app.config['METRICS_DUMP_INTERVAL']:
+            self.dump()
+
+    def collect(self):
+        '''Reads the gauges and the cache counters into this process' snapshot'''
+        from web import db, cache, user_cache
+        pool = db.engine.pool
+        recorder = self.recorder
+        with recorder.lock:
+            gauges = {('http_requests_in_flight', ()): recorder.in_flight}
+            for name, method in (('db_pool_size', 'size'), ('db_pool_checked_out', 'checkedout'), ('db_pool_overflow', 'overflow')):
+                if hasattr(pool, method): # SQLite's pools don't have them all
+                    gauges[(name, ())] = getattr(pool, method)()
+            gauges[('cache_entries', (('cache', 'pages'),))] = len(cache.backend)
+            gauges[('cache_entries', (('cache', 'users'),))] = len(user_cache)
+            recorder.snapshot.gauges = gauges
+            recorder.snapshot.counters[('cache_requests_total', (('result', 'hit'),))] = cache.hits
+            recorder.snapshot.counters[('cache_requests_total', (('result', 'miss'),))] = cache.misses
+
+    def dump(self):
+        '''Writes this process' snapshot to METRICS_DIR'''
+        self.collect()
+        directory = current_app.config['METRICS_DIR']
+        recorder = self.recorder
+        path = os.path.join(directory, recorder.filename())
+        with recorder.lock:
+            data = dict(recorder.snapshot.to_json(), started=recorder.started)
+        with open(path + '.tmp', 'w') as out:
+            json.dump(data, out)
+        os.replace(path + '.tmp', path) # readers never see half a file
+        recorder.last_dump = time.monotonic()
+
+    def gather(self):
+        '''This process' numbers, added to the ones of the other workers if METRICS_DIR is set'''
+        directory = current_app.config['METRICS_DIR']
+        if not directory:
+            self.collect()
+            return self.recorder.snapshot
+        self.dump()
+        snapshots = []
+        for filename in os.listdir(directory):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(directory, filename)) as snapshot:
+                    snapshots.append(json.load(snapshot))
+            except (OSError, ValueError): # removed or being replaced
+                continue
+
+        # of the processes that had the same pid, only the last one started can still be running
+        latest = {}
+        for data in snapshots:
+            latest[data['pid']] = max(latest.get(data['pid'], 0), data.get('started', 0))
+        total = Snapshot()
+        for data in snapshots:
+            running = data.get('started', 0) == latest[data['pid']] and alive(data['pid'])
+            total.merge(Snapshot.from_json(data), gauges=running)
+        return total
+
+    def view(self):
+        if not self.enabled():
+            return Response('Not found', status=404)
+        return Response(self.gather().render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,152 @@
+'''Per-habit progress: how many times a habit was completed and its streaks.
+
+The HabitProgress record of a habit is updated in the same transaction as the check-off (or undo)
+that changes it, so milestones read a single row instead of counting the habit's logs every time.
+The records are read with SELECT ... FOR UPDATE (on the databases that have it), in the order of their
+habit ids, before being written back, so that two check-offs of the same habit at once wait for each
+other instead of losing one, and check-offs of overlapping habits never deadlock.
+'''
+from collections import Counter
+from web import db, metrics
+from .models import Habit, Log, HabitProgress, touch_users
+from . import history, milestones
+from .schedule import period
+from .streaks import compute_streaks
+
+def progress_values(dates, frequency):
+    '''Column values of a progress record for the given sorted completion dates'''
+    streaks = compute_streaks(dates, frequency)
+    return {
+        'total_completions': len(dates),
+        'current_streak': streaks.current,
+        'longest_streak': streaks.longest,
+        'last_completed': dates[-1] if dates else None
+    }
+
+def completed_dates(habit_id):
+    '''Sorted dates of all the completed logs of a habit'''
+    rows = db.session.query(Log.date).filter(Log.habit_id == habit_id, Log.status == True).order_by(Log.date)
+    return [day.date() for day, in rows]
+
+def current_values(habit):
+    '''Column values of the progress record of habit, from its bitmaps or from its logs depending on HISTORY_STORAGE'''
+    if not history.reads_enabled():
+        return progress_values(completed_dates(habit.id), habit.frequency)
+    bitmap = history.load(habit)
+    streaks = bitmap.streaks(habit.frequency)
+    return {
+        'total_completions': bitmap.count(),
+        'current_streak': streaks.current,
+        'longest_streak': streaks.longest,
+        'last_completed': bitmap.last_completed()
+    }
+
+def rebuild(progress, habit):
+    '''Recomputes progress from the habit's completions'''
+    for column, value in current_values(habit).items():
+        setattr(progress, column, value)
+    return progress
+
+def lock_progress(habit_ids):
+    '''Loads the progress records of the habits, locked until the end of the transaction'''
+    if not habit_ids:
+        return []
+    # always in the same order, so that two check-offs of overlapping habits can't each hold a lock the other waits for
+    return (HabitProgress.query.filter(HabitProgress.habit_id.in_(habit_ids)).order_by(HabitProgress.habit_id)
+        .with_for_update().populate_existing().all())
+
+def get_progress(habit):
+    '''Returns the progress record of habit, building it from its logs if it doesn't have one yet'''
+    progress = HabitProgress.query.get(habit.id)
+    if progress is None:
+        progress = rebuild(HabitProgress(habit_id=habit.id, user_id=habit.user_id), habit)
+        db.session.add(progress)
+    return progress
+
+def new_progress(habit):
+    '''Progress record of a habit that was just created'''
+    return HabitProgress(habit_id=habit.id, user_id=habit.user_id, total_completions=0, current_streak=0, longest_streak=0)
+
+def change_frequency(habit, frequency):
+    '''Sets the frequency of habit, rebuilding its progress if it changed since streaks depend on it, without committing.
+
+    The rebuilt streaks can reach milestones, which are stored like on a check-off. Returns them as
+    milestones.evaluate() does.
+    '''
+    if frequency == habit.frequency:
+        return []
+    habit.frequency = frequency
+    locked = lock_progress([habit.id])
+    rebuild(locked[0] if locked else get_progress(habit), habit)
+    return milestones.evaluate([habit.id])
+
+class ConcurrentChange(Exception):
+    '''Raised when logs being updated were changed by another transaction at the same time'''
+
+def set_status(user_id, log_ids, day, status):
+    '''Sets the status of the user's logs on day with the given ids in a single UPDATE.
+
+    Logs that already have that status are left alone. Returns how many logs changed per habit id.
+    The logs are selected FOR UPDATE first, in id order, so that a request submitting the same ids at
+    once waits and then finds them already changed. If the UPDATE still changes another number of logs than
+    selected (on a database without row locks), ConcurrentChange is raised rather than counting
+    logs another request changed, and the caller rolls back.
+    '''
+    rows = (Log.query.with_entities(Log.id, Log.habit_id)
+        .filter(Log.user_id == user_id, Log.id.in_([int(i) for i in log_ids]), Log.date == day, Log.status != status)
+        .order_by(Log.id).with_for_update().all()) # locked in id order, like lock_progress(), against deadlocks
+    if not rows:
+        return Counter()
+    updated = Log.query.filter(Log.id.in_([log_id for log_id, _ in rows]), Log.status != status).update({Log.status: status}, synchronize_session=False)
+    if updated != len(rows):
+        raise ConcurrentChange(f'{len(rows) - updated} of the logs were changed by another request')
+    return Counter(habit_id for _, habit_id in rows)
+
+def record_check_off(habit, day, logs=1):
+    '''Updates the progress of habit after its logs (normally one) on day (a date) were checked off'''
+    progress = HabitProgress.query.get(habit.id) # locked by lock_progress() beforehand
+    if progress is None:
+        return get_progress(habit) # built from the logs, which already include this check-off
+    last = progress.last_completed
+    if logs == 1 and (last is None or day > last): # the common case: checking off the latest day
+        progress.total_completions += 1
+        progress.current_streak = progress.current_streak + 1 if last and (day - last).days == period(habit.frequency) else 1
+        progress.longest_streak = max(progress.longest_streak, progress.current_streak)
+        progress.last_completed = day
+    else: # checking off an earlier day can join two streaks, so start over from the logs
+        rebuild(progress, habit)
+    return progress
+
+def record_undo(habit):
+    '''Updates the progress of habit after one of its logs was unchecked'''
+    return rebuild(get_progress(habit), habit)
+
+def check_off(user_id, log_ids, day):
+    '''Checks off the user's logs on day (a datetime) and updates the progress of their habits, without committing.
+
+    Returns the ids of the habits that had a log checked off.
+    '''
+    changed = set_status(user_id, log_ids, day, True)
+    records = lock_progress(list(changed)) # kept in the session's identity map while referenced
+    for habit in Habit.query.filter(Habit.id.in_(changed)):
+        if history.writes_enabled():
+            history.record(habit, day, True)
+        record_check_off(habit, day.date(), changed[habit.id])
+    touch_users([user_id] if changed else [])
+    metrics.inc('logs_checked_off_total', sum(changed.values()))
+    return list(changed)
+
+def undo(user_id, log_ids, day):
+    '''Unchecks the user's logs on day (a datetime) and updates the progress of their habits, without committing.
+
+    Returns how many logs were unchecked per habit id.
+    '''
+    changed = set_status(user_id, log_ids, day, False)
+    records = lock_progress(list(changed))
+    for habit in Habit.query.filter(Habit.id.in_(changed)):
+        if history.writes_enabled():
+            history.record(habit, day, False)
+        record_undo(habit)
+    touch_users([user_id] if changed else [])
+    metrics.inc('logs_unchecked_total', sum(changed.values()))
+    return changed
@@ -0,0 +1,116 @@
+'''Reminders of the milestones whose deadline is near or past, sent as one digest per user.
+
+`flask send-reminders` scans the unfinished milestones of active habits due in a window, for all
+users at once, batch_size users at a time. The users of a batch are the next ones, by id after the
+last user of the previous batch, with an unfinished milestone in the window: a range scan of the
+partial index ix_milestone_due, on the deadlines of the unfinished milestones only, so the job reads
+the window instead of every milestone of the table. Their milestones are then read in (user, deadline,
+id) order with a search of ix_milestone_user_deadline per user, without sorting. Only a batch is in
+memory at a time however many milestones there are, and every user's milestones are in one batch,
+which makes one digest.
+
+Digests go to a sink chosen with the REMINDER_SINK setting:
+    'file'  (default) one JSON line per digest appended to REMINDER_FILE
+    'null'  digests are dropped, e.g. to time the scan
+    'package.module:factory' any callable taking the app config and returning an object with the
+            send(digest) and close() methods of FileSink, e.g. to send emails
+'''
+import json
+from collections import namedtuple
+from datetime import date
+from importlib import import_module
+from itertools import groupby
+from sqlalchemy import func
+from web import db, metrics
+from .models import User, Habit, Milestone
+
+Reminder = namedtuple('Reminder', 'milestone_id habit_id habit_title text deadline overdue')
+Digest = namedtuple('Digest', 'user_id username reminders')
+
+class FileSink:
+    '''Appends every digest to a file as a line of JSON'''
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def send(self, digest):
+        if self.file is None:
+            self.file = open(self.path, 'a')
+        reminders = [dict(reminder._asdict(), deadline=reminder.deadline.isoformat()) for reminder in digest.reminders]
+        self.file.write(json.dumps({'user_id': digest.user_id, 'username': digest.username, 'reminders': reminders}) + '\n')
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+class NullSink:
+    '''Drops every digest'''
+
+    def send(self, digest):
+        pass
+
+    def close(self):
+        pass
+
+def make_sink(config):
+    name = config.get('REMINDER_SINK', 'file')
+    if name == 'file':
+        return FileSink(config.get('REMINDER_FILE', 'reminders.ndjson'))
+    if name == 'null':
+        return NullSink()
+    module, factory = name.split(':')
+    return getattr(import_module(module), factory)(config)
+
+def due_rows(start, end, batch_size):
+    '''Yields the unfinished milestones of active habits with a deadline from start (None for no limit) to end, by user, deadline and id.
+
+    Every batch of batch_size users takes two queries: one counting them and finding the last one, and one for their milestones.
+    '''
+    due = [Milestone.deadline <= end, Milestone.complete.isnot(True)] # the condition of ix_milestone_due, for it to be used
+    if start is not None:
+        due.append(Milestone.deadline >= start)
+    users = db.session.query(Milestone.user_id).filter(*due).distinct().order_by(Milestone.user_id)
+    rows = (db.session.query(Milestone.user_id, Milestone.deadline, Milestone.id, Milestone.habit_id, Milestone.text, Habit.title, User.username)
+        .join(Habit, Habit.id == Milestone.habit_id)
+        .join(User, User.id == Milestone.user_id)
+        .filter(*due)
+        .filter(Habit.active == True)
+        .order_by(Milestone.user_id, Milestone.deadline, Milestone.id))
+    last = None
+    while True:
+        batch = (users if last is None else users.filter(Milestone.user_id > last)).limit(batch_size).subquery()
+        count, last = db.session.query(func.count(), func.max(batch.c.user_id)).one()
+        if not count:
+            return
+        yield from rows.filter(Milestone.user_id.in_(db.session.query(batch.c.user_id))).all()
+        if count < batch_size:
+            return
+
+def digests(start, end, today=None, batch_size=1000):
+    '''Yields a Digest for every user with milestones due from start to end, their reminders by deadline'''
+    today = today or date.today()
+    for (user_id, username), rows in groupby(due_rows(start, end, batch_size), key=lambda row: (row.user_id, row.username)):
+        yield Digest(user_id, username, [Reminder(row.id, row.habit_id, row.title, row.text, row.deadline, row.deadline < today) for row in rows])
+
+def send_reminders(sink, start, end, today=None, batch_size=1000, report=None):
+    '''Sends the digests of the milestones due from start to end to sink.
+
+    report, if given, is called after every batch_size digests (a batch of users) and at the end with the number of
+    users and reminders sent so far. Returns these two numbers.
+    '''
+    users = reminders = 0
+    try:
+        for digest in digests(start, end, today, batch_size):
+            sink.send(digest)
+            users += 1
+            reminders += len(digest.reminders)
+            if report and users % batch_size == 0:
+                report(users, reminders)
+        if report and users % batch_size:
+            report(users, reminders)
+    finally:
+        sink.close()
+    metrics.inc('milestone_reminders_total', reminders)
+    return users, reminders
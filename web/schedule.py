@@ -0,0 +1,46 @@
+'''When habits are due, i.e. on which days they get a log.
+
+A 'daily' habit is due every day. A 'weekly' ('monthly') habit is due every 7 (30) days counted from
+Habit.last_modified, the day it was created or its frequency last changed, but not on that day itself.
+No habit is due before it was created.
+
+Days are handled as ordinals (day numbers) so that due days over a range are computed arithmetically:
+for each habit the first due day in the range is found with one division and the rest are a stride of
+its period, instead of testing every (habit, day) pair one at a time.
+'''
+from datetime import date, datetime, time
+
+# days between two consecutive logs of a habit
+FREQUENCY_DAYS = {'daily': 1, 'weekly': 7, 'monthly': 30}
+
+def period(frequency):
+    '''Number of days between two consecutive logs of a habit with this frequency'''
+    return FREQUENCY_DAYS.get(frequency, 1)
+
+def as_date(day):
+    return day.date() if isinstance(day, datetime) else day
+
+def first_day(habit):
+    '''Ordinal of the first day the habit can be due: its creation day, or the next one if it was created after midnight'''
+    created = habit.date_created
+    return created.toordinal() + (0 if created.time() == time.min else 1)
+
+def due_ordinals(habit, start, end):
+    '''Range of the ordinals of the days between start and end (included) on which habit is due'''
+    lo = max(start, first_day(habit))
+    if habit.frequency == 'daily':
+        return range(lo, end + 1)
+    if habit.frequency not in ('weekly', 'monthly'): # unknown frequencies never get a log
+        return range(0)
+
+    step = FREQUENCY_DAYS[habit.frequency]
+    anchor = habit.last_modified.toordinal()
+    k = max(1, -(-(lo - anchor) // step)) # smallest number of periods after the anchor that reaches lo
+    return range(anchor + k * step, end + 1, step)
+
+def due_pairs(habits, start, end):
+    '''Returns every (habit id, date) for which one of habits is due between start and end, ordered by date'''
+    start, end = as_date(start).toordinal(), as_date(end).toordinal()
+    pairs = [(ordinal, habit.id) for habit in habits for ordinal in due_ordinals(habit, start, end)]
+    pairs.sort()
+    return [(habit_id, date.fromordinal(ordinal)) for ordinal, habit_id in pairs]
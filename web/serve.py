@@ -1,13 +1,127 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+from flask import Blueprint, current_app, render_template, request, redirect, url_for, session, flash, g
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime, date, timedelta
+from datetime import datetime, date, time, timedelta
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 import os
-from web import app, db, login_manager
-from .models import User, Habit, Log, Milestone
-
-@app.route('/signup', methods=['GET', 'POST'])
+import click
+from sqlalchemy import func
+from collections import namedtuple
+from web import db, login_manager, cache, user_cache, metrics
+from .cache import MISSING
+from .models import User, Habit, Log, Milestone, HabitProgress, HabitHistory, touch_users
+from . import progress, schedule, milestones
+
+# the pages and the `flask` commands, registered on the app by create_app()
+bp = Blueprint('web', __name__, cli_group=None)
+
+def materialize_logs(user_id, day, end=None):
+    '''Creates the missing logs of all the user's active habits that are due on day, or from day to end.
+
+    Uses the same number of queries no matter how many habits the user has: one for the habits,
+    one for the logs that already exist and a single bulk insert for the missing ones.
+    '''
+    end = end or day
+    #find all active habits for the user that were created before or on the last day
+    habits = Habit.query.filter_by(user_id=user_id, active=True).filter(Habit.date_created <= end).all()
+    if not habits: #nothing to materialize
+        return 0
+
+    #(habit id, date) of the logs that already exist
+    logged = set(db.session.query(Log.habit_id, Log.date).filter(Log.user_id == user_id, Log.date >= day, Log.date <= end))
+
+    new_logs = []
+    for habit_id, due in schedule.due_pairs(habits, day, end):
+        due = datetime.combine(due, time.min)
+        if (habit_id, due) not in logged:
+            new_logs.append({'user_id': user_id, 'habit_id': habit_id, 'date': due, 'status': False})
+
+    if new_logs:
+        db.session.bulk_insert_mappings(Log, new_logs)
+        touch_users([user_id])
+        db.session.commit() # one transaction for all the new logs
+        metrics.inc('logs_materialized_total', len(new_logs))
+    return len(new_logs)
+
+def create_habit(user_id, title, description, frequency):
+    '''Adds a new habit for the user, with its log for today and its progress record, to the session'''
+    #adds a habit
+    habit = Habit(
+        user_id=user_id,
+        title=title,
+        description=description,
+        frequency=frequency,
+        date_created=datetime.today(),
+        active=True
+    )
+
+    db.session.add(habit)
+    db.session.flush() #staging
+
+    #adds a log with the current habit's id
+    log = Log(
+        user_id=user_id,
+        habit_id=habit.id,
+        date=date.today()
+    )
+
+    db.session.add(log)
+    db.session.add(progress.new_progress(habit))
+    metrics.inc('habits_created_total')
+    return habit
+
+def delete_habit(habit):
+    '''Hard deletes the habit with its logs, milestones, progress and history'''
+    Log.query.filter_by(habit_id=habit.id).delete()
+    HabitHistory.query.filter_by(habit_id=habit.id).delete()
+    Milestone.query.filter_by(habit_id=habit.id).delete()
+    HabitProgress.query.filter_by(habit_id=habit.id).delete()
+    db.session.delete(habit)
+
+def log_counts(user_id, day):
+    '''Returns how many of the user's logs of active habits on day are completed and how many are still to do, with a single GROUP BY query'''
+    rows = (db.session.query(Log.status, func.count(Log.id)).join(Habit, Habit.id == Log.habit_id)
+        .filter(Log.user_id == user_id, Log.date == day, Habit.active == True).group_by(Log.status))
+    counts = {bool(status): n for status, n in rows}
+    return {'completed': counts.get(True, 0), 'todo': counts.get(False, 0)}
+
+HabitSummary = namedtuple('HabitSummary', ['id', 'title'])
+
+def data_version(user_id, refresh=False):
+    '''The user's data version, read from the database once per request (or again if refresh) and kept in flask.g'''
+    # the logged in user may be a cached copy from before another worker's write, like in api.current_etag()
+    versions = g.setdefault('data_versions', {})
+    if refresh or user_id not in versions:
+        versions[user_id] = db.session.query(User.data_version).filter(User.id == user_id).scalar()
+    return versions[user_id]
+
+def active_habits_summary(user_id):
+    '''Id and title of the user's active habits, for the sidebar.
+
+    Kept for the rest of the request in flask.g and across requests in the cache, under the user's data
+    version: any write to the user's data, whichever process makes it, bumps the version and with it the key.
+    '''
+    summaries = g.setdefault('active_habits_summary', {})
+    if user_id not in summaries:
+        summaries[user_id] = cache.get_or_set(user_id, 'active_habits_summary', data_version(user_id), compute=lambda: [
+            HabitSummary(habit_id, title) for habit_id, title in
+            db.session.query(Habit.id, Habit.title).filter(Habit.user_id == user_id, Habit.active == True).order_by(Habit.id)
+        ])
+    return summaries[user_id]
+
+DashboardHabit = namedtuple('DashboardHabit', ['id', 'title'])
+DashboardLog = namedtuple('DashboardLog', ['id', 'status'])
+
+def dashboard_data(user_id, day):
+    '''The (habit, log) pairs and the counts shown on the dashboard, as plain tuples that can be cached'''
+    #all the user's logs of active habits for the day
+    rows = db.session.query(Habit.id, Habit.title, Log.id, Log.status).filter(Habit.id == Log.habit_id, Log.user_id == user_id, Log.date == day, Habit.active == True)
+    return {
+        'habits': [(DashboardHabit(habit_id, title), DashboardLog(log_id, bool(status))) for habit_id, title, log_id, status in rows],
+        'count': log_counts(user_id, day) #how many habits were completed, how many habits were not
+    }
+
+@bp.route('/signup', methods=['GET', 'POST'])
 def signup():
     if request.method == 'GET':
         return render_template('signup.html')
@@ -17,17 +131,17 @@ def signup():
 
         if username == '': #if username is empty
             flash('Please insert a username.')
-            return redirect(url_for('signup'))
+            return redirect(url_for('web.signup'))
 
         if password == '': #if password is empty
             flash('Please insert a password.')
-            return redirect(url_for('signup'))
+            return redirect(url_for('web.signup'))
 
         user = User.query.filter_by(username=username).first() # check if a user exists
 
         if user: # if a user is found, try again
             flash('Username already exists')
-            return redirect(url_for('signup'))
+            return redirect(url_for('web.signup'))
 
         # create new user with the form data
         try:
@@ -38,15 +152,15 @@ def signup():
         except:
             db.session.rollback()
             flash('Something happened and signup failed. Please try again.')
-            return redirect(url_for('signup'))
+            return redirect(url_for('web.signup'))
 
-        return redirect(url_for('login'))
+        return redirect(url_for('web.login'))
 
-@app.route('/') #redirect home route
+@bp.route('/') #redirect home route
 def home():
-    return redirect(url_for('dashboard', current_date=date.today()))
+    return redirect(url_for('web.dashboard', current_date=date.today()))
 
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'GET':
         return render_template('login.html')
@@ -60,58 +174,36 @@ def login():
         # check if user actually exists
         if not user:
             flash('This username does not exist')
-            return redirect(url_for('login'))
+            return redirect(url_for('web.login'))
         if not check_password_hash(user.password, password):
             flash('Incorrect password')
-            return redirect(url_for('login'))
+            return redirect(url_for('web.login'))
 
         # if the username exists and the password was correct, go to the user's "dashboard" for today
         login_user(user, remember=remember)
-        return redirect(url_for('dashboard', current_date=date.today()))
+        return redirect(url_for('web.dashboard', current_date=date.today()))
 
-@app.route('/dashboard/<current_date>', methods=['GET', 'POST'])
+@bp.route('/dashboard/<current_date>', methods=['GET', 'POST'])
 @login_required
 def dashboard(current_date):
     if request.method == 'GET':
-        #find all active habits for the user that were created before or on current_date
-        habits = Habit.query.filter_by(user_id=current_user.id, active=True).filter(Habit.date_created <= datetime.strptime(current_date, '%Y-%m-%d')).all()
-
-        if habits: #if they are habits
-            for habit in habits:
-                #check if no log exists for the current_date
-                if not Log.query.filter_by(habit_id=habit.id, date=datetime.strptime(current_date, '%Y-%m-%d')).first():
-                    #if no log exists, add a log
-                    try:
-                        gap = (datetime.strptime(current_date, '%Y-%m-%d').date() - habit.last_modified.date()).days #days since the habit was created/frequency changed
-                        weekly_test =  gap > 0 and gap % 7 == 0
-                        monthly_test =  gap > 0 and gap % 30 == 0 # assuming monthly habits occur every 30 days
-
-                        if ((habit.frequency == 'daily')
-                            or (habit.frequency == 'weekly' and weekly_test)
-                            or (habit.frequency == 'monthly' and monthly_test)):# check if a log is needed
-                            log = Log(
-                                user_id=current_user.id,
-                                habit_id=habit.id,
-                                date=datetime.strptime(current_date, '%Y-%m-%d')
-                                )
-                            db.session.add(log)
-                            db.session.commit()
-
-                    except:
-                        db.session.rollback()
-                        flash('Ahh, something happened while loading this page. The page was refreshed.')
-                        return redirect(url_for('dashboard', current_date=date.today()))
-
-        #returns a habit, log iterable of all the logs for the current_date
-        habit_log_iter = db.session.query(Habit, Log).filter(Habit.id == Log.habit_id, Log.date == datetime.strptime(current_date, '%Y-%m-%d'), Habit.active == True).all()
-
-        #how many habits were completed, how many habits were not
-        count = {
-            'completed' : len(db.session.query(Log).filter(Log.date == datetime.strptime(current_date, '%Y-%m-%d'), Log.status==True).all()),
-            'todo' : len(db.session.query(Log).filter(Log.date == datetime.strptime(current_date, '%Y-%m-%d'), Log.status==False).all())
-        }
-
-        return render_template('dashboard.html', user=current_user, date=current_date, habits=habit_log_iter, count=count)
+        day = datetime.strptime(current_date, '%Y-%m-%d')
+        # keyed by the data version, so that a write made by another worker (or a job) is never hidden by this one's cache
+        data = cache.get(current_user.id, 'dashboard', day, data_version(current_user.id))
+        if data is MISSING:
+            created = 0
+            if current_app.config['MATERIALIZE_ON_READ']: # otherwise logs are created ahead of time by `flask generate-logs`
+                try:
+                    created = materialize_logs(current_user.id, day)
+                except:
+                    db.session.rollback()
+                    flash('Ahh, something happened while loading this page. The page was refreshed.')
+                    return redirect(url_for('web.dashboard', current_date=date.today()))
+
+            data = dashboard_data(current_user.id, day)
+            cache.set(current_user.id, 'dashboard', day, data_version(current_user.id, refresh=created > 0), value=data) # new logs bump it
+
+        return render_template('dashboard.html', user=current_user, date=current_date, habits=data['habits'], count=data['count'])
 
     if request.method == 'POST':
         current_date = datetime.strptime(current_date, '%Y-%m-%d')
@@ -123,111 +215,44 @@ def dashboard(current_date):
             current_date = current_date.today()
 
         elif request.form.get('done'): #check off habits for current_date
-            for checked_off_id in request.form.getlist('done'):
-                try:
-                    log = Log.query.filter_by(user_id=current_user.id, id=checked_off_id, date=current_date).first()
-                    log.status = True
-
-                    db.session.add(log)
-                    db.session.commit()
-
-                    try:
-                        cur_habit_id = Log.query.filter_by(id=checked_off_id).first().habit_id
-                        count_log = len(Log.query.filter_by(user_id=current_user.id, habit_id=cur_habit_id, status=True).all())
-
-                        # check the total number of times the habit was logged ("count" milestones)
-                        if count_log in [3,7,14,30,60]:
-                            cur_habit_title = Habit.query.filter_by(id = cur_habit_id).first().title
-                            flash(f'YAY! You checked off the habit "{cur_habit_title}" {count_log} days in total!')
-                            get_milestone = Milestone.query.filter_by(user_id=current_user.id, habit_id=cur_habit_id, type='count', text=f'Complete the habit {count_log} times!').first()
-                            get_milestone.status=True #check off milestone
-                            db.session.commit()
-
-                    except:
-                        db.session.rollback()
-                        flash("Oh no! We couldn't check your progress after your checked off this habit. Uncheck and recheck off?")
-                        return redirect(url_for('dashboard', current_date=datetime.strptime(current_date, '%Y-%m-%d'))) #if fail, stay on the day where the user wanted to check off a habit
-
-                    try:
-                        # check the number of consecutive check-offs for the habit ("streak" milestones)
-                        last_logs = Log.query.filter_by(user_id=current_user.id, habit_id = cur_habit_id, status=True).order_by(Log.date.desc())
-
-                        # get the habit frequency ('daily', 'weekly', or 'monthly')
-                        habit_freq = Habit.query.filter_by(user_id=current_user.id, id=cur_habit_id).first().frequency
-
-                        # dictionary - will serve to convert habit "string" to a number of days
-                        freq_to_days = {'daily': 1, 'weekly':7, 'monthly': 30}
-
-                        # check the last n times the habit should have been checked:
-                        for n in [3,7,14,30,60]:
-                            count_logs = 1 #initialize at 1 since this happens when user logs in the habit
-                            for i in range(1,n):  # starting from the current day
-                                date_to_check = current_date - timedelta(days= i*freq_to_days[habit_freq])  # check the previous logs (depending on frequency, could be previous logs every 1, 7 or 30 days)
-                                if date_to_check in [log.date for log in last_logs]: # if the habit was successfully checked i times ago
-                                    count_logs += 1 # increment the number of consecutive logs
-
-                            if count_logs == n: # if goal streak was achieved, celebrate and mark milestone as completed
-                                flash(f"YOU ROCK! You completed the habit '{cur_habit_title}' {n} times in a row!")
-                                get_streak_milestone = Milestone.query.filter_by(user_id=current_user.id, habit_id=cur_habit_id, type='streak', text=f'Complete the habit {n} consecutive times!').first()
-                                get_streak_milestone.status=True #check off milestone
-                                db.session.commit()
-
-                    except:
-                        flash("Oops! We couldn't keep track of your progress for this habit. Try again?")
-                        return redirect(url_for('dashboard', current_date=datetime.strptime(current_date, '%Y-%m-%d'))) #if fail, stay on the day where the user wanted to check off a habit
-
-
-                except:
-                    db.session.rollback()
-                    flash('Damn, something happened while marking this as done. Please try again.')
-                    return redirect(url_for('dashboard', current_date=date.today()))
-
+            try:
+                # a single UPDATE for all the checked off logs, and the progress of their habits in the same transaction
+                habit_ids = progress.check_off(current_user.id, request.form.getlist('done'), current_date)
+                # then the default milestones that the progress of these habits reached
+                completed = milestones.evaluate(habit_ids)
+                db.session.commit()
+            except:
+                db.session.rollback()
+                flash('Damn, something happened while marking this as done. Please try again.')
+                return redirect(url_for('web.dashboard', current_date=date.today()))
 
+            for milestone, habit_title in completed: # celebrate every milestone reached
+                if milestone.type == 'count':
+                    flash(f'YAY! You checked off the habit "{habit_title}" {milestone.threshold} days in total!')
+                else:
+                    flash(f"YOU ROCK! You completed the habit '{habit_title}' {milestone.threshold} times in a row!")
 
         elif request.form.get('undo-done'): #uncheck habits for current_date
-            for checked_off_id in request.form.getlist('undo-done'):
-                try:
-                    log = Log.query.filter_by(user_id=current_user.id, id=checked_off_id).filter(Log.date.like(current_date)).first()
-                    log.status = False
-                    db.session.add(log)
-                    db.session.commit()
-                except:
-                    db.session.rollback()
-                    flash('Oy vey, something happened while unmarking this. Please try again.')
-                    return redirect(url_for('dashboard', current_date=date.today()))
+            try:
+                progress.undo(current_user.id, request.form.getlist('undo-done'), current_date)
+                db.session.commit()
+            except:
+                db.session.rollback()
+                flash('Oy vey, something happened while unmarking this. Please try again.')
+                return redirect(url_for('web.dashboard', current_date=date.today()))
 
-        return redirect(url_for('dashboard', current_date=datetime.strftime(current_date, '%Y-%m-%d')))
+        return redirect(url_for('web.dashboard', current_date=datetime.strftime(current_date, '%Y-%m-%d')))
 
-@app.route('/add_habit', methods=['GET', 'POST'])
+@bp.route('/add_habit', methods=['GET', 'POST'])
 @login_required
 def add_habit():
     if request.method == 'GET':
-        habits = Habit.query.filter_by(user_id=current_user.id, active=True)
+        habits = active_habits_summary(current_user.id)
         return render_template('add_habit.html', habits=habits, user=current_user)
     elif request.method == 'POST':
 
         try:
-            #adds a habit
-            habit = Habit(
-                user_id=current_user.id,
-                title=request.form.get('title'),
-                description=request.form.get('description'),
-                frequency=request.form.get('frequency'),
-                date_created=datetime.today(),
-                active=True
-            )
-
-            db.session.add(habit)
-            db.session.flush() #staging
-
-            #adds a log with the current habit's id
-            log = Log(
-                user_id=current_user.id,
-                habit_id=habit.id,
-                date=date.today()
-            )
-
-            db.session.add(log)
+            habit = create_habit(current_user.id, request.form.get('title'), request.form.get('description'), request.form.get('frequency'))
 
             # Add a user-defined milestone if user inserted one:
             form = request.form.to_dict()
@@ -239,7 +264,7 @@ def add_habit():
                         deadline = datetime.strptime(form['new_milestone_deadline_' + str(new_milestone_counter)], '%Y-%m-%d')
                     if deadline and deadline.date() < datetime.now().date():  #check if the deadline is not in the past
                         flash('The deadline cannot be in the past!')
-                        return redirect(url_for('add_habit'))
+                        return redirect(url_for('web.add_habit'))
                     else:
                         milestone = Milestone(
                             user_id = current_user.id,
@@ -249,40 +274,31 @@ def add_habit():
                         db.session.add(milestone)
                 new_milestone_counter += 1
 
-            # Automatically create a 'count' milestone when the habit is created
-            # E.g. A 'count' milestone is achieved when the user completed the habit a total number of 3 times
-            for n in [3,7,14,30,60]:  # milestone is achieved when habit is checked 3, 7, 14, 30 and 60 times total
-                iteration_milestone = Milestone(user_id=current_user.id, habit_id=habit.id, type='count', text=f'Complete the habit {n} times!')
-                db.session.add(iteration_milestone)
-
-            # Automatically create "streak" milestones when the habit is created
-            # E.g.streak milestone is achieved when the user completed the habit 3 consecutive days (or whatever frequency was specified)
-            for n in [3,7,14,30,60]:  # milestone is achieved when habit is checked 3, 7, 14, 30 and 60 consecutive times total
-                streak_milestone = Milestone(user_id=current_user.id, habit_id=habit.id, type='streak', text=f'Complete the habit {n} consecutive times!')
-                db.session.add(streak_milestone)
-
+            touch_users([current_user.id]) # the default milestones are not stored until they are reached
             db.session.commit() # end of the transaction
+            cache.invalidate_user(current_user.id)
         except:
             db.session.rollback()
             flash('Woops, there was an error adding your habit. Please try again.')
-            return redirect(url_for('add_habit'))
+            return redirect(url_for('web.add_habit'))
 
-        return redirect(url_for('dashboard', current_date=date.today()))
+        return redirect(url_for('web.dashboard', current_date=date.today()))
 
-@app.route('/habit/<habit_id>')
+@bp.route('/habit/<habit_id>')
 @login_required
 def habit(habit_id):
-    habits = Habit.query.filter_by(user_id=current_user.id, active=True)
+    habits = active_habits_summary(current_user.id)
     habit = Habit.query.filter_by(id=habit_id, user_id=current_user.id).first()
-    milestones = Milestone.query.filter_by(habit_id=habit_id, user_id=current_user.id).all()
-    return render_template('habit.html', habits=habits, habit=habit, milestones=milestones)
+    stored = Milestone.query.filter_by(habit_id=habit_id, user_id=current_user.id).order_by(Milestone.id).all()
+    habit_milestones = milestones.habit_milestones(habit, stored, HabitProgress.query.get(habit_id)) if habit else stored
+    return render_template('habit.html', habits=habits, habit=habit, milestones=habit_milestones)
 
-@app.route('/habit/<habit_id>/edit', methods=['GET', 'POST'])
+@bp.route('/habit/<habit_id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_habit(habit_id):
     habit = Habit.query.filter_by(id=habit_id, user_id=current_user.id).first()
     if request.method == 'GET':
-        habits = Habit.query.filter_by(user_id=current_user.id, active=True)
+        habits = active_habits_summary(current_user.id)
         milestones = Milestone.query.filter_by(habit_id=habit_id, user_id=current_user.id, type='custom').all()
         return render_template('edit_habit.html', habits=habits, milestones = milestones, habit=habit)
     elif request.method == 'POST':
@@ -291,41 +307,45 @@ def edit_habit(habit_id):
             habit.active = False
             try:
                 db.session.add(habit)
+                touch_users([current_user.id])
                 db.session.commit()
+                cache.invalidate_user(current_user.id)
             except:
                 db.session.rollback()
                 flash('Oops, there was an error archiving your habit. Please try again.')
-                return redirect(url_for('habit', habit_id=habit.id))
+                return redirect(url_for('web.habit', habit_id=habit.id))
 
-            return redirect(url_for('habit', habit_id=habit.id))
+            return redirect(url_for('web.habit', habit_id=habit.id))
 
         elif 'unarchive' in form.keys(): #allows a user to set a habit to active, this will allow habit logs to show up on dashboard
             habit.active = True
             try:
                 db.session.add(habit)
+                touch_users([current_user.id])
                 db.session.commit()
+                cache.invalidate_user(current_user.id)
             except:
                 db.session.rollback()
                 flash('We are sorry, there was an error activating your habit. Please try again.')
-                return redirect(url_for('habit', habit_id=habit.id))
+                return redirect(url_for('web.habit', habit_id=habit.id))
 
 
-            return redirect(url_for('habit', habit_id=habit.id))
+            return redirect(url_for('web.habit', habit_id=habit.id))
 
         elif 'delete' in form.keys(): #hard delete the current habit
             #TODO: it is probably a good idea to soft delete habits and not expose hard delete functionality to the user
-            Log.query.filter_by(habit_id=habit.id).delete()
-            Milestone.query.filter_by(habit_id=habit.id).delete()
             try:
-                db.session.delete(habit)
+                delete_habit(habit)
+                touch_users([current_user.id])
                 db.session.commit()
+                cache.invalidate_user(current_user.id)
             except:
                 db.session.rollback()
                 flash('There was an error deleting your habit. Please try again (or is it a sign?).')
-                return redirect(url_for('habit', habit_id=habit.id))
+                return redirect(url_for('web.habit', habit_id=habit.id))
 
 
-            return redirect(url_for('dashboard', current_date=date.today()))
+            return redirect(url_for('web.dashboard', current_date=date.today()))
 
         elif 'title' in form.keys() or 'description' in form.keys() or 'frequency' in form.keys() or 'new_milestone_text_0' in form.keys():
             try:
@@ -334,7 +354,7 @@ def edit_habit(habit_id):
                 if 'description' in form.keys():
                     habit.description = form['description']
                 if 'frequency' in form.keys():
-                    habit.frequency = form['frequency']
+                    progress.change_frequency(habit, form['frequency']) # streaks are counted in periods of the frequency
 
                 habit.last_modified = datetime.today()
 
@@ -358,7 +378,7 @@ def edit_habit(habit_id):
                         deadline = datetime.strptime(form['new_milestone_deadline_' + str(new_milestone_counter)], '%Y-%m-%d')
                     if deadline and deadline.date() < datetime.now().date():  #check if the deadline is not in the past
                         flash('The deadline cannot be in the past!')
-                        return redirect(url_for('add_habit'))
+                        return redirect(url_for('web.add_habit'))
                     else:
                         milestone = Milestone(
                             user_id = current_user.id,
@@ -369,35 +389,160 @@ def edit_habit(habit_id):
                     new_milestone_counter += 1
 
                 db.session.add(habit)
+                touch_users([current_user.id])
                 db.session.commit()
+                cache.invalidate_user(current_user.id)
             except:
                 db.session.rollback()
                 flash('Nope, didn''t work. Redirecting ya')
 
-            return redirect(url_for('habit', habit_id=habit.id))
+            return redirect(url_for('web.habit', habit_id=habit.id))
 
-@app.route('/archive') #page for all the habits that are currently set to inactive
+@bp.route('/archive') #page for all the habits that are currently set to inactive
 @login_required
 def archive():
     habits = Habit.query.filter_by(user_id=current_user.id, active=False).all()
     return render_template("archive.html", habits=habits)
 
-@app.route('/active_habits') #page for all current active habits
+@bp.route('/active_habits') #page for all current active habits
 @login_required
 def active_habits():
     habits = Habit.query.filter_by(user_id=current_user.id, active=True).all()
     return render_template("active_habits.html", habits=habits)
 
-@app.route('/logout')
+@bp.route('/logout')
 @login_required
 def logout():
+    user_cache.delete(current_user.id)
     logout_user()
-    return redirect(url_for('login'))
+    return redirect(url_for('web.login'))
 
-@app.shell_context_processor # Makes all objects available on flask shell for easy testing
-def make_shell_context():
+def make_shell_context(): # Makes all objects available on flask shell for easy testing
     '''Allows to work with all objects directly in flask shell'''
-    return {'db': db, 'User': User, 'Habit': Habit, 'Milestone': Milestone, 'Log': Log}
+    return {'db': db, 'User': User, 'Habit': Habit, 'Milestone': Milestone, 'Log': Log, 'HabitProgress': HabitProgress, 'HabitHistory': HabitHistory}
+
+@bp.cli.command('generate-logs')
+@click.option('--start', type=click.DateTime(formats=['%Y-%m-%d']), default=None, help='First day to generate logs for (default: today).')
+@click.option('--end', type=click.DateTime(formats=['%Y-%m-%d']), default=None, help='Last day to generate logs for (default: start).')
+@click.option('--batch-size', type=int, default=500, show_default=True, help='Number of habits handled per transaction.')
+def generate_logs(start, end, batch_size):
+    '''Creates the due logs of every user's active habits, e.g. nightly for the next day'''
+    from . import jobs
+    start = start.date() if start else date.today()
+    end = end.date() if end else start
+    total = Habit.query.filter_by(active=True).count()
+
+    def report(habits_done, created):
+        click.echo(f'{habits_done}/{total} habits, {created} logs created')
+
+    created = jobs.generate_logs(start, end, batch_size, report)
+    click.echo(f'Done: {created} logs created from {start} to {end}')
+
+@bp.cli.command('send-reminders')
+@click.option('--start', type=click.DateTime(formats=['%Y-%m-%d']), default=None, help='First deadline to remind of (default: today).')
+@click.option('--end', type=click.DateTime(formats=['%Y-%m-%d']), default=None, help='Last deadline to remind of (default: a week after start).')
+@click.option('--overdue', is_flag=True, help='Also remind of every unfinished milestone whose deadline is before start.')
+@click.option('--batch-size', type=int, default=1000, show_default=True, help='Number of users whose milestones are read per query.')
+def send_milestone_reminders(start, end, overdue, batch_size):
+    '''Sends every user a digest of their unfinished milestones due soon, through REMINDER_SINK'''
+    from . import reminders
+    start = start.date() if start else date.today()
+    end = end.date() if end else start + timedelta(days=7)
+
+    def report(users, sent):
+        click.echo(f'{users} users, {sent} reminders')
+
+    users, sent = reminders.send_reminders(reminders.make_sink(current_app.config), None if overdue else start, end, batch_size=batch_size, report=report)
+    click.echo(f'Done: {sent} reminders sent to {users} users')
+
+@bp.cli.command('evaluate-milestones')
+@click.option('--user', 'username', default=None, help='Only evaluate the milestones of this user (default: every user).')
+def evaluate_milestones(username):
+    '''Stores the default milestones that the progress of their habit reached as completed, e.g. after a backfill'''
+    user_id = None
+    if username is not None:
+        user = User.query.filter_by(username=username).first()
+        if user is None:
+            raise click.BadParameter(f'No user named {username}', param_hint='--user')
+        user_id = user.id
+    completed = milestones.complete_reached(user_id)
+    db.session.commit()
+    if user_id is not None:
+        cache.invalidate_user(user_id)
+    click.echo(f'Completed {completed} milestones')
+
+@bp.cli.command('init-db')
+def init_db():
+    '''Creates the tables of a new database and records it as up to date with the migrations'''
+    from . import migrations
+    db.create_all()
+    migrations.upgrade() # only records the versions, the schema is already the latest
+    click.echo(f'Database is at version {migrations.current_version()}')
+
+@bp.cli.command('upgrade-db')
+@click.option('--target', type=int, default=None, help='Stop after this migration version.')
+def upgrade_db(target):
+    '''Applies the schema migrations the database has not seen yet'''
+    from . import migrations
+    done = migrations.upgrade(target)
+    for version in done:
+        click.echo(f'Applied migration {version}')
+    click.echo(f'Database is at version {migrations.current_version()}')
+
+@bp.cli.command('build-history')
+@click.option('--batch-size', type=int, default=500, show_default=True, help='Number of habits handled per transaction.')
+def build_history(batch_size):
+    '''Rebuilds the completion bitmaps of every habit from its logs and compares their size with the logs'''
+    from . import history
+    total = Habit.query.count()
+
+    def report(habits_done, written):
+        click.echo(f'{habits_done}/{total} habits, {written} bitmap rows written')
+
+    history.build(batch_size, report)
+    storage = history.storage_report()
+    click.echo(f'Logs: {storage.log_rows} rows ({storage.completed_logs} completed), {storage.log_disk_bytes or "unknown"} bytes on disk')
+    click.echo(f'Bitmaps: {storage.history_rows} rows, {storage.history_bytes} bytes of bits, {storage.history_disk_bytes or "unknown"} bytes on disk')
+
+@bp.cli.command('export')
+@click.option('--user', 'username', default=None, help='Only export this user (default: every user).')
+@click.option('--format', type=click.Choice(['csv', 'ndjson']), default='ndjson', show_default=True)
+@click.option('--output', default='-', help='File to write to (default: standard output).')
+@click.option('--gzip', 'compress', is_flag=True, help='Compress the output with gzip.')
+def export_data(username, format, output, compress):
+    '''Exports users, habits, logs and milestones without loading them all in memory'''
+    from . import export
+    user_id = None
+    if username is not None:
+        user = User.query.filter_by(username=username).first()
+        if user is None:
+            raise click.BadParameter(f'No user named {username}', param_hint='--user')
+        user_id = user.id
+    with click.open_file(output, 'wb') as out:
+        for chunk in export.export(user_id, format, compress):
+            out.write(chunk)
+
+@bp.cli.command('import')
+@click.argument('file', type=click.File('rb'))
+@click.option('--user', 'username', required=True, help='User the habits are imported for.')
+@click.option('--format', type=click.Choice(['csv', 'ndjson']), default=None, help='Format of the file (default: guessed).')
+def import_data(file, username, format):
+    '''Imports habits with their logs and milestones from a CSV or NDJSON file, gzipped or not'''
+    from . import imports
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        raise click.BadParameter(f'No user named {username}', param_hint='--user')
+    try:
+        summary = imports.import_file(user.id, file, format)
+        db.session.commit()
+    except imports.InvalidImport as e:
+        db.session.rollback()
+        for line, message in e.errors:
+            click.echo(f'line {line}: {message}', err=True)
+        raise click.ClickException('Nothing was imported')
+    cache.invalidate_user(user.id)
+    click.echo(f'Imported {summary.habits} habits, {summary.logs} logs and {summary.milestones} custom milestones')
 
 if __name__ == '__main__':
-    app.run()
+    from web import create_app
+    create_app().run()
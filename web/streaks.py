@@ -0,0 +1,30 @@
+'''Streaks of a habit, computed from the sorted dates on which it was completed.
+
+A streak is a run of completions where each one is exactly one period (1, 7 or 30 days depending on
+the frequency of the habit) after the previous one.
+'''
+from collections import namedtuple
+from .schedule import period
+
+Streaks = namedtuple('Streaks', ['current', 'longest'])
+
+def compute_streaks(dates, frequency, as_of=None):
+    '''Returns the current and the longest streak in a single pass over sorted dates.
+
+    The current streak is the one ending on as_of (0 if the habit was not completed that day),
+    or the one ending on the last date when as_of is not given. Duplicate dates count once.
+    '''
+    step = period(frequency)
+    current = longest = run = 0
+    previous = None
+    for day in dates:
+        if day == previous:
+            continue
+        run = run + 1 if previous is not None and (day - previous).days == step else 1
+        longest = max(longest, run)
+        if day == as_of:
+            current = run
+        previous = day
+    if as_of is None:
+        current = run
+    return Streaks(current, longest)
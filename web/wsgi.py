@@ -0,0 +1,16 @@
+'''Entry point of the production server, a pre-fork WSGI server configured by gunicorn.conf.py:
+    gunicorn -c gunicorn.conf.py web.wsgi:app
+
+Database connections must never be shared between processes: two workers talking over the same
+socket mix up each other's results. The app itself does not connect before it serves a request, but
+any connection opened before the workers are forked (e.g. by the master with preload) is refused by
+the pool of the worker that inherits it and replaced by a new one, without closing the original,
+which still belongs to the process that opened it (see database.refuse_foreign_connections).
+'''
+from sqlalchemy.pool import Pool
+from web import create_app
+from web.database import refuse_foreign_connections
+
+refuse_foreign_connections(Pool) # every pool of the process
+
+app = create_app()